@@ -281,7 +281,8 @@ setup_args = {
                             'netifaces',
                             'setproctitle',
                             'ntplib',
-                            'pyzmq'
+                            'pyzmq',
+                            'msgpack'
                            ],
     'tests_require'      : [],
     'test_suite'         : '%s.tests' % name,
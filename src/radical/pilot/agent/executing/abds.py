@@ -166,10 +166,20 @@ class ABDS(AgentExecutingComponent):
 
     # --------------------------------------------------------------------------
     #
-    def work(self, cu):
+    def work(self, units):
 
-        self.advance(cu, rps.EXECUTING_PENDING, publish=True, push=False)
+        if not isinstance(units, list):
+            units = [units]
 
+        self.advance(units, rps.EXECUTING_PENDING, publish=True, push=False)
+
+        for cu in units:
+            self._handle_unit(cu)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle_unit(self, cu):
 
         try:
             if cu['description']['mpi']:
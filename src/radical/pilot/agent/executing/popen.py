@@ -4,10 +4,11 @@ __license__   = "MIT"
 
 
 import os
+import sys
 import copy
-import stat
-import time
-import Queue
+import json
+import errno
+import signal
 import tempfile
 import threading
 import traceback
@@ -53,19 +54,16 @@ class Popen(AgentExecutingComponent) :
         self.declare_publisher ('command', rpc.AGENT_COMMAND_PUBSUB)
         self.declare_subscriber('command', rpc.AGENT_COMMAND_PUBSUB, self.command_cb)
 
-        self._cancel_lock    = threading.RLock()
-        self._cus_to_cancel  = list()
-        self._cus_to_watch   = list()
-        self._watch_queue    = Queue.Queue ()
+        # the watcher reaps the unit processes as they exit.  We keep track of
+        # the running units by pid (to find the unit for a reaped process), and
+        # by uid (to find the process for a unit to cancel).
+        self._watch_lock    = threading.RLock()
+        self._cus_by_pid    = dict()  # pid -> cu
+        self._cus_by_uid    = dict()  # uid -> cu
+        self._cus_to_cancel = set()   # uids
 
         self._pilot_id = self._cfg['pilot_id']
 
-        # run watcher thread
-        self._terminate = threading.Event()
-        self._watcher   = threading.Thread(target=self._watch, name="Watcher")
-        self._watcher.daemon = True
-        self._watcher.start ()
-
         # The AgentExecutingComponent needs the LaunchMethods to construct
         # commands.
         self._task_launcher = rp.agent.LM.create(
@@ -78,6 +76,51 @@ class Popen(AgentExecutingComponent) :
                 cfg    = self._cfg,
                 logger = self._log)
 
+        # launch scripts are rendered from templates, which are cached per set
+        # of pre- and post-exec commands.  The part of the environment setting
+        # which is the same for all units is also prepared once.
+        self._templates   = dict()
+        self._script_prof = 'RADICAL_PILOT_PROFILE' in os.environ
+        self._env_string  = " RP_SESSION_ID=%s" % self._cfg['session_id'] \
+                          + " RP_PILOT_ID=%s"   % self._cfg['pilot_id']   \
+                          + " RP_AGENT_ID=%s"   % self._cfg['agent_name'] \
+                          + " RP_SPAWNER_ID=%s" % self.cname
+
+        # units can be forked by a small helper process, which is much cheaper
+        # than forking from this (large) process.  The helper also reaps the
+        # units, and reports their exit to the watcher.
+        self._spawner = None
+        if self._cfg.get('popen_spawner'):
+            helper = '%s/agent/radical-pilot-popen-spawner.py' \
+                   % os.path.dirname(rp.__file__)
+            self._spawner = subprocess.Popen([sys.executable, helper],
+                                             stdin     = subprocess.PIPE,
+                                             stdout    = subprocess.PIPE,
+                                             close_fds = True)
+
+        # units forked by this process are started in the process group of an
+        # anchor process, so that the watcher can wait for exactly those
+        # processes: other child processes (like those of the launch methods)
+        # are left to their owners.  The anchor keeps the group alive while no
+        # units are running, and exits when its stdin gets closed.
+        self._anchor = None
+        if not self._spawner:
+            self._anchor = subprocess.Popen(['/bin/cat'],
+                                            stdin      = subprocess.PIPE,
+                                            stdout     = open(os.devnull, 'w'),
+                                            preexec_fn = os.setpgrp,
+                                            close_fds  = True)
+            self._pgid = self._anchor.pid
+
+        # run watcher thread
+        if self._spawner: watch = self._watch_helper
+        else            : watch = self._watch
+
+        self._terminate = threading.Event()
+        self._watcher   = threading.Thread(target=watch, name="Watcher")
+        self._watcher.daemon = True
+        self._watcher.start ()
+
         # communicate successful startup
         self.publish('command', {'cmd' : 'alive',
                                  'arg' : self.cname})
@@ -91,9 +134,20 @@ class Popen(AgentExecutingComponent) :
     #
     def finalize_child(self):
 
-        # terminate watcher thread
+        # terminate watcher thread.  The watcher may be blocked on waiting for
+        # units, so we don't wait for it forever (it is a daemon thread).
         self._terminate.set()
-        self._watcher.join()
+
+        # the spawner helper terminates when its stdin gets closed
+        if self._spawner:
+            self._spawner.stdin.close()
+            self._spawner.wait()
+
+        # so does the anchor, which wakes up the watcher
+        if self._anchor:
+            self._anchor.stdin.close()
+
+        self._watcher.join(timeout=1.0)
 
         # communicate finalization
         self.publish('command', {'cmd' : 'final',
@@ -110,8 +164,13 @@ class Popen(AgentExecutingComponent) :
         if cmd == 'cancel_unit':
 
             self._log.info("cancel unit command (%s)" % arg)
-            with self._cancel_lock:
-                self._cus_to_cancel.append(arg)
+            with self._watch_lock:
+                self._cus_to_cancel.add(arg)
+                cu = self._cus_by_uid.get(arg)
+                if cu:
+                    # the watcher will collect the process and finalize the
+                    # unit
+                    self._kill(cu)
 
 
     # --------------------------------------------------------------------------
@@ -158,10 +217,32 @@ class Popen(AgentExecutingComponent) :
 
     # --------------------------------------------------------------------------
     #
-    def work(self, cu):
+    def work(self, units):
 
-      # self.advance(cu, rps.AGENT_EXECUTING, publish=True, push=False)
-        self.advance(cu, rps.EXECUTING, publish=True, push=False)
+        if not isinstance(units, list):
+            units = [units]
+
+      # self.advance(units, rps.AGENT_EXECUTING, publish=True, push=False)
+        self.advance(units, rps.EXECUTING, publish=True, push=False)
+
+        # prepare all units, then launch them in one batch
+        batch = list()
+        for cu in units:
+            cmdline = self._handle_unit(cu)
+            if cmdline:
+                batch.append([cu, cmdline])
+
+        if batch:
+            self._spawn(batch)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle_unit(self, cu):
+        """
+        Prepare the given unit for launching, and return the command line to
+        launch it (or None if the unit failed).
+        """
 
         try:
             if cu['description']['mpi']:
@@ -177,28 +258,107 @@ class Popen(AgentExecutingComponent) :
             assert(cu['opaque_slots']) # FIXME: no assert, but check
             self._prof.prof('exec', msg='unit launch', uid=cu['_id'])
 
-            # Start a new subprocess to launch the unit
-            self.spawn(launcher=launcher, cu=cu)
+            # Create the launch script for the unit
+            return self._prepare(launcher=launcher, cu=cu)
 
         except Exception as e:
-            # append the startup error to the units stderr.  This is
-            # not completely correct (as this text is not produced
-            # by the unit), but it seems the most intuitive way to
-            # communicate that error to the application/user.
-            self._log.exception("error running CU")
-            cu['stderr'] += "\nPilot cannot start compute unit:\n%s\n%s" \
-                            % (str(e), traceback.format_exc())
+            self._fail_unit(cu, e)
+            return None
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _fail_unit(self, cu, e):
+
+        # append the startup error to the units stderr.  This is
+        # not completely correct (as this text is not produced
+        # by the unit), but it seems the most intuitive way to
+        # communicate that error to the application/user.
+        self._log.exception("error running CU")
+        cu['stderr'] += "\nPilot cannot start compute unit:\n%s\n%s" \
+                        % (str(e), traceback.format_exc())
+
+        with self._watch_lock:
+            self._cus_by_uid.pop(cu['_id'], None)
+            self._cus_to_cancel.discard(cu['_id'])
+
+        # Free the Slots, Flee the Flots, Ree the Frots!
+        if cu['opaque_slots']:
+            self.publish('unschedule', cu)
+
+        self.advance(cu, rps.FAILED, publish=True, push=False)
 
-            # Free the Slots, Flee the Flots, Ree the Frots!
-            if cu['opaque_slots']:
-                self.publish('unschedule', cu)
 
-            self.advance(cu, rps.FAILED, publish=True, push=False)
+    # --------------------------------------------------------------------------
+    #
+    def _get_template(self, descr):
+        """
+        Return the launch script template for the given unit description.  The
+        templates only depend on the pre- and post-exec commands, and are
+        cached.  The per-unit values (workdir, environment and launch command,
+        which depends on the unit's slots) are filled in via '%(key)s'
+        substitution.
+        """
+
+        pre_exec  = descr['pre_exec']  or list()
+        post_exec = descr['post_exec'] or list()
+
+        if not isinstance(pre_exec,  list): pre_exec  = [pre_exec]
+        if not isinstance(post_exec, list): post_exec = [post_exec]
+
+        key = (tuple(pre_exec), tuple(post_exec))
+
+        if key in self._templates:
+            return self._templates[key]
+
+        # user provided strings must not be interpreted as substitutions
+        pre_exec_string  = ''.join(["%s\n" % elem for elem in pre_exec ]).replace('%', '%%')
+        post_exec_string = ''.join(["%s\n" % elem for elem in post_exec]).replace('%', '%%')
+
+        prof = self._script_prof
+        tmpl = '#!/bin/sh\n\n'
+
+        if prof: tmpl += "echo script start_script `%(gtod)s` >> %(workdir)s/PROF\n"
+        tmpl += '\n# Change to working directory for unit\ncd %(workdir)s\n'
+        if prof: tmpl += "echo script after_cd `%(gtod)s` >> %(workdir)s/PROF\n"
+
+        tmpl += '# Environment variables\n%(env)s\n'
+
+        # Before the Big Bang there was nothing
+        if pre_exec:
+            # Note: extra spaces below are for visual alignment
+            tmpl += "# Pre-exec commands\n"
+            if prof: tmpl += "echo pre  start `%(gtod)s` >> %(workdir)s/PROF\n"
+            tmpl += pre_exec_string
+            if prof: tmpl += "echo pre  stop `%(gtod)s` >> %(workdir)s/PROF\n"
+
+        tmpl += "# The command to run\n"
+        tmpl += "%(command)s\n"
+        tmpl += "RETVAL=$?\n"
+        if prof: tmpl += "echo script after_exec `%(gtod)s` >> %(workdir)s/PROF\n"
+
+        # After the universe dies the infrared death, there will be nothing
+        if post_exec:
+            tmpl += "# Post-exec commands\n"
+            if prof: tmpl += "echo post start `%(gtod)s` >> %(workdir)s/PROF\n"
+            tmpl += '%s\n' % post_exec_string
+            if prof: tmpl += "echo post stop  `%(gtod)s` >> %(workdir)s/PROF\n"
+
+        tmpl += "# Exit the script with the return code from the command\n"
+        tmpl += "exit $RETVAL\n"
+
+        self._templates[key] = tmpl
+
+        return tmpl
 
 
     # --------------------------------------------------------------------------
     #
-    def spawn(self, launcher, cu):
+    def _prepare(self, launcher, cu):
+        """
+        Write the launch script for the unit, and return the command line to
+        run it.
+        """
 
         self._prof.prof('spawn', msg='unit spawn', uid=cu['_id'])
 
@@ -211,155 +371,230 @@ class Popen(AgentExecutingComponent) :
         launch_script_name = '%s/radical_pilot_cu_launch_script.sh' % cu_tmpdir
         self._log.debug("Created launch_script: %s", launch_script_name)
 
-        with open(launch_script_name, "w") as launch_script:
-            launch_script.write('#!/bin/sh\n\n')
-
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                launch_script.write("echo script start_script `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-            launch_script.write('\n# Change to working directory for unit\ncd %s\n' % cu_tmpdir)
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                launch_script.write("echo script after_cd `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-
-            # Create string for environment variable setting
-            env_string = 'export'
-            if cu['description']['environment']:
-                for key,val in cu['description']['environment'].iteritems():
-                    env_string += ' %s=%s' % (key, val)
-            env_string += " RP_SESSION_ID=%s" % self._cfg['session_id']
-            env_string += " RP_PILOT_ID=%s"   % self._cfg['pilot_id']
-            env_string += " RP_AGENT_ID=%s"   % self._cfg['agent_name']
-            env_string += " RP_SPAWNER_ID=%s" % self.cname
-            env_string += " RP_UNIT_ID=%s"    % cu['_id']
-          # for key,val in self._cu_environment.iteritems():
-          #     env_string += " %s='%s'"      % (key, val)
-            launch_script.write('# Environment variables\n%s\n' % env_string)
-
-            # Before the Big Bang there was nothing
-            if cu['description']['pre_exec']:
-                pre_exec_string = ''
-                if isinstance(cu['description']['pre_exec'], list):
-                    for elem in cu['description']['pre_exec']:
-                        pre_exec_string += "%s\n" % elem
-                else:
-                    pre_exec_string += "%s\n" % cu['description']['pre_exec']
-                # Note: extra spaces below are for visual alignment
-                launch_script.write("# Pre-exec commands\n")
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write("echo pre  start `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-                launch_script.write(pre_exec_string)
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write("echo pre  stop `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-
-            # The actual command line, constructed per launch-method
-            try:
-                launch_command, hop_cmd = launcher.construct_command(cu, launch_script_name)
-
-                if hop_cmd : cmdline = hop_cmd
-                else       : cmdline = launch_script_name
-
-            except Exception as e:
-                msg = "Error in spawner (%s)" % e
-                self._log.exception(msg)
-                raise RuntimeError(msg)
-
-            launch_script.write("# The command to run\n")
-            launch_script.write("%s\n" % launch_command)
-            launch_script.write("RETVAL=$?\n")
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                launch_script.write("echo script after_exec `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-
-            # After the universe dies the infrared death, there will be nothing
-            if cu['description']['post_exec']:
-                post_exec_string = ''
-                if isinstance(cu['description']['post_exec'], list):
-                    for elem in cu['description']['post_exec']:
-                        post_exec_string += "%s\n" % elem
-                else:
-                    post_exec_string += "%s\n" % cu['description']['post_exec']
-                launch_script.write("# Post-exec commands\n")
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write("echo post start `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-                launch_script.write('%s\n' % post_exec_string)
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write("echo post stop  `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-
-            launch_script.write("# Exit the script with the return code from the command\n")
-            launch_script.write("exit $RETVAL\n")
-
-        # done writing to launch script, get it ready for execution.
-        st = os.stat(launch_script_name)
-        os.chmod(launch_script_name, st.st_mode | stat.S_IEXEC)
+        # The actual command line, constructed per launch-method
+        try:
+            launch_command, hop_cmd = launcher.construct_command(cu, launch_script_name)
+
+            if hop_cmd : cmdline = hop_cmd
+            else       : cmdline = launch_script_name
+
+        except Exception as e:
+            msg = "Error in spawner (%s)" % e
+            self._log.exception(msg)
+            raise RuntimeError(msg)
+
+        # Create string for environment variable setting
+        env_string = 'export'
+        if cu['description']['environment']:
+            for key,val in cu['description']['environment'].iteritems():
+                env_string += ' %s=%s' % (key, val)
+        env_string += self._env_string
+        env_string += " RP_UNIT_ID=%s"    % cu['_id']
+
+        script = self._get_template(cu['description']) \
+                 % {'gtod'    : cu.get('gtod'),
+                    'workdir' : cu_tmpdir,
+                    'env'     : env_string,
+                    'command' : launch_command}
+
+        # write the script in one go, and create it executable right away
+        fd = os.open(launch_script_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0755)
+        try:
+            os.write(fd, script)
+        finally:
+            os.close(fd)
+
         self._prof.prof('command', msg='launch script constructed', uid=cu['_id'])
 
+        return cmdline
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _spawn(self, batch):
+        """
+        Launch the given list of [cu, cmdline] pairs, either directly, or via
+        the spawner helper process.
+        """
+
+        for cu, cmdline in batch:
+            self._log.info("Launching unit %s via %s in %s", cu['_id'], cmdline, cu['workdir'])
+
+        if self._spawner:
+            self._spawn_helper(batch)
+        else:
+            for cu, cmdline in batch:
+                try:
+                    self._spawn_popen(cu, cmdline)
+                except Exception as e:
+                    self._fail_unit(cu, e)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _spawn_helper(self, batch):
+
+        # the helper reports the pids, so we can only register the units by
+        # uid for now.
+        reqs = ''
+        with self._watch_lock:
+            for cu, cmdline in batch:
+                self._cus_by_uid[cu['_id']] = cu
+                reqs += json.dumps({'uid'    : cu['_id'],
+                                    'cmd'    : cmdline,
+                                    'cwd'    : cu['workdir'],
+                                    'stdout' : cu['stdout_file'],
+                                    'stderr' : cu['stderr_file']}) + '\n'
+
+        try:
+            self._spawner.stdin.write(reqs)
+            self._spawner.stdin.flush()
+
+        except Exception as e:
+            for cu, _ in batch:
+                self._fail_unit(cu, e)
+            return
+
+        for cu, _ in batch:
+            self._prof.prof('spawn', msg='spawning passed to spawner', uid=cu['_id'])
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _spawn_popen(self, cu, cmdline):
+
         _stdout_file_h = open(cu['stdout_file'], "w")
         _stderr_file_h = open(cu['stderr_file'], "w")
         self._prof.prof('command', msg='stdout and stderr files created', uid=cu['_id'])
 
-        self._log.info("Launching unit %s via %s in %s", cu['_id'], cmdline, cu_tmpdir)
-
-        proc = subprocess.Popen(args               = cmdline,
-                                bufsize            = 0,
-                                executable         = None,
-                                stdin              = None,
-                                stdout             = _stdout_file_h,
-                                stderr             = _stderr_file_h,
-                                preexec_fn         = None,
-                                close_fds          = True,
-                                shell              = True,
-                                cwd                = cu_tmpdir,
-                              # env                = self._cu_environment,
-                                universal_newlines = False,
-                                startupinfo        = None,
-                                creationflags      = 0)
-
-        self._prof.prof('spawn', msg='spawning passed to popen', uid=cu['_id'])
+        # we hold the watch lock while spawning, so that the watcher can't reap
+        # the process before we know the unit it belongs to
+        try:
+            with self._watch_lock:
+
+                proc = subprocess.Popen(args               = cmdline,
+                                        bufsize            = 0,
+                                        executable         = None,
+                                        stdin              = None,
+                                        stdout             = _stdout_file_h,
+                                        stderr             = _stderr_file_h,
+                                        preexec_fn         = self._join_group,
+                                        close_fds          = True,
+                                        shell              = True,
+                                        cwd                = cu['workdir'],
+                                      # env                = self._cu_environment,
+                                        universal_newlines = False,
+                                        startupinfo        = None,
+                                        creationflags      = 0)
+
+                self._prof.prof('spawn', msg='spawning passed to popen', uid=cu['_id'])
+
+                # we need to keep the Popen object around until the process is
+                # reaped, otherwise subprocess may attempt to reap it
+                cu['proc'] = proc
+                self._started(cu, proc.pid)
+
+        finally:
+            _stdout_file_h.close()
+            _stderr_file_h.close()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _join_group(self):
+
+        # runs in the forked unit process, before exec: move into the process
+        # group the watcher waits for
+        os.setpgid(0, self._pgid)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _started(self, cu, pid):
+        """
+        Register a started unit process.  Must be called with the watch lock
+        held.
+        """
 
         cu['started'] = rpu.timestamp()
-        cu['proc']    = proc
+        cu['pid']     = pid
+
+        self._cus_by_pid[pid]       = cu
+        self._cus_by_uid[cu['_id']] = cu
+
+        # the unit may have been canceled before it got started
+        if cu['_id'] in self._cus_to_cancel:
+            self._kill(cu)
+
+        self._prof.prof('passed', msg="ExecWatcher picked up unit", uid=cu['_id'])
+
 
-        self._watch_queue.put(cu)
+    # --------------------------------------------------------------------------
+    #
+    def _kill(self, cu):
+
+        # units launched via the spawner may not have a pid, yet -- they will
+        # be killed once they are reported as started.
+        if not cu.get('pid'):
+            return
+
+        try:
+            os.kill(cu['pid'], signal.SIGKILL)
+        except OSError as e:
+            # the process may be gone already -- the watcher will pick it up
+            if e.errno != errno.ESRCH:
+                raise
 
 
     # --------------------------------------------------------------------------
     #
     def _watch(self):
+        """
+        Reap unit processes as they exit.  All unit processes run in the process
+        group of the anchor, so a blocking wait4() on that group returns as soon
+        as any unit exits, without sweeping over the running units, and
+        without reaping other child processes of this component.  Once woken
+        up, we also collect all other units which exited in the meantime (with
+        a non-blocking wait4()), and handle them in bulk.  The anchor only
+        exits on finalization, which wakes up the watcher for termination.
+        """
 
         self._prof.prof('run', uid=self._pilot_id)
         try:
 
             while not self._terminate.is_set():
 
-                cus = list()
-
-                try:
+                exited = list()
+                flags  = 0  # block until the first unit exits
 
-                    # we don't want to only wait for one CU -- then we would
-                    # pull CU state too frequently.  OTOH, we also don't want to
-                    # learn about CUs until all slots are filled, because then
-                    # we may not be able to catch finishing CUs in time -- so
-                    # there is a fine balance here.  Balance means 100 (FIXME).
-                  # self._prof.prof('ExecWorker popen watcher pull cu from queue')
-                    MAX_QUEUE_BULKSIZE = 100
-                    while len(cus) < MAX_QUEUE_BULKSIZE :
-                        cus.append (self._watch_queue.get_nowait())
+                while True:
 
-                except Queue.Empty:
+                    try:
+                        pid, status, rusage = os.wait4(-self._pgid, flags)
 
-                    # nothing found -- no problem, see if any CUs finished
-                    pass
+                    except OSError as e:
+                        if e.errno == errno.EINTR:
+                            continue
+                        raise
 
-                # add all cus we found to the watchlist
-                for cu in cus :
+                    if not pid:
+                        break  # no more exited units
 
-                    self._prof.prof('passed', msg="ExecWatcher picked up unit", uid=cu['_id'])
-                    self._cus_to_watch.append (cu)
+                    if pid == self._anchor.pid:
+                        # we reaped the anchor, so its Popen object must not
+                        # attempt to do so
+                        self._anchor.returncode = status
+                        if not self._terminate.is_set():
+                            raise RuntimeError('anchor process died')
+                        break
 
-                # check on the known cus.
-                action = self._check_running()
+                    exited.append([pid, status, {'utime'  : rusage.ru_utime,
+                                                 'stime'  : rusage.ru_stime,
+                                                 'maxrss' : rusage.ru_maxrss}])
+                    flags = os.WNOHANG
 
-                if not action and not cus :
-                    # nothing happened at all!  Zzz for a bit.
-                    time.sleep(self._cfg['db_poll_sleeptime'])
+                if exited:
+                    self._handle_exited(exited)
 
         except Exception as e:
             self._log.exception("Error in ExecWorker watch loop (%s)" % e)
@@ -367,76 +602,137 @@ class Popen(AgentExecutingComponent) :
 
 
     # --------------------------------------------------------------------------
-    # Iterate over all running tasks, check their status, and decide on the
-    # next step.  Also check for a requested cancellation for the tasks.
-    def _check_running(self):
+    #
+    def _watch_helper(self):
+        """
+        Watch the messages from the spawner helper process, which reports
+        started and exited units.  We read whatever is available, and handle
+        the exited units in bulk.
+        """
+
+        self._prof.prof('run', uid=self._pilot_id)
+        try:
+
+            fd  = self._spawner.stdout.fileno()
+            buf = ''
+
+            while not self._terminate.is_set():
+
+                data = os.read(fd, 1024 * 1024)
+                if not data:
+                    if not self._terminate.is_set():
+                        raise RuntimeError('spawner helper died')
+                    break
 
-        action = 0
+                lines = (buf + data).split('\n')
+                buf   = lines.pop()
+                exited = list()
 
-        for cu in self._cus_to_watch:
+                for line in lines:
 
-            # poll subprocess object
-            exit_code = cu['proc'].poll()
-            now       = rpu.timestamp()
+                    msg = json.loads(line)
+                    uid = msg['uid']
 
-            if exit_code is None:
-                # Process is still running
+                    if 'error' in msg:
+                        with self._watch_lock:
+                            cu = self._cus_by_uid.get(uid)
+                        if cu:
+                            self._fail_unit(cu, RuntimeError(msg['error']))
 
-                if cu['_id'] in self._cus_to_cancel:
+                    elif 'status' in msg:
+                        exited.append([msg['pid'], msg['status'], msg])
 
-                    # FIXME: there is a race condition between the state poll
-                    # above and the kill command below.  We probably should pull
-                    # state after kill again?
+                    else:
+                        with self._watch_lock:
+                            cu = self._cus_by_uid.get(uid)
+                            if cu:
+                                self._started(cu, msg['pid'])
 
-                    # We got a request to cancel this cu
-                    action += 1
-                    cu['proc'].kill()
-                    cu['proc'].wait() # make sure proc is collected
+                if exited:
+                    self._handle_exited(exited)
 
-                    with self._cancel_lock:
-                        self._cus_to_cancel.remove(cu['_id'])
+        except Exception as e:
+            self._log.exception("Error in ExecWorker watch loop (%s)" % e)
+            # FIXME: this should signal the ExecWorker for shutdown...
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle_exited(self, exited):
+        """
+        Finalize the units for the given list of [pid, status, rusage] tuples
+        of reaped processes, where rusage is a dict with 'utime', 'stime' and
+        'maxrss'.  Canceled units are moved to CANCELED, all others
+        to output staging.
+        """
+
+        now      = rpu.timestamp()
+        finished = list()
+        canceled = list()
 
-                    self._prof.prof('final', msg="execution canceled", uid=cu['_id'])
+        with self._watch_lock:
 
-                    del(cu['proc'])  # proc is not json serializable
-                    self.publish('unschedule', cu)
-                    self.advance(cu, rps.CANCELED, publish=True, push=False)
+            for pid, status, rusage in exited:
 
-                    # we don't need to watch canceled CUs
-                    self._cus_to_watch.remove(cu)
+                cu = self._cus_by_pid.pop(pid, None)
 
-            else:
-                self._prof.prof('exec', msg='execution complete', uid=cu['_id'])
+                if not cu:
+                    # not a unit process (or it was reaped already)
+                    self._log.debug("reaped unknown process %s", pid)
+                    continue
 
-                # make sure proc is collected
-                cu['proc'].wait()
+                uid = cu['_id']
+                del(self._cus_by_uid[uid])
 
-                # we have a valid return code -- unit is final
-                action += 1
-                self._log.info("Unit %s has return code %s.", cu['_id'], exit_code)
+                # same convention as subprocess: negative signal number for
+                # killed processes
+                if os.WIFSIGNALED(status): exit_code = -os.WTERMSIG(status)
+                else                     : exit_code =  os.WEXITSTATUS(status)
+
+                # we reaped the process, so the Popen object must not attempt to
+                # do so
+                proc = cu.pop('proc', None)  # proc is not json serializable
+                if proc:
+                    proc.returncode = exit_code
+
+                cu['rusage'] = {'utime'  : rusage['utime'],
+                                'stime'  : rusage['stime'],
+                                'maxrss' : rusage['maxrss']}
+
+                if uid in self._cus_to_cancel:
+                    self._cus_to_cancel.remove(uid)
+                    self._prof.prof('final', msg="execution canceled", uid=uid)
+                    canceled.append(cu)
+                    continue
+
+                self._prof.prof('exec', msg='execution complete', uid=uid)
+                self._log.info("Unit %s has return code %s.", uid, exit_code)
 
                 cu['exit_code'] = exit_code
                 cu['finished']  = now
 
-                # Free the Slots, Flee the Flots, Ree the Frots!
-                self._cus_to_watch.remove(cu)
-                del(cu['proc'])  # proc is not json serializable
-                self.publish('unschedule', cu)
-
                 if exit_code != 0:
                     # The unit failed - fail after staging output
-                    self._prof.prof('final', msg="execution failed", uid=cu['_id'])
+                    self._prof.prof('final', msg="execution failed", uid=uid)
                     cu['target_state'] = rps.FAILED
 
                 else:
                     # The unit finished cleanly, see if we need to deal with
                     # output data.  We always move to stageout, even if there are no
                     # directives -- at the very least, we'll upload stdout/stderr
-                    self._prof.prof('final', msg="execution succeeded", uid=cu['_id'])
+                    self._prof.prof('final', msg="execution succeeded", uid=uid)
                     cu['target_state'] = rps.DONE
 
-                self.advance(cu, rps.AGENT_STAGING_OUTPUT_PENDING, publish=True, push=True)
+                finished.append(cu)
+
+        # Free the Slots, Flee the Flots, Ree the Frots!
+        if finished or canceled:
+            self.publish('unschedule', finished + canceled)
+
+        if canceled:
+            self.advance(canceled, rps.CANCELED, publish=True, push=False)
 
-        return action
+        if finished:
+            self.advance(finished, rps.AGENT_STAGING_OUTPUT_PENDING, publish=True, push=True)
 
 
@@ -192,7 +192,18 @@ class Shell(AgentExecutingComponent):
 
     # --------------------------------------------------------------------------
     #
-    def work(self, cu):
+    def work(self, units):
+
+        if not isinstance(units, list):
+            units = [units]
+
+        for cu in units:
+            self._handle_unit(cu)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle_unit(self, cu):
 
         # check that we don't start any units which need cancelling
         if cu['_id'] in self._cus_to_cancel:
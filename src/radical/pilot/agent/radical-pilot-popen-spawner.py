@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# A small spawner helper for the Popen executor.  The executor runs this script
+# as a separate process, and passes spawn requests over its stdin.  The helper
+# forks the unit processes, reaps them as they exit, and reports both events
+# over its stdout.  Forking from this helper is much cheaper than forking from
+# the (large) agent process.  The helper uses only the python standard library,
+# and must not import radical.pilot, to keep its address space small.
+#
+# Messages are JSON encoded, one per line:
+#
+#   request : {"uid": <uid>, "cmd": <cmdline>, "cwd": <dir>,
+#              "stdout": <file>, "stderr": <file>}
+#   started : {"uid": <uid>, "pid": <pid>}
+#   failed  : {"uid": <uid>, "error": <message>}
+#   exited  : {"uid": <uid>, "pid": <pid>, "status": <wait status>,
+#              "utime": <sec>, "stime": <sec>, "maxrss": <kb>}
+#
+# The 'started' message for a unit is always sent before its 'exited' message.
+# The helper terminates when its stdin is closed (without waiting for running
+# units).
+
+import os
+import sys
+import json
+import errno
+import threading
+
+MAXFD   = 1024
+lock    = threading.Lock()   # protects pids and stdout
+pids    = dict()             # pid -> uid
+spawned = threading.Event()  # wakes up the reaper
+
+
+# ------------------------------------------------------------------------------
+#
+def reply(msg):
+
+    # must be called with the lock held
+    sys.stdout.write(json.dumps(msg) + '\n')
+    sys.stdout.flush()
+
+
+# ------------------------------------------------------------------------------
+#
+def spawn(req):
+
+    pid = os.fork()
+
+    if pid:
+        return pid
+
+    # child: redirect I/O and run the command
+    try:
+        os.chdir(req['cwd'])
+        fin  = os.open(os.devnull,     os.O_RDONLY)
+        fout = os.open(req['stdout'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        ferr = os.open(req['stderr'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        os.dup2(fin,  0)
+        os.dup2(fout, 1)
+        os.dup2(ferr, 2)
+        os.closerange(3, MAXFD)
+        os.execv('/bin/sh', ['/bin/sh', '-c', req['cmd']])
+
+    except Exception as e:
+        try:
+            os.write(2, 'cannot spawn %s: %s\n' % (req['uid'], e))
+        except Exception:
+            pass
+
+    finally:
+        os._exit(127)
+
+
+# ------------------------------------------------------------------------------
+#
+def reap():
+
+    while True:
+
+        try:
+            pid, status, rusage = os.wait4(-1, 0)
+
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            # no children -- wait until something gets spawned
+            spawned.wait(1.0)
+            spawned.clear()
+            continue
+
+        with lock:
+            reply({'uid'    : pids.pop(pid, None),
+                   'pid'    : pid,
+                   'status' : status,
+                   'utime'  : rusage.ru_utime,
+                   'stime'  : rusage.ru_stime,
+                   'maxrss' : rusage.ru_maxrss})
+
+
+# ------------------------------------------------------------------------------
+#
+def main():
+
+    reaper = threading.Thread(target=reap, name='Reaper')
+    reaper.daemon = True
+    reaper.start()
+
+    for line in iter(sys.stdin.readline, ''):
+
+        req = json.loads(line)
+
+        # the lock is held across the fork, so that the reaper can't report the
+        # exit of a process before its start
+        with lock:
+            try:
+                pid = spawn(req)
+            except Exception as e:
+                reply({'uid' : req['uid'], 'error' : str(e)})
+                continue
+
+            pids[pid] = req['uid']
+            reply({'uid' : req['uid'], 'pid' : pid})
+
+        spawned.set()
+
+    # stdin got closed -- we don't wait for the reaper thread, but make sure
+    # it does not write anymore
+    with lock:
+        os._exit(0)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    main()
+
+
+# ------------------------------------------------------------------------------
+
@@ -3,6 +3,7 @@ __copyright__ = "Copyright 2013-2016, http://radical.rutgers.edu"
 __license__   = "MIT"
 
 
+import logging
 import threading
 
 import radical.utils as ru
@@ -11,6 +12,8 @@ from ... import utils     as rpu
 from ... import states    as rps
 from ... import constants as rpc
 
+from .wait_pool import WaitPool
+
 
 # ------------------------------------------------------------------------------
 # 'enum' for RPs's pilot scheduler types
@@ -54,7 +57,7 @@ class AgentSchedulingComponent(rpu.Component):
         self.declare_publisher ('state',      rpc.AGENT_STATE_PUBSUB)
         self.declare_subscriber('unschedule', rpc.AGENT_UNSCHEDULE_PUBSUB, self.unschedule_cb)
 
-        # we create a pubsub pair for reschedule trigger
+        # we create a pubsub pair for explicit reschedule triggers
         self.declare_publisher ('reschedule', rpc.AGENT_RESCHEDULE_PUBSUB)
         self.declare_subscriber('reschedule', rpc.AGENT_RESCHEDULE_PUBSUB, self.reschedule_cb)
 
@@ -79,10 +82,21 @@ class AgentSchedulingComponent(rpu.Component):
         self._lrms_cores_per_node = self._cfg['lrms_info']['cores_per_node']
         # FIXME: this information is insufficient for the torus scheduler!
 
-        self._wait_pool = list()            # set of units which wait for the resource
+        # units which wait for the resource.  By default, waiting units are
+        # placed in order of arrival -- backfilling allows smaller units to
+        # overtake larger ones.
+        self._wait_pool = WaitPool(backfill=self._cfg.get('scheduler_backfill', False))
         self._wait_lock = threading.RLock() # look on the above set
         self._slot_lock = threading.RLock() # look for slot allocation/deallocation
 
+        # Released slots are not used right away: we only note that
+        # a reschedule is needed, and sweep over the wait pool once per
+        # reschedule interval, or before scheduling the next batch of units
+        # (whatever comes first).
+        self._reschedule_pending = False
+        self.declare_idle_cb(self._reschedule_idle_cb,
+                             self._cfg.get('reschedule_interval', 0.1))
+
         # configure the scheduler instance
         self._configure()
 
@@ -157,6 +171,16 @@ class AgentSchedulingComponent(rpu.Component):
         raise NotImplementedError("_release_slot() not implemented for Scheduler '%s'." % self._cname)
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _free_cores(self):
+        """
+        Return the number of currently free cores, or None if that is not known.
+        This is used to avoid allocation attempts which can't succeed.
+        """
+        return None
+
+
     # --------------------------------------------------------------------------
     #
     def _try_allocation(self, cu):
@@ -183,11 +207,23 @@ class AgentSchedulingComponent(rpu.Component):
         # got an allocation, go off and launch the process
         self._prof.prof('schedule', msg="try", uid=cu['_id'], timestamp=before_ts)
         self._prof.prof('schedule', msg="allocated", uid=cu['_id'])
-        self._log.info("slot status after allocated  : %s" % self.slot_status ())
+        self._log_slot_status("after allocated  ")
 
         return True
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _log_slot_status(self, msg):
+        """
+        Rendering the slot status can be expensive, so we only do so if it is
+        actually logged.
+        """
+
+        if self._log.isEnabledFor(logging.INFO):
+            self._log.info("slot status %s: %s", msg, self.slot_status())
+
+
     # --------------------------------------------------------------------------
     #
     def reschedule_cb(self, topic, msg):
@@ -196,31 +232,44 @@ class AgentSchedulingComponent(rpu.Component):
         # right now.  This will become interesting once reschedule becomes too
         # expensive.
 
-        cu = msg
+        self._reschedule()
 
-        self._prof.prof('reschedule', uid=self._pilot_id)
-        self._log.info("slot status before reschedule: %s" % self.slot_status())
 
-        # cycle through wait queue, and see if we get anything running now.  We
-        # cycle over a copy of the list, so that we can modify the list on the
-        # fly
-        for cu in self._wait_pool[:]:
+    # --------------------------------------------------------------------------
+    #
+    def _reschedule_idle_cb(self):
 
-            if self._try_allocation(cu):
+        if not self._reschedule_pending:
+            return False
 
-                # allocated cu -- advance it
-                self.advance(cu, rps.EXECUTING_PENDING, publish=True, push=True)
+        self._reschedule()
+        return True
 
-                # remove it from the wait queue
-                with self._wait_lock :
-                    self._wait_pool.remove(cu)
-                    self._prof.prof('unqueue', msg="re-allocation done", uid=cu['_id'])
-            else:
-                # Break out of this loop if we didn't manage to schedule a task
-                break
+
+    # --------------------------------------------------------------------------
+    #
+    def _reschedule(self):
+
+        self._reschedule_pending = False
+
+        self._prof.prof('reschedule', uid=self._pilot_id)
+        self._log_slot_status("before reschedule")
+
+        # cycle through wait pool, and see if we get anything running now.
+        # Only units which can fit into the free cores are tried.
+        with self._wait_lock :
+            placed = self._wait_pool.schedule(self._try_allocation,
+                                              self._free_cores())
+
+        for cu in placed:
+            self._prof.prof('unqueue', msg="re-allocation done", uid=cu['_id'])
+
+        # advance the allocated units
+        if placed:
+            self.advance(placed, rps.EXECUTING_PENDING, publish=True, push=True)
 
         # Note: The extra space below is for visual alignment
-        self._log.info("slot status after  reschedule: %s" % self.slot_status ())
+        self._log_slot_status("after  reschedule")
         self._prof.prof('reschedule done')
 
 
@@ -228,31 +277,37 @@ class AgentSchedulingComponent(rpu.Component):
     #
     def unschedule_cb(self, topic, msg):
         """
-        release (for whatever reason) all slots allocated to this CU
+        release (for whatever reason) all slots allocated to this CU (or to
+        this list of CUs)
         """
 
-        cu = msg
-        self._prof.prof('unschedule', uid=cu['_id'])
+        units = msg
+        if not isinstance(units, list):
+            units = [units]
 
-        if not cu['opaque_slots']:
-            # Nothing to do -- how come?
-            self._log.warn("cannot unschedule: %s (no slots)" % cu)
-            return
+        self._log_slot_status("before unschedule")
 
-        self._log.info("slot status before unschedule: %s" % self.slot_status ())
+        for cu in units:
 
-        # needs to be locked as we try to release slots, but slots are acquired
-        # in a different thread....
-        with self._slot_lock :
-            self._release_slot(cu['opaque_slots'])
-            self._prof.prof('unschedule', msg='released', uid=cu['_id'])
+            self._prof.prof('unschedule', uid=cu['_id'])
+
+            if not cu['opaque_slots']:
+                # Nothing to do -- how come?
+                self._log.warn("cannot unschedule: %s (no slots)" % cu)
+                continue
 
-        # notify the scheduling thread, ie. trigger a reschedule to utilize
-        # the freed slots
-        self.publish('reschedule', cu)
+            # needs to be locked as we try to release slots, but slots are
+            # acquired in a different thread....
+            with self._slot_lock :
+                self._release_slot(cu['opaque_slots'])
+                self._prof.prof('unschedule', msg='released', uid=cu['_id'])
+
+            # we need to reschedule to utilize the freed slots, but we only do
+            # so in the next sweep over the wait pool (see _reschedule_idle_cb)
+            self._reschedule_pending = True
 
         # Note: The extra space below is for visual alignment
-        self._log.info("slot status after  unschedule: %s" % self.slot_status ())
+        self._log_slot_status("after  unschedule")
 
 
     # --------------------------------------------------------------------------
@@ -267,10 +322,10 @@ class AgentSchedulingComponent(rpu.Component):
             # of) core(s).  But also, we don't really want to schedule, that is
             # why we blow up on output, right?
             #
-            # So we fake scheduling.  This assumes the 'self.slots' structure as
-            # used by the continuous scheduler, wo will likely only work for
-            # this one (FIXME): we walk our own index into the slot structure,
-            # and simply assign that core, be it busy or not.
+            # So we fake scheduling.  This assumes the node ordering as used by
+            # the continuous scheduler, wo will likely only work for this one
+            # (FIXME): we walk our own index over all nodes and cores, and
+            # simply assign that core, be it busy or not.
             #
             # FIXME: This method makes no attempt to set 'taskslots', so will
             # not work properly for some launch methods.
@@ -287,7 +342,7 @@ class AgentSchedulingComponent(rpu.Component):
             slot = self._clone_slot_idx / self._lrms_cores_per_node
             core = self._clone_slot_idx % self._lrms_cores_per_node
 
-            node = self.slots[slot]['node']
+            node = self._lrms_node_list[slot]
 
             unit['opaque_slots']['task_slots'][0] = '%s:%d' \
                     % (node, core)
@@ -315,23 +370,36 @@ class AgentSchedulingComponent(rpu.Component):
 
     # --------------------------------------------------------------------------
     #
-    def work(self, cu):
-
-      # self.advance(cu, rps.AGENT_SCHEDULING, publish=True, push=False)
-        self.advance(cu, rps.ALLOCATING      , publish=True, push=False)
-
-        # we got a new unit to schedule.  Either we can place it
-        # straight away and move it to execution, or we have to
-        # put it on the wait queue.
-        if self._try_allocation(cu):
-            self._prof.prof('schedule', msg="allocation succeeded", uid=cu['_id'])
-            self.advance(cu, rps.EXECUTING_PENDING, publish=True, push=True)
-
-        else:
-            # No resources available, put in wait queue
-            self._prof.prof('schedule', msg="allocation failed", uid=cu['_id'])
-            with self._wait_lock :
-                self._wait_pool.append(cu)
+    def work(self, units):
+
+        if not isinstance(units, list):
+            units = [units]
+
+        # give waiting units a chance to use released slots first
+        if self._reschedule_pending:
+            self._reschedule()
+
+      # self.advance(units, rps.AGENT_SCHEDULING, publish=True, push=False)
+        self.advance(units, rps.ALLOCATING      , publish=True, push=False)
+
+        # we got new units to schedule.  Either we can place them
+        # straight away and move them to execution, or we have to
+        # put them on the wait queue.
+        allocated = list()
+        for cu in units:
+
+            if self._try_allocation(cu):
+                self._prof.prof('schedule', msg="allocation succeeded", uid=cu['_id'])
+                allocated.append(cu)
+
+            else:
+                # No resources available, put in wait queue
+                self._prof.prof('schedule', msg="allocation failed", uid=cu['_id'])
+                with self._wait_lock :
+                    self._wait_pool.add(cu, cu['description']['cores'])
+
+        if allocated:
+            self.advance(allocated, rps.EXECUTING_PENDING, publish=True, push=True)
 
 
 # ------------------------------------------------------------------------------
@@ -9,7 +9,8 @@ from ... import utils     as rpu
 from ... import states    as rps
 from ... import constants as rpc
 
-from .base import AgentSchedulingComponent
+from .base     import AgentSchedulingComponent
+from .core_map import CoreMap
 
 
 # ==============================================================================
@@ -36,23 +37,14 @@ class Continuous(AgentSchedulingComponent):
             raise RuntimeError("LRMS %s didn't _configure cores_per_node." % \
                                self._lrms_info['name'])
 
-        # Slots represents the internal process management structure.
-        # The structure is as follows:
-        # [
-        #    {'node': 'node1', 'cores': [p_1, p_2, p_3, ... , p_cores_per_node]},
-        #    {'node': 'node2', 'cores': [p_1, p_2, p_3. ... , p_cores_per_node]
-        # ]
+        # Slots represents the internal process management structure.  We use
+        # a CoreMap, which keeps the state of all cores of all nodes in a single
+        # compact array, in node order (we care about, and make use of, the
+        # order).
         #
-        # We put it in a list because we care about (and make use of) the order.
-        #
-        self.slots = []
-        for node in self._lrms_node_list:
-            self.slots.append({
-                'node': node,
-                # TODO: Maybe use the real core numbers in the case of
-                # non-exclusive host reservations?
-                'cores': [rpc.FREE for _ in range(0, self._lrms_cores_per_node)]
-            })
+        # TODO: Maybe use the real core numbers in the case of
+        # non-exclusive host reservations?
+        self.slots = CoreMap(self._lrms_node_list, self._lrms_cores_per_node)
 
 
     # --------------------------------------------------------------------------
@@ -61,17 +53,15 @@ class Continuous(AgentSchedulingComponent):
         """Returns a multi-line string corresponding to slot status.
         """
 
-        slot_matrix = ""
-        for slot in self.slots:
-            slot_matrix += "|"
-            for core in slot['cores']:
-                if core == rpc.FREE:
-                    slot_matrix += "-"
-                else:
-                    slot_matrix += "+"
-        slot_matrix += "|"
         return {'timestamp' : rpu.timestamp(),
-                'slotstate' : slot_matrix}
+                'slotstate' : self.slots.status()}
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _free_cores(self):
+
+        return self.slots.free
 
 
     # --------------------------------------------------------------------------
@@ -85,32 +75,18 @@ class Continuous(AgentSchedulingComponent):
         else:
             single_node = False
 
-        # Given that we are the continuous scheduler, this is fixed.
-        # TODO: Argument can be removed altogether?
-        continuous = True
-
-        # Switch between searching for continuous or scattered slots
-        # Switch between searching for single or multi-node
-        if single_node:
-            if continuous:
-                task_slots = self._find_slots_single_cont(cores_requested)
-            else:
-                raise NotImplementedError('No scattered single node scheduler implemented yet.')
-        else:
-            if continuous:
-                task_slots = self._find_slots_multi_cont(cores_requested)
-            else:
-                raise NotImplementedError('No scattered multi node scheduler implemented yet.')
+        # Given that we are the continuous scheduler, we search for continuous
+        # slots, either within node boundaries, or across nodes.
+        offset = self.slots.find(cores_requested, single_node)
 
-        if not task_slots:
+        if offset is None:
             # allocation failed
             return {}
 
-        self._change_slot_states(task_slots, rpc.BUSY)
-        task_offsets = self.slots2offset(task_slots)
+        self.slots.set_busy(offset, cores_requested)
 
-        return {'task_slots'   : task_slots,
-                'task_offsets' : task_offsets,
+        return {'task_slots'   : self.slots.slots(offset, cores_requested),
+                'task_offsets' : offset,
                 'lm_info'      : self._lrms_lm_info}
 
 
@@ -121,15 +97,7 @@ class Continuous(AgentSchedulingComponent):
     def slots2offset(self, task_slots):
         # TODO: This assumes all hosts have the same number of cores
 
-        first_slot = task_slots[0]
-        # Get the host and the core part
-        [first_slot_host, first_slot_core] = first_slot.split(':')
-        # Find the entry in the the all_slots list based on the host
-        slot_entry = (slot for slot in self.slots if slot["node"] == first_slot_host).next()
-        # Transform it into an index in to the all_slots list
-        all_slots_slot_index = self.slots.index(slot_entry)
-
-        return all_slots_slot_index * self._lrms_cores_per_node + int(first_slot_core)
+        return self.slots.offset(task_slots[0])
 
 
     # --------------------------------------------------------------------------
@@ -143,143 +111,13 @@ class Continuous(AgentSchedulingComponent):
         self._change_slot_states(opaque_slots['task_slots'], rpc.FREE)
 
 
-    # --------------------------------------------------------------------------
-    #
-    # Find a needle (continuous sub-list) in a haystack (list)
-    #
-    def _find_sublist(self, haystack, needle):
-        n = len(needle)
-        # Find all matches (returns list of False and True for every position)
-        hits = [(needle == haystack[i:i+n]) for i in xrange(len(haystack)-n+1)]
-        try:
-            # Grab the first occurrence
-            index = hits.index(True)
-        except ValueError:
-            index = None
-
-        return index
-
-
-    # --------------------------------------------------------------------------
-    #
-    # Transform the number of cores into a continuous list of "status"es,
-    # and use that to find a sub-list.
-    #
-    def _find_cores_cont(self, slot_cores, cores_requested, status):
-        return self._find_sublist(slot_cores, [status for _ in range(cores_requested)])
-
-
-    # --------------------------------------------------------------------------
-    #
-    # Find an available continuous slot within node boundaries.
-    #
-    def _find_slots_single_cont(self, cores_requested):
-
-        for slot in self.slots:
-            slot_node = slot['node']
-            slot_cores = slot['cores']
-
-            slot_cores_offset = self._find_cores_cont(slot_cores,
-                    cores_requested, rpc.FREE)
-
-            if slot_cores_offset is not None:
-              # self._log.info('Node %s satisfies %d cores at offset %d',
-              #               slot_node, cores_requested, slot_cores_offset)
-                return ['%s:%d' % (slot_node, core) for core in
-                        range(slot_cores_offset, slot_cores_offset + cores_requested)]
-
-        return None
-
-
-    # --------------------------------------------------------------------------
-    #
-    # Find an available continuous slot across node boundaries.
-    #
-    def _find_slots_multi_cont(self, cores_requested):
-
-        # Convenience aliases
-        cores_per_node = self._lrms_cores_per_node
-        all_slots = self.slots
-
-        # Glue all slot core lists together
-        all_slot_cores = [core for node in [node['cores'] for node in all_slots] for core in node]
-        # self._log.debug("all_slot_cores: %s", all_slot_cores)
-
-        # Find the start of the first available region
-        all_slots_first_core_offset = self._find_cores_cont(all_slot_cores, 
-                cores_requested, rpc.FREE)
-        self._log.debug("all_slots_first_core_offset: %s", all_slots_first_core_offset)
-        if all_slots_first_core_offset is None:
-            return None
-
-        # Determine the first slot in the slot list
-        first_slot_index = all_slots_first_core_offset / cores_per_node
-        self._log.debug("first_slot_index: %s", first_slot_index)
-        # And the core offset within that node
-        first_slot_core_offset = all_slots_first_core_offset % cores_per_node
-        self._log.debug("first_slot_core_offset: %s", first_slot_core_offset)
-
-        # Note: We subtract one here, because counting starts at zero;
-        #       Imagine a zero offset and a count of 1, the only core used
-        #       would be core 0.
-        #       TODO: Verify this claim :-)
-        all_slots_last_core_offset = (first_slot_index * cores_per_node) +\
-                                     first_slot_core_offset + cores_requested - 1
-        self._log.debug("all_slots_last_core_offset: %s", all_slots_last_core_offset)
-        last_slot_index = (all_slots_last_core_offset) / cores_per_node
-        self._log.debug("last_slot_index: %s", last_slot_index)
-        last_slot_core_offset = all_slots_last_core_offset % cores_per_node
-        self._log.debug("last_slot_core_offset: %s", last_slot_core_offset)
-
-        # Convenience aliases
-        last_slot = self.slots[last_slot_index]
-        self._log.debug("last_slot: %s", last_slot)
-        last_node = last_slot['node']
-        self._log.debug("last_node: %s", last_node)
-        first_slot = self.slots[first_slot_index]
-        self._log.debug("first_slot: %s", first_slot)
-        first_node = first_slot['node']
-        self._log.debug("first_node: %s", first_node)
-
-        # Collect all node:core slots here
-        task_slots = []
-
-        # Add cores from first slot for this unit
-        # As this is a multi-node search, we can safely assume that we go
-        # from the offset all the way to the last core.
-        task_slots.extend(['%s:%d' % (first_node, core) for core in
-                           range(first_slot_core_offset, cores_per_node)])
-
-        # Add all cores from "middle" slots
-        for slot_index in range(first_slot_index+1, last_slot_index):
-            slot_node = all_slots[slot_index]['node']
-            task_slots.extend(['%s:%d' % (slot_node, core) for core in range(0, cores_per_node)])
-
-        # Add the cores of the last slot
-        task_slots.extend(['%s:%d' % (last_node, core) for core in range(0, last_slot_core_offset+1)])
-
-        return task_slots
-
-
     # --------------------------------------------------------------------------
     #
     # Change the reserved state of slots (rpc.FREE or rpc.BUSY)
     #
     def _change_slot_states(self, task_slots, new_state):
 
-        # Convenience alias
-        all_slots = self.slots
-
-        # logger.debug("change_slot_states: unit slots: %s", task_slots)
-
-        for slot in task_slots:
-            # logger.debug("change_slot_states: slot content: %s", slot)
-            # Get the node and the core part
-            [slot_node, slot_core] = slot.split(':')
-            # Find the entry in the the all_slots list
-            slot_entry = (slot for slot in all_slots if slot["node"] == slot_node).next()
-            # Change the state of the slot
-            slot_entry['cores'][int(slot_core)] = new_state
+        self.slots.change(task_slots, busy=(new_state == rpc.BUSY))
 
 
 # ------------------------------------------------------------------------------
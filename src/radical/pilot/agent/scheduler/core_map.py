@@ -0,0 +1,240 @@
+
+__copyright__ = "Copyright 2016, http://radical.rutgers.edu"
+__license__   = "MIT"
+
+
+_FREE = 0
+_BUSY = 1
+
+# render cores as '-' (free) and '+' (busy) in status strings
+_STATUS_TABLE = ''.join([chr(i) for i in range(256)])
+_STATUS_TABLE = '-+' + _STATUS_TABLE[2:]
+
+
+# ==============================================================================
+#
+class CoreMap(object):
+    """
+    A compact representation of the cores of a set of nodes, as used by the
+    continuous scheduler.  All cores are kept in a single bytearray (one byte
+    per core, nodes in order), where a zero byte marks a free core.  That allows
+    us to search for runs of free cores with bytearray.find(), ie. at memchr
+    speed and without creating any intermediate lists.  Additionally we keep
+
+      - an index from node names to node positions,
+      - the number of free cores per node, and in total, and
+      - the first node which may still have free cores,
+
+    so that requests which cannot possibly be satisfied fail in O(1), and
+    searches skip the fully occupied nodes at the start of the map.  Changing
+    core states costs O(cores requested).
+
+    Cores are addressed by their global offset, ie. by
+
+        node_index * cores_per_node + core
+
+    and are rendered as 'node:core' strings in the task slots.
+    """
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, nodes, cores_per_node):
+
+        self._nodes = list(nodes)
+        self._cpn   = cores_per_node
+        self._map   = bytearray(len(self._nodes) * self._cpn)
+        self._free  = [self._cpn] * len(self._nodes)  # free cores per node
+        self._nfree = len(self._map)                 # free cores in total
+        self._first = 0                              # first non-full node
+        self._runs  = dict()                         # search pattern cache
+
+        # in case of duplicated node names, the first entry wins
+        self._index = dict()
+        for idx in reversed(range(len(self._nodes))):
+            self._index[self._nodes[idx]] = idx
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def nodes(self):
+        return self._nodes
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def cores_per_node(self):
+        return self._cpn
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def free(self):
+        return self._nfree
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _run(self, cores, value):
+        """
+        return a (cached) bytearray of the given length and value, to be used as
+        search pattern and for slice assignments.
+        """
+
+        key = (cores, value)
+        if key not in self._runs:
+            self._runs[key] = bytearray(chr(value) * cores)
+        return self._runs[key]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def find(self, cores, single_node=True):
+        """
+        Return the offset of the first run of 'cores' free cores, or None if no
+        such run exists.  If 'single_node' is set, the run must not cross node
+        boundaries.
+        """
+
+        if cores < 1 or cores > self._nfree:
+            return None
+
+        needle = self._run(cores, _FREE)
+        cpn    = self._cpn
+
+        if not single_node:
+            offset = self._map.find(needle, self._first * cpn)
+            if offset < 0:
+                return None
+            return offset
+
+        if cores > cpn:
+            return None
+
+        free = self._free
+        for idx in xrange(self._first, len(self._nodes)):
+            if free[idx] >= cores:
+                start  = idx * cpn
+                offset = self._map.find(needle, start, start + cpn)
+                if offset >= 0:
+                    return offset
+
+        return None
+
+
+    # --------------------------------------------------------------------------
+    #
+    def set_busy(self, offset, cores):
+        """
+        mark 'cores' cores, starting at 'offset', as busy
+        """
+        self._set(offset, cores, _BUSY)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def set_free(self, offset, cores):
+        """
+        mark 'cores' cores, starting at 'offset', as free
+        """
+        self._set(offset, cores, _FREE)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _set(self, offset, cores, value):
+
+        cpn  = self._cpn
+        end  = offset + cores
+        node = offset / cpn
+
+        # handle the run node by node, to keep the free counters correct (also
+        # for cores which already were in the target state)
+        while offset < end:
+
+            stop = min(end, (node + 1) * cpn)
+            n    = stop - offset
+            busy = self._map.count(chr(_BUSY), offset, stop)
+
+            if value == _BUSY: delta = busy - n  # free cores which got busy
+            else             : delta = busy      # busy cores which got free
+
+            self._map[offset:stop] = self._run(n, value)
+            self._free[node] += delta
+            self._nfree      += delta
+
+            offset = stop
+            node  += 1
+
+        # keep track of the first node which may have free cores
+        if value == _FREE:
+            self._first = min(self._first, (end - cores) / cpn)
+        else:
+            while self._first < len(self._nodes) and not self._free[self._first]:
+                self._first += 1
+
+
+    # --------------------------------------------------------------------------
+    #
+    def change(self, slots, busy):
+        """
+        Change the state of the given 'node:core' slots.  Consecutive slots are
+        changed in one go.
+        """
+
+        offsets = [self.offset(slot) for slot in slots]
+        value   = _BUSY if busy else _FREE
+
+        start = None
+        for offset in offsets:
+            if start is None:
+                start, cores = offset, 1
+            elif offset == start + cores:
+                cores += 1
+            else:
+                self._set(start, cores, value)
+                start, cores = offset, 1
+
+        if start is not None:
+            self._set(start, cores, value)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def offset(self, slot):
+        """
+        convert a 'node:core' slot into a global core offset
+        """
+
+        node, core = slot.rsplit(':', 1)
+        return self._index[node] * self._cpn + int(core)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def slots(self, offset, cores):
+        """
+        convert a run of cores into a list of 'node:core' slots
+        """
+
+        cpn = self._cpn
+        return ['%s:%d' % (self._nodes[o / cpn], o % cpn)
+                for o in xrange(offset, offset + cores)]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def status(self):
+        """
+        render the core states as string, like '|--++|----|'
+        """
+
+        cpn = self._cpn
+        txt = str(self._map).translate(_STATUS_TABLE)
+        return '|%s|' % '|'.join([txt[i:i + cpn] for i in xrange(0, len(txt), cpn)])
+
+
+# ------------------------------------------------------------------------------
+
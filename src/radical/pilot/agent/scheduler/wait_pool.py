@@ -0,0 +1,145 @@
+
+__copyright__ = "Copyright 2016, http://radical.rutgers.edu"
+__license__   = "MIT"
+
+
+import collections
+
+
+# ==============================================================================
+#
+class WaitPool(object):
+    """
+    The set of units which wait for resources to become available.  Units are
+    kept in FIFO buckets, one per requested number of cores, and a sequence
+    number records the arrival order across buckets.
+
+    schedule() attempts to place waiting units, and supports two policies:
+
+      - FIFO (default): units are tried in arrival order, and the first unit
+        which cannot be placed blocks all others.
+      - backfill: units are tried bucket by bucket (buckets with older units
+        first).  A unit which cannot be placed only blocks the remaining units
+        of its own bucket, so small units can use cores which are not (yet)
+        sufficient for larger ones.
+
+    With either policy, buckets which request more cores than are known to be
+    free are not tried at all.
+
+    The pool has no dependency on the scheduler component, and can thus also
+    be used in simulations.
+    """
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, backfill=False):
+
+        self._backfill = backfill
+        self._buckets  = dict()  # cores -> deque([seq, unit])
+        self._seq      = 0       # arrival counter
+        self._size     = 0       # number of waiting units
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __len__(self):
+
+        return self._size
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def backfill(self):
+
+        return self._backfill
+
+
+    # --------------------------------------------------------------------------
+    #
+    def add(self, unit, cores):
+        """
+        add a unit which requests the given number of cores
+        """
+
+        if cores not in self._buckets:
+            self._buckets[cores] = collections.deque()
+
+        self._buckets[cores].append([self._seq, unit])
+        self._seq  += 1
+        self._size += 1
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _heads(self):
+        """
+        return the non-empty buckets, ordered by the arrival of their heads
+        """
+
+        return sorted([[b[0][0], cores] for cores, b in self._buckets.iteritems() if b])
+
+
+    # --------------------------------------------------------------------------
+    #
+    def schedule(self, allocate, free=None):
+        """
+        Try to place waiting units by calling 'allocate(unit)', which is
+        expected to return True if the unit could be placed.  'free' is the
+        number of free cores, if known.  Returns the list of placed units (in
+        the order they were placed), which are removed from the pool.
+        """
+
+        placed = list()
+
+        if not self._size:
+            return placed
+
+        if not self._backfill:
+
+            while self._size:
+
+                # the oldest unit is the oldest head of all buckets
+                _, cores = min(self._heads())
+
+                if free is not None and cores > free:
+                    break
+
+                unit = self._buckets[cores][0][1]
+                if not allocate(unit):
+                    break
+
+                self._buckets[cores].popleft()
+                self._size -= 1
+                placed.append(unit)
+
+                if free is not None:
+                    free -= cores
+
+        else:
+
+            for _, cores in self._heads():
+
+                bucket = self._buckets[cores]
+
+                while bucket:
+
+                    if free is not None and cores > free:
+                        break
+
+                    # units of the same size will fail just the same, so we
+                    # leave the bucket on the first failure
+                    if not allocate(bucket[0][1]):
+                        break
+
+                    placed.append(bucket.popleft()[1])
+                    self._size -= 1
+
+                    if free is not None:
+                        free -= cores
+
+        return placed
+
+
+# ------------------------------------------------------------------------------
+
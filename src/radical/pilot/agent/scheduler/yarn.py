@@ -179,24 +179,29 @@ class Yarn(AgentSchedulingComponent):
 
     # --------------------------------------------------------------------------
     #
-    def work(self, cu):
+    def work(self, units):
 
-      # self.advance(cu, rps.AGENT_SCHEDULING, publish=True, push=False)
-        self._log.info("Overiding Parent's class method")
-        self.advance(cu, rps.ALLOCATING , publish=True, push=False)
-
-        # we got a new unit to schedule.  Either we can place it
-        # straight away and move it to execution, or we have to
-        # put it on the wait queue.
-        if self._try_allocation(cu):
-            self._prof.prof('schedule', msg="allocation succeeded", uid=cu['_id'])
-            self.advance(cu, rps.EXECUTING_PENDING, publish=True, push=True)
+        if not isinstance(units, list):
+            units = [units]
 
-        else:
-            # No resources available, put in wait queue
-            self._prof.prof('schedule', msg="allocation failed", uid=cu['_id'])
-            with self._wait_lock :
-                self._wait_pool.append(cu)
+      # self.advance(units, rps.AGENT_SCHEDULING, publish=True, push=False)
+        self._log.info("Overiding Parent's class method")
+        self.advance(units, rps.ALLOCATING , publish=True, push=False)
+
+        # we got new units to schedule.  Either we can place them
+        # straight away and move them to execution, or we have to
+        # put them on the wait queue.
+        for cu in units:
+
+            if self._try_allocation(cu):
+                self._prof.prof('schedule', msg="allocation succeeded", uid=cu['_id'])
+                self.advance(cu, rps.EXECUTING_PENDING, publish=True, push=True)
+
+            else:
+                # No resources available, put in wait queue
+                self._prof.prof('schedule', msg="allocation failed", uid=cu['_id'])
+                with self._wait_lock :
+                    self._wait_pool.add(cu, cu['description']['cores'])
 
 
 # ------------------------------------------------------------------------------
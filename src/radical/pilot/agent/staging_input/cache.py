@@ -0,0 +1,168 @@
+
+__copyright__ = "Copyright 2016, http://radical.rutgers.edu"
+__license__   = "MIT"
+
+
+import os
+import stat
+import errno
+import shutil
+import hashlib
+import threading
+import collections
+
+
+# ==============================================================================
+#
+class StagingCache(object):
+    """
+    A cache of staged input files, so that files which are copied into many
+    unit sandboxes are only read and written once.  Files are identified by
+    (path, size, mtime), and are stored under a name derived from that key.
+    Repeated copies of a file are then hardlinked from the cache (or copied if
+    the target is on a different filesystem).
+
+    Cached files are made read-only, as their content is shared with all unit
+    sandboxes they are linked into.
+
+    The cache keeps at most 'budget' bytes, and evicts the least recently used
+    files beyond that.  Evicted files remain available in the unit sandboxes
+    they are linked into.
+
+    The cache can be used from multiple threads.  Cache misses are filled
+    outside of the cache lock, so that only copies of the same file wait for
+    each other.  Links are created under the cache lock, so that a cached file
+    cannot be evicted while it is linked.
+    """
+
+    # number of locks for filling the cache (files are mapped to locks by key)
+    FILL_LOCKS = 64
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, path, budget):
+
+        self._path    = path
+        self._budget  = budget
+        self._size    = 0                         # bytes in cache
+        self._entries = collections.OrderedDict() # key -> [cached path, size]
+        self._lock    = threading.Lock()          # protects the entries
+        self._fill    = [threading.Lock() for _ in range(self.FILL_LOCKS)]
+
+        self.hits     = 0
+        self.misses   = 0
+
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _lookup(self, key):
+        """
+        Return the cached copy for the key, or None.  Must be called under
+        self._lock.
+        """
+
+        entry = self._entries.pop(key, None)
+        if entry:
+            if os.path.exists(entry[0]):
+                self._entries[key] = entry  # most recently used
+                return entry[0]
+            self._size -= entry[1]
+
+        return None
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _add(self, key, source, size):
+        """
+        Copy the source file into the cache, and evict the least recently used
+        files beyond the budget.  The copy is done outside of self._lock.
+        """
+
+        cached = os.path.join(self._path, hashlib.sha1(repr(key)).hexdigest())
+        tmp    = '%s.tmp' % cached
+
+        shutil.copyfile(source, tmp)
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.rename(tmp, cached)
+
+        with self._lock:
+
+            self._entries[key] = [cached, size]
+            self._size += size
+
+            while self._size > self._budget:
+                _, (path, size) = self._entries.popitem(last=False)
+                self._size -= size
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+    # --------------------------------------------------------------------------
+    #
+    def copy(self, source, target):
+        """
+        Copy the source file to the target, via the cache.  Returns True on
+        a cache hit.  Files larger than the budget are copied directly.
+        """
+
+        st  = os.stat(source)
+        key = (os.path.realpath(source), st.st_size, st.st_mtime)
+
+        # like copyfile, we replace existing targets
+        if os.path.lexists(target):
+            os.unlink(target)
+
+        if st.st_size > self._budget:
+            with self._lock:
+                self.misses += 1
+            shutil.copyfile(source, target)
+            return False
+
+        # only one thread fills the cache for a file, the others wait for it
+        with self._fill[hash(key) % self.FILL_LOCKS]:
+
+            with self._lock:
+                hit = bool(self._lookup(key))
+
+            if not hit:
+                self._add(key, source, st.st_size)
+
+        with self._lock:
+
+            if hit: self.hits   += 1
+            else  : self.misses += 1
+
+            # link under the lock, so that the file is not evicted meanwhile
+            cached = self._lookup(key)
+            if cached:
+                try:
+                    os.link(cached, target)
+                    return hit
+                except OSError as e:
+                    # different filesystem, or no hardlink support
+                    if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK,
+                                       errno.ENOTSUP]:
+                        raise
+
+        # the cached copy cannot be linked: copy it, or the source if the
+        # cached copy got evicted meanwhile
+        if cached:
+            try:
+                shutil.copyfile(cached, target)
+                return hit
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+        shutil.copyfile(source, target)
+        return hit
+
+
+# ------------------------------------------------------------------------------
+
@@ -6,6 +6,8 @@ __license__   = "MIT"
 import os
 import shutil
 
+from multiprocessing.pool import ThreadPool
+
 import radical.utils as ru
 
 from .... import pilot     as rp
@@ -13,7 +15,8 @@ from ...  import utils     as rpu
 from ...  import states    as rps
 from ...  import constants as rpc
 
-from .base import AgentStagingInputComponent
+from .base  import AgentStagingInputComponent
+from .cache import StagingCache
 
 
 # ==============================================================================
@@ -53,6 +56,22 @@ class Default(AgentStagingInputComponent):
 
         self.declare_publisher('state', rpc.AGENT_STATE_PUBSUB)
 
+        # repeated COPY directives for the same file are served from a cache
+        # (of 'staging_cache_size' bytes, 0 disables it)
+        self._cache = None
+        budget = self._cfg.get('staging_cache_size', 0)
+        if budget:
+            self._cache = StagingCache(os.path.join(self._cfg['workdir'],
+                                                    'staging_cache', self.cname),
+                                       budget)
+
+        # units can be staged concurrently on a thread pool, configured per
+        # component type in 'component_threads'
+        self._pool = None
+        threads    = self._cfg.get('component_threads', {}).get(self.ctype, 0)
+        if threads:
+            self._pool = ThreadPool(threads)
+
         # all components use the command channel for control messages
         self.declare_publisher ('command', rpc.AGENT_COMMAND_PUBSUB)
 
@@ -65,6 +84,16 @@ class Default(AgentStagingInputComponent):
     #
     def finalize_child(self):
 
+        # finish all staging in progress
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+
+        if self._cache:
+            self._prof.prof('staging cache', uid=self._cfg['pilot_id'],
+                            msg='hits: %d, misses: %d' % (self._cache.hits,
+                                                          self._cache.misses))
+
         # communicate finalization
         self.publish('command', {'cmd' : 'final',
                                  'arg' : self.cname})
@@ -73,9 +102,53 @@ class Default(AgentStagingInputComponent):
 
     # --------------------------------------------------------------------------
     #
-    def work(self, cu):
+    def work(self, units):
+
+        if not isinstance(units, list):
+            units = [units]
+
+        self.advance(units, rps.AGENT_STAGING_INPUT, publish=True, push=False)
+
+        for cu in units:
+            if self._pool:
+                self._pool.apply_async(self._handle_unit_threaded, [cu])
+            else:
+                self._handle_unit(cu)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle_unit_threaded(self, cu):
+
+        # this runs on a pool thread.  All staging for a unit happens here, so
+        # the order of its directives is kept.  The component's channels are
+        # not thread safe, so we advance the unit under the callback lock.
+        try:
+            state, push = self._stage(cu)
+        except Exception as e:
+            self._log.exception("staging input failed -> unit failed")
+            state, push = rps.FAILED, False
+
+        with self._cb_lock:
+            self.advance(cu, state, publish=True, push=push)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle_unit(self, cu):
+
+        state, push = self._stage(cu)
+        self.advance(cu, state, publish=True, push=push)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _stage(self, cu):
+        """
+        Perform the input staging for the given unit, and return the state to
+        advance it to, and whether to push it.
+        """
 
-        self.advance(cu, rps.AGENT_STAGING_INPUT, publish=True, push=False)
         self._log.info('handle %s' % cu['_id'])
 
         workdir      = os.path.join(self._cfg['workdir'], '%s' % cu['_id'])
@@ -148,7 +221,13 @@ class Default(AgentStagingInputComponent):
                             self._log.error(log_message)
                             raise Exception(log_message)
 
-                if   directive['action'] == rpc.LINK: os.symlink     (source, abs_target)
+                if directive['action'] == rpc.COPY and self._cache:
+                    if self._cache.copy(source, abs_target):
+                        self._prof.prof('staging cache hit',  uid=cu['_id'], msg=source)
+                    else:
+                        self._prof.prof('staging cache miss', uid=cu['_id'], msg=source)
+
+                elif directive['action'] == rpc.LINK: os.symlink     (source, abs_target)
                 elif directive['action'] == rpc.COPY: shutil.copyfile(source, abs_target)
                 elif directive['action'] == rpc.MOVE: shutil.move    (source, abs_target)
                 else:
@@ -165,10 +244,10 @@ class Default(AgentStagingInputComponent):
 
         # Agent input staging is done (or failed)
         if staging_ok:
-          # self.advance(cu, rps.AGENT_SCHEDULING_PENDING, publish=True, push=True)
-            self.advance(cu, rps.ALLOCATING_PENDING, publish=True, push=True)
+          # return rps.AGENT_SCHEDULING_PENDING, True
+            return rps.ALLOCATING_PENDING, True
         else:
-            self.advance(cu, rps.FAILED, publish=True, push=False)
+            return rps.FAILED, False
 
 
 # ------------------------------------------------------------------------------
@@ -6,6 +6,8 @@ __license__   = "MIT"
 import os
 import shutil
 
+from multiprocessing.pool import ThreadPool
+
 import radical.utils as ru
 
 from .... import pilot     as rp
@@ -58,6 +60,13 @@ class Default(AgentStagingOutputComponent):
 
         self.declare_publisher('state', rpc.AGENT_STATE_PUBSUB)
 
+        # units can be staged concurrently on a thread pool, configured per
+        # component type in 'component_threads'
+        self._pool = None
+        threads    = self._cfg.get('component_threads', {}).get(self.ctype, 0)
+        if threads:
+            self._pool = ThreadPool(threads)
+
         # all components use the command channel for control messages
         self.declare_publisher ('command', rpc.AGENT_COMMAND_PUBSUB)
 
@@ -70,6 +79,11 @@ class Default(AgentStagingOutputComponent):
     #
     def finalize_child(self):
 
+        # finish all staging in progress
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+
         # communicate finalization
         self.publish('command', {'cmd' : 'final',
                                  'arg' : self.cname})
@@ -77,9 +91,52 @@ class Default(AgentStagingOutputComponent):
 
     # --------------------------------------------------------------------------
     #
-    def work(self, cu):
+    def work(self, units):
+
+        if not isinstance(units, list):
+            units = [units]
+
+        self.advance(units, rps.AGENT_STAGING_OUTPUT, publish=True, push=False)
+
+        for cu in units:
+            if self._pool:
+                self._pool.apply_async(self._handle_unit_threaded, [cu])
+            else:
+                self._handle_unit(cu)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle_unit_threaded(self, cu):
+
+        # this runs on a pool thread.  All staging for a unit happens here, so
+        # the order of its directives is kept.  The component's channels are
+        # not thread safe, so we advance the unit under the callback lock.
+        try:
+            state, push = self._stage(cu)
+        except Exception as e:
+            self._log.exception("staging output failed -> unit failed")
+            state, push = rps.FAILED, False
 
-        self.advance(cu, rps.AGENT_STAGING_OUTPUT, publish=True, push=False)
+        with self._cb_lock:
+            self.advance(cu, state, publish=True, push=push)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle_unit(self, cu):
+
+        state, push = self._stage(cu)
+        self.advance(cu, state, publish=True, push=push)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _stage(self, cu):
+        """
+        Perform the output staging for the given unit, and return the state to
+        advance it to, and whether to push it.
+        """
 
         staging_area = os.path.join(self._cfg['workdir'], self._cfg['staging_area'])
         staging_ok   = True
@@ -87,30 +144,25 @@ class Default(AgentStagingOutputComponent):
         workdir = cu['workdir']
 
         ## parked from unit state checker: unit postprocessing
+        #  we only read the tail of stdout and stderr, which is all we push
         if os.path.isfile(cu['stdout_file']):
-            with open(cu['stdout_file'], 'r') as stdout_f:
-                try:
-                    txt = unicode(stdout_f.read(), "utf-8")
-                except UnicodeDecodeError:
-                    txt = "unit stdout contains binary data -- use file staging directives"
-
-                cu['stdout'] += rpu.tail(txt)
+            txt = rpu.tail_file(cu['stdout_file'])
+            if txt is None:
+                txt = "unit stdout contains binary data -- use file staging directives"
+            cu['stdout'] += txt
 
         if os.path.isfile(cu['stderr_file']):
-            with open(cu['stderr_file'], 'r') as stderr_f:
-                try:
-                    txt = unicode(stderr_f.read(), "utf-8")
-                except UnicodeDecodeError:
-                    txt = "unit stderr contains binary data -- use file staging directives"
-
-                cu['stderr'] += rpu.tail(txt)
+            txt = rpu.tail_file(cu['stderr_file'])
+            if txt is None:
+                txt = "unit stderr contains binary data -- use file staging directives"
+            cu['stderr'] += txt
 
         if 'RADICAL_PILOT_PROFILE' in os.environ:
             if os.path.isfile("%s/PROF" % cu['workdir']):
                 try:
                     with open("%s/PROF" % cu['workdir'], 'r') as prof_f:
-                        txt = prof_f.read()
-                        for line in txt.split("\n"):
+                        for line in prof_f:
+                            line = line.strip()
                             if line:
                                 x1, x2, x3 = line.split()
                                 self._prof.prof(x1, msg=x2, timestamp=float(x3), uid=cu['_id'])
@@ -123,8 +175,7 @@ class Default(AgentStagingOutputComponent):
         #       don't need to advance those units anymore, but can make them
         #       final.
         if cu['target_state'] != rps.DONE:
-            self.advance(cu, cu['target_state'], publish=True, push=False)
-            return
+            return cu['target_state'], False
 
 
         try:
@@ -185,10 +236,10 @@ class Default(AgentStagingOutputComponent):
 
         # Agent output staging is done (or failed)
         if staging_ok:
-          # self.advance(cu, rps.UMGR_STAGING_OUTPUT_PENDING, publish=True, push=True)
-            self.advance(cu, rps.PENDING_OUTPUT_STAGING, publish=True, push=False)
+          # return rps.UMGR_STAGING_OUTPUT_PENDING, True
+            return rps.PENDING_OUTPUT_STAGING, False
         else:
-            self.advance(cu, rps.FAILED, publish=True, push=False)
+            return rps.FAILED, False
 
 
 
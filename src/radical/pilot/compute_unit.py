@@ -58,6 +58,12 @@ class ComputeUnit(object):
         # handle to the manager's worker
         self._worker = None
 
+        # set if the unit is assigned to a pilot before it is published (see
+        # UnitManager.submit_units())
+        self._pilot_uid = None
+        self._pilot_sandbox = None
+        self.sandbox = None
+
         if os.getenv("RADICAL_PILOT_GCDEBUG", None) is not None:
             logger.debug("GCDEBUG __init__(): ComputeUnit [object id: %s]." % id(self))
 
@@ -130,7 +136,8 @@ class ComputeUnit(object):
         """
         units_json = unit_manager_obj._session._dbs.get_compute_units(
             unit_manager_id=unit_manager_obj.uid,
-            unit_ids=unit_ids
+            unit_ids=unit_ids,
+            fields=['description']
         )
         # create and return unit objects
         computeunits = []
@@ -150,19 +157,25 @@ class ComputeUnit(object):
     # -------------------------------------------------------------------------
     #
     def as_dict(self):
-        """Returns a Python dictionary representation of the object.
+        """Returns a Python dictionary representation of the object.  This
+        pulls the full unit document from the database (see
+        `execution_details`).
         """
+        # get the unit data once, instead of once per property
+        cu_json = self.execution_details
+
         obj_dict = {
             'uid':               self.uid,
             'name':              self.name,
-            'state':             self.state,
-            'exit_code':         self.exit_code,
-            'log':               self.log,
-            'execution_details': self.execution_details,
-            'submission_time':   self.submission_time,
-            'working_directory': self.working_directory,
-            'start_time':        self.start_time,
-            'stop_time':         self.stop_time
+            'state':             cu_json['state'],
+            'exit_code':         cu_json['exit_code'],
+            'log':               [Logentry.from_dict (log)
+                                  for log in cu_json.get('log') or []],
+            'execution_details': cu_json,
+            'submission_time':   cu_json['submitted'],
+            'working_directory': cu_json['sandbox'],
+            'start_time':        cu_json['started'],
+            'stop_time':         cu_json['finished']
         }
         return obj_dict
 
@@ -349,8 +362,7 @@ class ComputeUnit(object):
 
         logs = []
 
-        cu_json = self._worker.get_compute_unit_data(self.uid)
-        for log in cu_json['log']:
+        for log in self._worker.get_compute_unit_log(self.uid):
             logs.append(Logentry.from_dict (log))
 
         return logs
@@ -359,22 +371,27 @@ class ComputeUnit(object):
     #
     @property
     def execution_details(self):
-        """Returns the exeuction location(s) of the ComputeUnit.
+        """Returns the full unit document of the ComputeUnit, including its
+        description, staging directives, stdout, stderr and log.  The unit
+        manager does not keep those fields in memory, so they are pulled from
+        the database on every call.
         """
         if not self._uid:
             return None
 
-        cu_json = self._worker.get_compute_unit_data(self.uid)
-        return cu_json
+        return self._worker.get_compute_unit_details(self.uid)
 
     # -------------------------------------------------------------------------
     #
     @property
     def execution_locations(self):
         """Returns the exeuction location(s) of the ComputeUnit.
-           This is just an alias for execution_details.
         """
-        return self.execution_details['exec_locs']
+        if not self._uid:
+            return None
+
+        cu_json = self._worker.get_compute_unit_data(self.uid)
+        return cu_json['exec_locs']
 
     # -------------------------------------------------------------------------
     #
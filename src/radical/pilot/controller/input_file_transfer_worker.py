@@ -6,7 +6,11 @@ import os
 import time
 import saga
 import thread
+import hashlib
 import threading
+import collections
+
+from multiprocessing.pool import ThreadPool
 
 from ..states             import * 
 from ..utils              import logger
@@ -14,17 +18,35 @@ from ..utils              import timestamp
 from ..staging_directives import CREATE_PARENTS
 
 IDLE_TIME  = 1.0  # seconds to sleep after idle cycles
+BULK_SIZE  = 100  # max number of units claimed at once
+POOL_SIZE  = 8    # max number of concurrent transfers per target endpoint
+CACHE_SIZE = 1024 # max number of staged files remembered for deduplication
+CACHE_DIR  = 'ftw_cache'  # deduplication cache, in the pilot sandbox
 
 # ----------------------------------------------------------------------------
 #
 class InputFileTransferWorker(threading.Thread):
     """InputFileTransferWorker handles the staging of input files
     for a UnitManagerController.
+
+    Units are claimed in bulks.  All transfers for a bulk are executed
+    concurrently, on a bounded thread pool per target endpoint, and the
+    resulting state transitions are written back in one bulk operation.
+    Cancellation is checked once per bulk (and canceled units are never moved
+    out of the CANCELED state).
+
+    If deduplication is enabled (dedup=True, or RADICAL_PILOT_FTW_DEDUP set
+    in the environment), input files are copied once into a cache directory
+    in the pilot sandbox (CACHE_DIR), and linked from there into the unit
+    sandboxes.  Units must then not modify their input files in place.  If
+    the cache copy or the link fails, the file is copied into the unit sandbox
+    instead.
     """
 
     # ------------------------------------------------------------------------
     #
-    def __init__(self, session, unit_manager_id, number=None):
+    def __init__(self, session, unit_manager_id, number=None,
+                 bulk_size=BULK_SIZE, pool_size=POOL_SIZE, dedup=None):
 
         self._session = session
 
@@ -37,9 +59,20 @@ class InputFileTransferWorker(threading.Thread):
         self._worker_number = number
         self.name = "InputFileTransferWorker-%s" % str(self._worker_number)
 
+        self._bulk_size = bulk_size
+        self._pool_size = pool_size
+        self._claims    = 0       # number of claimed bulks
+        self._pools     = dict()  # endpoint key -> thread pool
+        self._staged    = collections.OrderedDict()  # key -> cached file
+
+        if dedup is None:
+            dedup = 'RADICAL_PILOT_FTW_DEDUP' in os.environ
+        self._dedup = dedup
+
         # we cache saga directories for performance, to speed up sandbox
-        # creation.
-        self._saga_dirs = dict()
+        # creation.  Saga objects are not shared between threads, so each pool
+        # thread has its own cache.
+        self._saga_dirs = threading.local()
 
         # Stop event can be set to terminate the main loop
         self._stop = threading.Event()
@@ -54,6 +87,11 @@ class InputFileTransferWorker(threading.Thread):
         logger.debug("itransfer %s stopping" % (self.name))
         self._stop.set()
         self.join()
+
+        for pool in self._pools.values():
+            pool.close()
+            pool.join()
+
         logger.debug("itransfer %s stopped" % (self.name))
 
 
@@ -81,160 +119,307 @@ class InputFileTransferWorker(threading.Thread):
             while not self._stop.is_set() and \
                   not self._session._terminate.is_set():
 
-                # See if we can find a ComputeUnit that is waiting for
+                # See if we can find ComputeUnits that are waiting for
                 # input file transfer.
-                ts = timestamp()
-                compute_unit = um_col.find_and_modify(
-                    query={"unitmanager": self.unit_manager_id,
-                           "state"      : PENDING_INPUT_STAGING,
-                           },
-                    update={"$set" : {"state": STAGING_INPUT},
-                            "$push": {"statehistory": {"state": STAGING_INPUT, "timestamp": ts}}}
-                )
-
-                if compute_unit is None:
+                compute_units = self._claim(um_col)
+
+                if not compute_units:
                     # Sleep a bit if no new units are available.
                     time.sleep(IDLE_TIME)
 
                 else:
-                    compute_unit_id = None
-                    state = STAGING_INPUT
-
-                    try:
-                        log_messages = []
-
-                        # We have found a new CU. Now we can process the transfer
-                        # directive(s) wit SAGA.
-                        compute_unit_id = str(compute_unit["_id"])
-
-                        logger.debug ("InputStagingController: unit found: %s" % compute_unit_id)
-                        self._session.prof.prof('advance', uid=compute_unit_id,
-                                msg=state, state=state)
-
-                        remote_sandbox = compute_unit["sandbox"]
-                        input_staging = compute_unit.get("FTW_Input_Directives", [])
-
-
-                        # if we do staging, create the CU's directory in case it doesn't exist yet.
-                        if input_staging:
-                            log_msg = "InputStagingController: Creating ComputeUnit sandbox directory %s." % remote_sandbox
-                            log_messages.append(log_msg)
-                            logger.info(log_msg)
-
-                            # Creating/initialising the sandbox directory.
-                            try:
-                                logger.debug ("saga.fs.Directory ('%s')" % remote_sandbox)
-
-                                # url used for saga
-                                remote_sandbox_url = saga.Url(remote_sandbox)
-
-                                # keyurl and key used for cache
-                                remote_sandbox_keyurl = saga.Url(remote_sandbox)
-                                remote_sandbox_keyurl.path = '/'
-                                remote_sandbox_key = str(remote_sandbox_keyurl)
-
-                                if  remote_sandbox_key not in self._saga_dirs :
-                                    self._saga_dirs[remote_sandbox_key] = \
-                                            saga.filesystem.Directory(remote_sandbox_url,
-                                                    flags=saga.filesystem.CREATE_PARENTS,
-                                                    session=self._session)
-
-                                saga_dir = self._saga_dirs[remote_sandbox_key]
-                            except Exception as e :
-                                logger.exception('Error: %s' % e)
-                                raise
-
-                            logger.info("InputStagingController: Processing input file transfers for ComputeUnit %s" % compute_unit_id)
-
-
-                        # Loop over all transfer directives and execute them.
-                        for sd in input_staging:
-
-                            logger.debug("InputStagingController: sd: %s : %s" % (compute_unit_id, sd))
-
-                            # Check if there was a cancel request
-                            state_doc = um_col.find_one(
-                                {"_id": compute_unit_id},
-                                fields=["state"]
-                            )
-                            if state_doc['state'] == CANCELED:
-                                self._session.prof.prof('advance', uid=compute_unit_id, 
-                                        msg=CANCELED, state=CANCELED)
-                                logger.info("Compute Unit Canceled, interrupting input file transfers.")
-                                state = CANCELED
-                                # Break out of the loop for this CU's SD's
-                                break
-
-                            abs_src = os.path.abspath(sd['source'])
-                            input_file_url = saga.Url("file://localhost%s" % abs_src)
-                            if not sd['target']:
-                                target = '%s/%s' % (remote_sandbox, os.path.basename(abs_src))
-                            else:
-                                target = "%s/%s" % (remote_sandbox, sd['target'])
-
-                            log_msg = "Transferring input file %s -> %s" % (input_file_url, target)
-                            log_messages.append(log_msg)
-                            logger.debug(log_msg)
-
-                            # Execute the transfer.
-                            if CREATE_PARENTS in sd['flags']:
-                                copy_flags = saga.filesystem.CREATE_PARENTS
-                            else:
-                                copy_flags = 0
-
-                            try:
-                                saga_dir.copy(input_file_url, target, flags=copy_flags)
-                            except Exception as e:
-                                logger.exception(e)
-                                raise Exception("input staging for %s failed: %s" \
-                                                % (compute_unit_id, e))
-
-                        # If this CU was canceled we can skip the remainder of this loop,
-                        # to process more CUs.
-                        if state == CANCELED:
-                            continue
-
-                        # All IFTW staging done for this CU.  Push it out, by
-                        # setting the state as 'AGENT_ATGING_INPUT_PENDING and
-                        # sending it to mongodb.  We mark the CU under 'umgr'
-                        # control -- once the agent picks it up, it will be
-                        # marked as under 'agent' control, before the
-                        # agent_stging_output_component passes control back in
-                        # a similar manner.
-                        um_col.update({'_id': compute_unit_id},
-                                      {'$set': {'state'  : AGENT_STAGING_INPUT_PENDING, 
-                                                'control': 'umgr'},
-                                       '$push': {
-                                           'statehistory': {
-                                               'state': AGENT_STAGING_INPUT_PENDING,
-                                               'timestamp': ts},
-                                           'log': {
-                                               'timestamp': timestamp(),
-                                               'message': 'push unit to agent after ftw staging'
-                                       }}})
-                        logger.debug("InputStagingController: %s : push to agent" % compute_unit_id)
-                        self._session.prof.prof('advance', uid=compute_unit_id, 
-                                msg=AGENT_STAGING_INPUT_PENDING, state=AGENT_STAGING_INPUT_PENDING)
-
-                    except Exception as e :
-
-                        # Update the CU's state to 'FAILED'.
-                        ts = timestamp()
-                        logentry = {'message': "Input transfer failed: %s" % e,
-                                    'timestamp': ts}
-
-                        um_col.update({'_id': compute_unit_id},
-                                      {'$set': {'state': FAILED},
-                                       '$push': {
-                                           'statehistory': {'state': FAILED, 'timestamp': ts},
-                                           'log': logentry
-                                       }})
-                        self._session.prof.prof('advance', uid=compute_unit_id, 
-                                msg=FAILED, state=FAILED)
-
-                        logger.exception(str(logentry))
-                        raise
+                    self._stage(um_col, compute_units)
 
         except SystemExit as e :
             logger.debug("input file transfer thread caught system exit -- forcing application shutdown")
             thread.interrupt_main ()
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _claim(self, um_col):
+        """
+        Claim a bulk of units which wait for input staging, and move them to
+        STAGING_INPUT.  Other workers may compete for the same units, so we
+        tag the units with a unique claim token, and only return those units
+        which carry our token.
+        """
+
+        query = {"unitmanager": self.unit_manager_id,
+                 "state"      : PENDING_INPUT_STAGING}
+
+        uids = [doc['_id'] for doc in um_col.find(query, fields=['_id'])
+                                              .limit(self._bulk_size)]
+        if not uids:
+            return list()
+
+        self._claims += 1
+        token = "%s.%s.%d" % (self.unit_manager_id, self.name, self._claims)
+        ts    = timestamp()
+
+        query['_id'] = {'$in': uids}
+        um_col.update(query,
+                      {"$set" : {"state"    : STAGING_INPUT,
+                                 "ftw_claim": token},
+                       "$push": {"statehistory": {"state": STAGING_INPUT, "timestamp": ts}},
+                       "$currentDate": {"modified": True}},
+                      multi=True)
+
+        return list(um_col.find({'_id'      : {'$in': uids},
+                                 'ftw_claim': token}))
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _get_dir(self, key, sandbox):
+        """
+        return the (thread local) saga directory for the given endpoint key.
+        The directory is created for the first sandbox we see on that endpoint.
+        """
+
+        if not hasattr(self._saga_dirs, 'cache'):
+            self._saga_dirs.cache = dict()
+
+        if key not in self._saga_dirs.cache:
+            logger.debug ("saga.fs.Directory ('%s')" % sandbox)
+            self._saga_dirs.cache[key] = \
+                    saga.filesystem.Directory(saga.Url(sandbox),
+                            flags=saga.filesystem.CREATE_PARENTS,
+                            session=self._session)
+
+        return self._saga_dirs.cache[key]
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _transfer(self, task):
+        """
+        Execute a single transfer task (see _stage()), and return None on
+        success, or an error message.  This runs on a pool thread.
+        """
+
+        uid, key, sandbox, source, target, flags, link = task
+
+        try:
+            saga_dir = self._get_dir(key, sandbox)
+
+            if link:
+                try:
+                    logger.debug("Linking input file %s -> %s" % (link, target))
+                    saga_dir.link(link, target, flags=flags)
+                    return None
+                except Exception as e:
+                    logger.debug("link failed, copying instead (%s)" % e)
+
+            logger.debug("Transferring input file %s -> %s" % (source, target))
+            saga_dir.copy(source, target, flags=flags)
+            return None
+
+        except Exception as e:
+            logger.exception(e)
+            return "input staging for %s failed: %s" % (uid, e)
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _run_tasks(self, tasks):
+        """
+        Execute the given transfer tasks on the pools of their target
+        endpoints, and return a dict of error messages for failed units (for
+        failed cache copies, by their target url).
+        """
+
+        errors = dict()
+        if not tasks:
+            return errors
+
+        by_key = dict()
+        for task in tasks:
+            by_key.setdefault(task[1], list()).append(task)
+
+        results = list()
+        for key, key_tasks in by_key.iteritems():
+            if key not in self._pools:
+                self._pools[key] = ThreadPool(self._pool_size)
+            results.append([key_tasks, self._pools[key].map_async(self._transfer, key_tasks)])
+
+        for key_tasks, result in results:
+            for task, error in zip(key_tasks, result.get()):
+                if error:
+                    errors[task[0] or task[4]] = error
+
+        return errors
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _stage(self, um_col, compute_units):
+        """
+        Execute the input staging directives for a bulk of claimed units, and
+        push the units to the agent (or fail them).
+        """
+
+        uids = [str(cu["_id"]) for cu in compute_units]
+
+        for uid in uids:
+            logger.debug ("InputStagingController: unit found: %s" % uid)
+            self._session.prof.prof('advance', uid=uid, msg=STAGING_INPUT,
+                                    state=STAGING_INPUT)
+
+        # Check if there were cancel requests
+        canceled = set([str(doc['_id']) for doc in um_col.find(
+                            {"_id"  : {"$in": uids},
+                             "state": CANCELED},
+                            fields=["_id"])])
+
+        for uid in canceled:
+            self._session.prof.prof('advance', uid=uid, msg=CANCELED, state=CANCELED)
+            logger.info("Compute Unit %s Canceled, skipping input file transfers." % uid)
+
+        # Create the transfer tasks for all directives.  A task is
+        #   [uid, endpoint key, sandbox, source url, target url, flags, link]
+        # where 'link' is the url of the cached copy of the file on the same
+        # endpoint (or None).  Tasks which fill the cache have no uid.
+        copies   = list()
+        links    = list()
+        new_keys = dict()  # cache keys of this bulk's cache copies
+
+        for cu in compute_units:
+
+            uid = str(cu["_id"])
+            if uid in canceled:
+                continue
+
+            remote_sandbox = cu["sandbox"]
+            input_staging  = cu.get("FTW_Input_Directives", [])
+
+            if not input_staging:
+                continue
+
+            logger.info("InputStagingController: Processing input file transfers for ComputeUnit %s" % uid)
+
+            # keyurl and key used for the endpoint
+            remote_sandbox_keyurl = saga.Url(remote_sandbox)
+            remote_sandbox_keyurl.path = '/'
+            remote_sandbox_key = str(remote_sandbox_keyurl)
+
+            for sd in input_staging:
+
+                logger.debug("InputStagingController: sd: %s : %s" % (uid, sd))
+
+                abs_src = os.path.abspath(sd['source'])
+                input_file_url = "file://localhost%s" % abs_src
+                if not sd['target']:
+                    target = '%s/%s' % (remote_sandbox, os.path.basename(abs_src))
+                else:
+                    target = "%s/%s" % (remote_sandbox, sd['target'])
+
+                if CREATE_PARENTS in sd['flags']:
+                    copy_flags = saga.filesystem.CREATE_PARENTS
+                else:
+                    copy_flags = 0
+
+                task = [uid, remote_sandbox_key, remote_sandbox,
+                        input_file_url, target, copy_flags, None]
+
+                if not self._dedup:
+                    copies.append(task)
+                    continue
+
+                # files are identified by cache directory, path, size and mtime
+                cache = '%s/%s' % (os.path.dirname(remote_sandbox.rstrip('/')),
+                                   CACHE_DIR)
+                try:
+                    st  = os.stat(abs_src)
+                    key = (cache, abs_src, st.st_size, st.st_mtime)
+                except OSError:
+                    copies.append(task)  # let the transfer fail
+                    continue
+
+                if key in self._staged:
+                    task[6] = self._staged[key]
+
+                elif key in new_keys:
+                    task[6] = new_keys[key]
+
+                else:
+                    task[6] = '%s/%s.%s' % (cache, hashlib.md5(repr(key)).hexdigest(),
+                                            os.path.basename(abs_src))
+                    new_keys[key] = task[6]
+                    copies.append([None, remote_sandbox_key, remote_sandbox,
+                                   input_file_url, task[6],
+                                   saga.filesystem.CREATE_PARENTS, None])
+
+                links.append(task)
+
+        # Execute the transfers: the copies first, then the links to the
+        # cached copies.  If a cache copy failed, the units which would link
+        # to it copy the file themselves.
+        errors = self._run_tasks(copies)
+        failed = set([t[4] for t in copies if t[0] is None and t[4] in errors])
+
+        for cached in failed:
+            del(errors[cached])
+
+        for key, cached in new_keys.iteritems():
+            if cached not in failed:
+                self._staged[key] = cached
+
+        for task in links:
+            if task[6] in failed:
+                task[6] = None
+
+        errors.update(self._run_tasks([t for t in links if t[0] not in errors]))
+
+        # don't let the deduplication cache grow forever
+        while len(self._staged) > CACHE_SIZE:
+            self._staged.popitem(last=False)
+
+        # All IFTW staging done for these CUs.  Push them out, by setting the
+        # state to AGENT_STAGING_INPUT_PENDING (or FAILED), in one bulk.  We
+        # mark the CUs under 'umgr' control -- once the agent picks them up,
+        # they will be marked as under 'agent' control, before the
+        # agent_staging_output_component passes control back in a similar
+        # manner.  Units which got canceled meanwhile are not touched.
+        bulk = um_col.initialize_ordered_bulk_op()
+
+        for uid in uids:
+
+            if uid in canceled:
+                continue
+
+            ts = timestamp()
+
+            if uid in errors:
+                logentry = {'message': "Input transfer failed: %s" % errors[uid],
+                            'timestamp': ts}
+                bulk.find({'_id': uid, 'state': STAGING_INPUT}) \
+                    .update({'$set': {'state': FAILED},
+                             '$push': {
+                                 'statehistory': {'state': FAILED, 'timestamp': ts},
+                                 'log': logentry
+                             },
+                             '$currentDate': {'modified': True}})
+                self._session.prof.prof('advance', uid=uid, msg=FAILED, state=FAILED)
+                logger.error(str(logentry))
+
+            else:
+                bulk.find({'_id': uid, 'state': STAGING_INPUT}) \
+                    .update({'$set': {'state'  : AGENT_STAGING_INPUT_PENDING,
+                                      'control': 'umgr'},
+                             '$push': {
+                                 'statehistory': {
+                                     'state': AGENT_STAGING_INPUT_PENDING,
+                                     'timestamp': ts},
+                                 'log': {
+                                     'timestamp': ts,
+                                     'message': 'push unit to agent after ftw staging'
+                             }},
+                             '$currentDate': {'modified': True}})
+                logger.debug("InputStagingController: %s : push to agent" % uid)
+                self._session.prof.prof('advance', uid=uid,
+                        msg=AGENT_STAGING_INPUT_PENDING, state=AGENT_STAGING_INPUT_PENDING)
+
+        if len(canceled) < len(uids):
+            bulk.execute()
+
@@ -88,7 +88,8 @@ class OutputFileTransferWorker(threading.Thread):
                             "$push": {"statehistory" : 
                                          {"state"    : STAGING_OUTPUT, 
                                           "timestamp": ts}
-                                     }
+                                     },
+                            "$currentDate": {"modified": True}
                             })
 
                 if compute_unit is None:
@@ -172,7 +173,8 @@ class OutputFileTransferWorker(threading.Thread):
                             '$push': {
                                 'statehistory': {'state': DONE, 'timestamp': ts},
                                 'log': {'message': log_message, 'timestamp': ts}
-                            }
+                            },
+                            '$currentDate': {'modified': True}
                         })
                         self._session.prof.prof('advance', uid=compute_unit_id,
                                 msg=DONE, state=DONE)
@@ -186,7 +188,8 @@ class OutputFileTransferWorker(threading.Thread):
                             '$push': {
                                 'statehistory': {'state': FAILED, 'timestamp': ts},
                                 'log': {'message': log_message, 'timestamp': ts}
-                            }})
+                            },
+                            '$currentDate': {'modified': True}})
                         logger.exception(log_message)
                         self._session.prof.prof('advance', uid=compute_unit_id, 
                                 msg=FAILED, state=FAILED)
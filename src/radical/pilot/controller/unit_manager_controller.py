@@ -8,9 +8,11 @@ __license__ = "MIT"
 
 import os
 import time
+import datetime
 import Queue
 import weakref
 import threading
+import collections
 
 from multiprocessing import Pool
 
@@ -21,12 +23,17 @@ from ..states             import *
 from ..utils              import logger
 from ..utils              import timestamp
 from ..staging_directives import TRANSFER, LINK, COPY, MOVE
+from ..db.database        import UNIT_LARGE_FIELDS, UNIT_STATIC_FIELDS
 
 from .input_file_transfer_worker  import InputFileTransferWorker
 from .output_file_transfer_worker import OutputFileTransferWorker
 
 
-IDLE_TIME = 3.0  # seconds to sleep between activities
+IDLE_TIME    = 3.0  # seconds to sleep between activities
+CHANGE_SLACK = datetime.timedelta(seconds=IDLE_TIME)  # see run()
+BULK_FETCH   = 1024  # max number of units to pull large fields for at once
+LARGE_CACHE  = 16 * BULK_FETCH  # max number of units to keep large fields for
+WAIT_SLICE   = 1.0  # max seconds to block in wait_units() at once
 
 # ----------------------------------------------------------------------------
 #
@@ -68,6 +75,32 @@ class UnitManagerController(threading.Thread):
         self._shared_data = dict()
         self._shared_data_lock = threading.Lock()
 
+        # The large unit fields (UNIT_LARGE_FIELDS) are not part of the unit
+        # data above, but are pulled when they are first asked for.  Once
+        # a unit is final, its large fields don't change anymore: we then keep
+        # them, and pull them for many final units at once (they are likely
+        # to be asked for next, like when summarizing all units).
+        #
+        # { unit1_uid: {'stdout': ..., 'stderr': ..., 'log': ...},
+        #   ...
+        # }
+        #
+        self._large_data = collections.OrderedDict()  # LRU, see LARGE_CACHE
+        self._large_todo = collections.OrderedDict()  # final units to pull
+        self._large_lock = threading.Lock()
+
+        # wait_units() registers a waiter for the units it waits for, and the
+        # run loop moves the units from the waiter's 'pending' set to its
+        # 'arrived' list as they reach one of the waiter's states (and notifies
+        # the waiters).  Waiting thus costs O(state changes), not O(units).
+        #
+        # [ {'states': set(states), 'pending': set(uids), 'arrived': [[uid, state]]},
+        #   ...
+        # ]
+        #
+        self._waiters      = list()
+        self._waiters_cond = threading.Condition()
+
         # The manager-level list.
         #
         self._manager_callbacks = dict()
@@ -151,6 +184,20 @@ class UnitManagerController(threading.Thread):
 
         return self._shared_data[unit_uid]["data"]
 
+    # ------------------------------------------------------------------------
+    #
+    def get_compute_unit_details(self, unit_uid):
+        """Returns the full unit document of a ComputeUnit: the unit data, plus
+           the UNIT_STATIC_FIELDS and UNIT_LARGE_FIELDS, which are not kept
+           with the unit data, and are thus pulled from the DB.
+        """
+        details = dict(self.get_compute_unit_data(unit_uid))
+        fields  = self._dbs.get_compute_unit_fields([unit_uid],
+                                 UNIT_STATIC_FIELDS + UNIT_LARGE_FIELDS)
+        details.update(fields.get(unit_uid, dict()))
+
+        return details
+
     # ------------------------------------------------------------------------
     #
     def call_unit_state_callbacks(self, unit_id, new_state):
@@ -225,23 +272,42 @@ class UnitManagerController(threading.Thread):
             # asynchronous transfer operations.
             transfer_results = list()
 
+            # all unit updates stamp the unit's 'modified' field with the DB
+            # server time, and we only pull the units which changed since the
+            # latest stamp we have seen (the high-water mark).  An update can
+            # become visible a little after its stamp was taken, so we pull
+            # again what changed shortly before the mark, and skip the units
+            # we have seen already.  The first pull gets all units.
+            since = None
+
             while not self._stop.is_set() and \
                   not self._session._terminate.is_set():
 
                 # =================================================================
                 #
-                # Check and update units. This needs to be optimized at
-                # some point, i.e., state pulling should be conditional
-                # or triggered by a tailable MongoDB cursor, etc.
-                unit_list = self._dbs.get_compute_units(unit_manager_id=self.uid)
+                # Check and update units.
+                if since: changed = since - CHANGE_SLACK
+                else    : changed = None
+
+                unit_list = self._dbs.get_compute_unit_changes(
+                                unit_manager_id=self.uid, since=changed)
                 action    = False
+                arrived   = list()
 
                 for unit in unit_list:
-                    unit_id = str(unit["_id"])
+                    unit_id  = str(unit["_id"])
+                    modified = unit.get("modified")
+
+                    if modified and (not since or modified > since):
+                        since = modified
 
                     new_state = unit["state"]
                     if unit_id in self._shared_data:
-                        old_state = self._shared_data[unit_id]["data"]["state"]
+                        old_data = self._shared_data[unit_id]["data"]
+                        if modified and modified == old_data.get("modified"):
+                            # seen this update before
+                            continue
+                        old_state = old_data["state"]
                     else:
                         old_state = None
                         self._shared_data_lock.acquire()
@@ -257,12 +323,21 @@ class UnitManagerController(threading.Thread):
                     self._shared_data_lock.release()
 
                     if new_state != old_state:
+                        if new_state in (DONE, FAILED, CANCELED):
+                            with self._large_lock:
+                                if unit_id not in self._large_data:
+                                    self._large_todo[unit_id] = True
+
                         # The state of the unit has changed, We call all
                         # unit-level callbacks to propagate this.
                         self.call_unit_state_callbacks(unit_id, new_state)
 
+                        arrived.append([unit_id, new_state])
                         action = True
 
+                if arrived and self._waiters:
+                    self._notify_waiters(arrived)
+
                 # After the first iteration, we are officially initialized!
                 if not self._initialized.is_set():
                     self._initialized.set()
@@ -278,6 +353,10 @@ class UnitManagerController(threading.Thread):
 
 
         finally :
+            # wake up the waiters, we won't notify them anymore
+            with self._waiters_cond:
+                self._waiters_cond.notify_all()
+
             # shut down the autonomous input / output transfer worker(s)
             for worker in self._input_file_transfer_worker_pool:
                 logger.debug("uworker %s stops   itransfer %s" % (self.name, worker.name))
@@ -290,6 +369,98 @@ class UnitManagerController(threading.Thread):
                 logger.debug("uworker %s stopped otransfer %s" % (self.name, worker.name))
 
 
+    # ------------------------------------------------------------------------
+    #
+    def _notify_waiters(self, changes):
+        """Pass the given unit state changes ([uid, state]) on to the waiters
+        which wait for them.
+        """
+        with self._waiters_cond:
+
+            notify = False
+            for waiter in self._waiters:
+                for unit_id, state in changes:
+                    if state in waiter['states'] and unit_id in waiter['pending']:
+                        waiter['pending'].remove(unit_id)
+                        waiter['arrived'].append([unit_id, state])
+                        notify = True
+
+            if notify:
+                self._waiters_cond.notify_all()
+
+    # ------------------------------------------------------------------------
+    #
+    def wait_units(self, unit_uids, states, timeout=None, arrived_cb=None,
+                   tick_cb=None):
+        """Returns when all given units have been seen in one of the given
+        states, when the timeout expires, or when the controller stops.  For
+        each unit arriving in one of the states, arrived_cb(uid, state) is
+        called (if given), and tick_cb() is called at least once per
+        WAIT_SLICE seconds (if given).  Returns the set of units which did not
+        arrive.
+        """
+        self._initialized.wait()
+
+        waiter = {'states' : set(states), 'pending': set(), 'arrived': list()}
+
+        # check the current unit states, and register the waiter, in one go --
+        # otherwise we could miss state changes in between
+        with self._waiters_cond:
+            for unit_uid in unit_uids:
+                state = None
+                if unit_uid in self._shared_data:
+                    state = self._shared_data[unit_uid]['data']['state']
+                if state in waiter['states']:
+                    waiter['arrived'].append([unit_uid, state])
+                else:
+                    waiter['pending'].add(unit_uid)
+            self._waiters.append(waiter)
+
+        start = time.time()
+        try:
+            while True:
+
+                with self._waiters_cond:
+
+                    if  not waiter['arrived'] and waiter['pending'] \
+                        and not self._stop.is_set() \
+                        and not self._session._terminate.is_set():
+
+                        # wait in slices: an unbounded wait cannot be
+                        # interrupted in Python 2
+                        if timeout is None:
+                            self._waiters_cond.wait(WAIT_SLICE)
+                        elif timeout > time.time() - start:
+                            remaining = timeout - (time.time() - start)
+                            self._waiters_cond.wait(min(WAIT_SLICE, remaining))
+
+                    arrived           = waiter['arrived']
+                    pending           = len(waiter['pending'])
+                    waiter['arrived'] = list()
+
+                if arrived_cb:
+                    for unit_uid, state in arrived:
+                        arrived_cb(unit_uid, state)
+
+                if tick_cb:
+                    tick_cb()
+
+                if not pending:
+                    break
+
+                if  self._stop.is_set() or self._session._terminate.is_set():
+                    break
+
+                if  (None != timeout) and (timeout <= (time.time() - start)):
+                    logger.debug ("wait timed out")
+                    break
+
+        finally:
+            with self._waiters_cond:
+                self._waiters.remove(waiter)
+
+        return waiter['pending']
+
     # ------------------------------------------------------------------------
     #
     def register_unit_callback(self, unit, cb_func, cb_data=None):
@@ -380,14 +551,70 @@ class UnitManagerController(threading.Thread):
     def get_compute_unit_stdout(self, compute_unit_uid):
         """Returns the stdout for a compute unit.
         """
-        return self._dbs.get_compute_unit_stdout(compute_unit_uid)
+        return self._get_large_field(compute_unit_uid, 'stdout')
 
     # ------------------------------------------------------------------------
     #
     def get_compute_unit_stderr(self, compute_unit_uid):
         """Returns the stderr for a compute unit.
         """
-        return self._dbs.get_compute_unit_stderr(compute_unit_uid)
+        return self._get_large_field(compute_unit_uid, 'stderr')
+
+    # ------------------------------------------------------------------------
+    #
+    def get_compute_unit_log(self, compute_unit_uid):
+        """Returns the log entries for a compute unit.
+        """
+        return self._get_large_field(compute_unit_uid, 'log')
+
+    # ------------------------------------------------------------------------
+    #
+    def _get_large_field(self, unit_uid, field):
+        """Returns one of the UNIT_LARGE_FIELDS for a compute unit.  If the unit
+        is final, the field is pulled along with those of other final units
+        (see self._large_data), and the LARGE_CACHE most recently used units
+        are kept.
+        """
+        # the DB is queried without holding the lock, which the run loop needs
+        with self._large_lock:
+
+            if unit_uid in self._large_data:
+                # most recently used
+                data = self._large_data.pop(unit_uid)
+                self._large_data[unit_uid] = data
+                return data.get(field)
+
+            uids = list()
+            if unit_uid in self._large_todo:
+                uids.append(unit_uid)
+                del(self._large_todo[unit_uid])
+                while self._large_todo and len(uids) < BULK_FETCH:
+                    uids.append(self._large_todo.popitem(last=False)[0])
+
+        if not uids:
+            # the unit is not final (or not known to be final, yet, or evicted
+            # from the cache) -- pull, but don't keep
+            units_json = self._dbs.get_compute_unit_fields([unit_uid],
+                                                           UNIT_LARGE_FIELDS)
+            return units_json[unit_uid].get(field)
+
+        try:
+            units_json = self._dbs.get_compute_unit_fields(uids, UNIT_LARGE_FIELDS)
+
+        except Exception:
+            # try again next time
+            with self._large_lock:
+                for uid in uids:
+                    self._large_todo[uid] = True
+            raise
+
+        with self._large_lock:
+            for uid in uids:
+                self._large_data[uid] = units_json.get(uid, dict())
+            while len(self._large_data) > LARGE_CACHE:
+                self._large_data.popitem(last=False)
+
+        return units_json.get(unit_uid, dict()).get(field)
 
     # ------------------------------------------------------------------------
     #
@@ -411,14 +638,16 @@ class UnitManagerController(threading.Thread):
     # ------------------------------------------------------------------------
     #
     def publish_compute_units(self, units):
-        """register the unscheduled units in the database"""
+        """register the units in the database.  Units which have been assigned
+           to a pilot already (unit._pilot_uid) are published in state
+           PENDING_INPUT_STAGING, so that they don't need to be updated again
+           after the publication.  The state callbacks for those units are
+           called here.
+        """
 
-      # # units are UNSCHEDULED on publishing
-      # # FIXME: wtf, units are not even statefulll Bah!
-      # for unit in units:
-      #     unit['state'] = UNSCHEDULED
-      #     self._session.prof.prof('advance', uid=unit.uid, 
-      #                 msg=UNSCHEDULED, state=UNSCHEDULED)
+        for unit in units:
+            if unit._pilot_uid:
+                self._split_staging_directives(unit)
 
         # Add all units to the database.
         results = self._dbs.insert_compute_units(umgr_uid=self.uid,
@@ -427,15 +656,130 @@ class UnitManagerController(threading.Thread):
 
         assert len(units) == len(results)
 
-        # Match results with units.
+        # Match results with units.  The unit descriptions and staging
+        # directives are kept by the unit objects, so we don't keep them here.
+        assigned = list()
         for unit in units:
+            data = results[unit.uid]
+            for field in UNIT_STATIC_FIELDS + UNIT_LARGE_FIELDS:
+                data.pop(field, None)
+
             # Create a shared data store entry
             self._shared_data[unit.uid] = {
-                'data':          results[unit.uid],
+                'data':          data,
                 'callbacks':     [],
                 'facade_object': unit # weakref.ref(unit)
             }
 
+            if unit._pilot_uid:
+                self._session.prof.prof('advance', uid=unit.uid,
+                        msg=PENDING_INPUT_STAGING, state=PENDING_INPUT_STAGING)
+                assigned.append([unit.uid, PENDING_INPUT_STAGING])
+
+        # the run loop finds the assigned units in the state we cached for them,
+        # and thus won't see their state change.  We report it instead.
+        for unit_id, state in assigned:
+            self.call_unit_state_callbacks(unit_id, state)
+
+        if assigned and self._waiters:
+            self._notify_waiters(assigned)
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _split_staging_directives(self, unit):
+        """Split the staging directives of a unit over the transfer workers and
+           the agent.
+        """
+
+        # Create object for staging status tracking
+        unit.FTW_Input_Status = None
+        unit.FTW_Input_Directives = []
+        unit.Agent_Input_Status = None
+        unit.Agent_Input_Directives = []
+        unit.FTW_Output_Status = None
+        unit.FTW_Output_Directives = []
+        unit.Agent_Output_Status = None
+        unit.Agent_Output_Directives = []
+
+        # Split the input staging directives over the transfer worker and the agent
+        input_sds = unit.description.input_staging
+        if not isinstance(input_sds, list):
+            # Ugly, but is a workaround for iterating on attribute interface
+            # TODO: Verify if this piece of code is actually still required
+            if input_sds:
+                input_sds = [input_sds]
+            else:
+                input_sds = []
+
+        for input_sd_entry in input_sds:
+            action = input_sd_entry['action']
+            source = ru.Url(input_sd_entry['source'])
+            target = ru.Url(input_sd_entry['target'])
+
+            new_sd = {'action':   action,
+                      'source':   str(source),
+                      'target':   str(target),
+                      'flags':    input_sd_entry['flags'],
+                      'priority': input_sd_entry['priority'],
+                      'state':    PENDING
+            }
+
+            if action in [LINK, COPY, MOVE]:
+                unit.Agent_Input_Directives.append(new_sd)
+                unit.Agent_Input_Status = PENDING
+            elif action in [TRANSFER]:
+                if source.scheme and source.scheme != 'file':
+                    # If there is a scheme and it is different than "file",
+                    # assume a remote pull from the agent
+                    unit.Agent_Input_Directives.append(new_sd)
+                    unit.Agent_Input_Status = PENDING
+                else:
+                    # Transfer from local to sandbox
+                    unit.FTW_Input_Directives.append(new_sd)
+                    unit.FTW_Input_Status = PENDING
+            else:
+                logger.warn('Not sure if action %s makes sense for input staging' % action)
+
+        # Split the output staging directives over the transfer worker and the agent
+        output_sds = unit.description.output_staging
+        if not isinstance(output_sds, list):
+            # Ugly, but is a workaround for iterating on att iface
+            # TODO: Verify if this piece of code is actually still required
+            if output_sds:
+                output_sds = [output_sds]
+            else:
+                output_sds = []
+
+        for output_sds_entry in output_sds:
+            action = output_sds_entry['action']
+            source = ru.Url(output_sds_entry['source'])
+            target = ru.Url(output_sds_entry['target'])
+
+            new_sd = {'action':   action,
+                      'source':   str(source),
+                      'target':   str(target),
+                      'flags':    output_sds_entry['flags'],
+                      'priority': output_sds_entry['priority'],
+                      'state':    PENDING
+            }
+
+            if action == LINK or action == COPY or action == MOVE:
+                unit.Agent_Output_Directives.append(new_sd)
+                unit.Agent_Output_Status = NEW
+            elif action == TRANSFER:
+                if target.scheme and target.scheme != 'file':
+                    # If there is a scheme and it is different than "file",
+                    # assume a remote push from the agent
+                    unit.Agent_Output_Directives.append(new_sd)
+                    unit.Agent_Output_Status = NEW
+                else:
+                    # Transfer from sandbox back to local
+                    unit.FTW_Output_Directives.append(new_sd)
+                    unit.FTW_Output_Status = NEW
+            else:
+                logger.warn('Not sure if action %s makes sense for output staging' % action)
+
 
     # ------------------------------------------------------------------------
     #
@@ -445,9 +789,6 @@ class UnitManagerController(threading.Thread):
         """
 
         try:
-            cu_transfer   = list()
-            cu_notransfer = list()
-
             # Get some information about the pilot sandbox from the database.
             pilot_info = self._dbs.get_pilots(pilot_ids=pilot_uid)
             # TODO: this hack below relies on what?! That there is just one pilot?
@@ -458,94 +799,7 @@ class UnitManagerController(threading.Thread):
             # don't. The latter is added to the pilot directly, while the former
             # is added to the transfer queue.
             for unit in units:
-
-                # Create object for staging status tracking
-                unit.FTW_Input_Status = None
-                unit.FTW_Input_Directives = []
-                unit.Agent_Input_Status = None
-                unit.Agent_Input_Directives = []
-                unit.FTW_Output_Status = None
-                unit.FTW_Output_Directives = []
-                unit.Agent_Output_Status = None
-                unit.Agent_Output_Directives = []
-
-                # Split the input staging directives over the transfer worker and the agent
-                input_sds = unit.description.input_staging
-                if not isinstance(input_sds, list):
-                    # Ugly, but is a workaround for iterating on attribute interface
-                    # TODO: Verify if this piece of code is actually still required
-                    if input_sds:
-                        input_sds = [input_sds]
-                    else:
-                        input_sds = []
-
-                for input_sd_entry in input_sds:
-                    action = input_sd_entry['action']
-                    source = ru.Url(input_sd_entry['source'])
-                    target = ru.Url(input_sd_entry['target'])
-
-                    new_sd = {'action':   action,
-                              'source':   str(source),
-                              'target':   str(target),
-                              'flags':    input_sd_entry['flags'],
-                              'priority': input_sd_entry['priority'],
-                              'state':    PENDING
-                    }
-
-                    if action in [LINK, COPY, MOVE]:
-                        unit.Agent_Input_Directives.append(new_sd)
-                        unit.Agent_Input_Status = PENDING
-                    elif action in [TRANSFER]:
-                        if source.scheme and source.scheme != 'file':
-                            # If there is a scheme and it is different than "file",
-                            # assume a remote pull from the agent
-                            unit.Agent_Input_Directives.append(new_sd)
-                            unit.Agent_Input_Status = PENDING
-                        else:
-                            # Transfer from local to sandbox
-                            unit.FTW_Input_Directives.append(new_sd)
-                            unit.FTW_Input_Status = PENDING
-                    else:
-                        logger.warn('Not sure if action %s makes sense for input staging' % action)
-
-                # Split the output staging directives over the transfer worker and the agent
-                output_sds = unit.description.output_staging
-                if not isinstance(output_sds, list):
-                    # Ugly, but is a workaround for iterating on att iface
-                    # TODO: Verify if this piece of code is actually still required
-                    if output_sds:
-                        output_sds = [output_sds]
-                    else:
-                        output_sds = []
-
-                for output_sds_entry in output_sds:
-                    action = output_sds_entry['action']
-                    source = ru.Url(output_sds_entry['source'])
-                    target = ru.Url(output_sds_entry['target'])
-
-                    new_sd = {'action':   action,
-                              'source':   str(source),
-                              'target':   str(target),
-                              'flags':    output_sds_entry['flags'],
-                              'priority': output_sds_entry['priority'],
-                              'state':    PENDING
-                    }
-
-                    if action == LINK or action == COPY or action == MOVE:
-                        unit.Agent_Output_Directives.append(new_sd)
-                        unit.Agent_Output_Status = NEW
-                    elif action == TRANSFER:
-                        if target.scheme and target.scheme != 'file':
-                            # If there is a scheme and it is different than "file",
-                            # assume a remote push from the agent
-                            unit.Agent_Output_Directives.append(new_sd)
-                            unit.Agent_Output_Status = NEW
-                        else:
-                            # Transfer from sandbox back to local
-                            unit.FTW_Output_Directives.append(new_sd)
-                            unit.FTW_Output_Status = NEW
-                    else:
-                        logger.warn('Not sure if action %s makes sense for output staging' % action)
+                self._split_staging_directives(unit)
 
             # Bulk-add all units
             self._dbs.assign_compute_units_to_pilot(
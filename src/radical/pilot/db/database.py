@@ -27,6 +27,18 @@ COMMAND_TYPE                = "type"
 COMMAND_ARG                 = "arg"
 COMMAND_TIME                = "time"
 
+# unit fields which can grow large.  Those are not pulled along with the other
+# unit fields, but only on demand.
+UNIT_LARGE_FIELDS           = ["stdout", "stderr", "log"]
+
+# unit fields which don't change once the unit is scheduled.  The unit manager
+# keeps those with the unit objects, and does not pull them again.
+UNIT_STATIC_FIELDS          = ["description",
+                               "FTW_Input_Directives",
+                               "Agent_Input_Directives",
+                               "FTW_Output_Directives",
+                               "Agent_Output_Directives"]
+
 
 #-----------------------------------------------------------------------------
 #
@@ -79,6 +91,9 @@ class Session():
         self._w  = self._db["%s.cu" % sid]
         self._um = self._db["%s.um" % sid] 
 
+        # the unit manager pulls the units which changed since its last pull
+        self._w.ensure_index([("unitmanager", 1), ("modified", 1)])
+
         self._p  = self._db["%s.p"  % sid]
         self._pm = self._db["%s.pm" % sid] 
 
@@ -200,7 +215,7 @@ class Session():
         if self._s is None:
             raise Exception("No active session.")
 
-        cursor = self._w.find({"_id": unit_uid})
+        cursor = self._w.find({"_id": unit_uid}, {"stdout": 1})
 
         return cursor[0]['stdout']
 
@@ -212,7 +227,7 @@ class Session():
         if self._s is None:
             raise Exception("No active session.")
 
-        cursor = self._w.find({"_id": unit_uid})
+        cursor = self._w.find({"_id": unit_uid}, {"stderr": 1})
 
         return cursor[0]['stderr']
 
@@ -401,15 +416,17 @@ class Session():
 
     #--------------------------------------------------------------------------
     #
-    def get_compute_units(self, unit_manager_id, unit_ids=None):
-        """ Get yerself a bunch of compute units.
+    def get_compute_units(self, unit_manager_id, unit_ids=None, fields=None):
+        """ Get yerself a bunch of compute units.  If 'fields' is given, only
+            those fields of the units are returned.
         """
         if self._s is None:
             raise Exception("No active session.")
 
         if unit_ids is None:
             cursor = self._w.find(
-                {"unitmanager": unit_manager_id}
+                {"unitmanager": unit_manager_id},
+                fields
             )
 
         else:
@@ -420,7 +437,8 @@ class Session():
 
             cursor = self._w.find(
                 {"_id": {"$in": unit_oid},
-                 "unitmanager": unit_manager_id}
+                 "unitmanager": unit_manager_id},
+                fields
             )
 
         # https://www.quora.com/How-did-mongodb-return-duplicated-but-different-documents
@@ -430,6 +448,53 @@ class Session():
 
         return units_json.values()
 
+    #--------------------------------------------------------------------------
+    #
+    def get_compute_unit_changes(self, unit_manager_id, since=None):
+        """ Get the compute units which changed since the given time (or all
+            units if 'since' is None).
+
+            All updates of unit documents (except for the callback history)
+            stamp the 'modified' field with the DB server time (via
+            '$currentDate'), so that the stamps of the different writers (umgr,
+            transfer workers, agents) are comparable.
+            The UNIT_LARGE_FIELDS (see get_compute_unit_fields()) and the
+            UNIT_STATIC_FIELDS are not returned.
+        """
+        if self._s is None:
+            raise Exception("No active session.")
+
+        query = {"unitmanager": unit_manager_id}
+        if since is not None:
+            query["modified"] = {"$gte": since}
+
+        cursor = self._w.find(query, dict([[f, 0] for f in UNIT_LARGE_FIELDS
+                                                         + UNIT_STATIC_FIELDS]))
+
+        units_json = dict()
+        for obj in cursor:
+            units_json[obj['_id']] = obj
+
+        return units_json.values()
+
+    #--------------------------------------------------------------------------
+    #
+    def get_compute_unit_fields(self, unit_ids, fields):
+        """ Get the given fields of one or more compute units, as dict
+            {unit_id: {field: value}}.
+        """
+        if self._s is None:
+            raise Exception("No active session.")
+
+        cursor = self._w.find({"_id": {"$in": unit_ids}},
+                              dict([[f, 1] for f in fields]))
+
+        units_json = dict()
+        for obj in cursor:
+            units_json[obj['_id']] = obj
+
+        return units_json
+
     #--------------------------------------------------------------------------
     #
     def change_compute_units (self, filter_dict, set_dict, push_dict):
@@ -441,7 +506,8 @@ class Session():
 
         self._w.update(spec     = filter_dict, 
                        document = {"$set" : set_dict, 
-                                   "$push": push_dict}, 
+                                   "$push": push_dict,
+                                   "$currentDate": {"modified": True}},
                        multi    = True)
 
 
@@ -477,12 +543,14 @@ class Session():
                               "state"   : {"$in"  : src_states} }) \
                     .update ({"$set"    : {"state": state},
                               "$push"   : {"statehistory": {"state": state, "timestamp": ts}},
-                              "$push"   : {"log"  : {"message": log, "timestamp": ts}}})
+                              "$push"   : {"log"  : {"message": log, "timestamp": ts}},
+                              "$currentDate": {"modified": True}})
             else :
                 bulk.find   ({"_id"     : uid}) \
                     .update ({"$set"    : {"state": state},
                               "$push"   : {"statehistory": {"state": state, "timestamp": ts}},
-                              "$push"   : {"log"  : {"message": log, "timestamp": ts}}})
+                              "$push"   : {"log"  : {"message": log, "timestamp": ts}},
+                              "$currentDate": {"modified": True}})
 
         result = bulk.execute()
 
@@ -708,7 +776,8 @@ class Session():
                                    "FTW_Output_Directives": unit.FTW_Output_Directives,
                                    "Agent_Output_Status": unit.Agent_Output_Status,
                                    "Agent_Output_Directives": unit.Agent_Output_Directives
-                        }})
+                        },
+                         "$currentDate": {"modified": True}})
         result = bulk.execute()
 
         # TODO: log result.
@@ -722,14 +791,18 @@ class Session():
         if self._s is None:
             raise RuntimeError("No active session.")
 
+        # this does not stamp 'modified': the unit manager writes the history
+        # when it sees a final unit, and doesn't need to pull the unit again
         self._w.update({"_id": unit_uid},
                        {"$set": {"callbackhistory": callback_history}})
 
     #--------------------------------------------------------------------------
     #
     def insert_compute_units(self, umgr_uid, units, unit_log):
-        """ Adds one or more compute units to the database and sets their state
-            to 'PENDING'.
+        """ Adds one or more compute units to the database.  Units which are
+            assigned to a pilot already (unit._pilot_uid) are inserted in
+            state PENDING_INPUT_STAGING, along with their staging directives.
+            All units are inserted in a single bulk insert.
         """
         if self._s is None:
             raise RuntimeError("No active session.")
@@ -772,6 +845,27 @@ class Session():
                 "Agent_Output_Status":     None,
                 "Agent_Output_Directives": None
             }
+
+            if unit._pilot_uid:
+                log = "Scheduled for data transfer to ComputePilot %s." % unit._pilot_uid
+                unit_json.update({
+                    "pilot":         unit._pilot_uid,
+                    "pilot_sandbox": unit._pilot_sandbox,
+                    "sandbox":       unit.sandbox,
+                    "state":         PENDING_INPUT_STAGING,
+                    "statehistory":  [{"state": SCHEDULING,            "timestamp": ts},
+                                      {"state": PENDING_INPUT_STAGING, "timestamp": ts}],
+                    "log":           unit_log + [{"message": log, "timestamp": ts}],
+                    "FTW_Input_Status":        unit.FTW_Input_Status,
+                    "FTW_Input_Directives":    unit.FTW_Input_Directives,
+                    "Agent_Input_Status":      unit.Agent_Input_Status,
+                    "Agent_Input_Directives":  unit.Agent_Input_Directives,
+                    "FTW_Output_Status":       unit.FTW_Output_Status,
+                    "FTW_Output_Directives":   unit.FTW_Output_Directives,
+                    "Agent_Output_Status":     unit.Agent_Output_Status,
+                    "Agent_Output_Directives": unit.Agent_Output_Directives
+                })
+
             unit_docs.append(unit_json)
             results[unit.uid] = unit_json
 
@@ -12,8 +12,10 @@ __copyright__ = "Copyright 2014, http://radical.rutgers.edu"
 __license__   = "MIT"
 
 import os 
+import bisect
 import pprint
 import threading
+import collections
 
 from ..states   import *
 from ..utils    import logger
@@ -37,6 +39,11 @@ class BackfillingScheduler(Scheduler):
     This scheduler is not able to handle pilots which serve more than one unit
     manager concurrently.
 
+    Waiting units are kept in buckets by their number of cores (in submission
+    order), and the active pilots are kept sorted by their free capacity.
+    A reschedule only fills the pilots whose capacity changed, with units which
+    fit the free capacity, and does not look at any other waiting unit.
+
     """
 
     # -------------------------------------------------------------------------
@@ -50,6 +57,10 @@ class BackfillingScheduler(Scheduler):
         self.session = session
         self.waitq   = dict()
         self.runqs   = dict()
+        self.buckets = dict()   # cores -> OrderedDict of waiting units
+        self.sizes   = list()   # sorted cores of non-empty buckets
+        self.free    = list()   # sorted [caps, pid] of active pilots
+        self.freeidx = dict()   # pid -> entry in self.free
         self.pmgrs   = list()
         self.pilots  = dict()
         self.lock    = threading.RLock ()
@@ -109,7 +120,7 @@ class BackfillingScheduler(Scheduler):
                             found_unit = True
 
                             del self.runqs[pid][uid]
-                            self.waitq[uid] = unit
+                            self._waitq_add (unit)
 
                           # self._dump ('before reschedule %s' % uid)
                             self._reschedule (uid=uid)
@@ -131,7 +142,7 @@ class BackfillingScheduler(Scheduler):
                     # the pilot which owned this CU should now have free slots available
                     # FIXME: how do I get the pilot from the CU?
                     
-                    pid = unit.execution_details.get ('pilot', None)
+                    pid = unit.pilot_id
 
                     if  not pid :
                         raise RuntimeError ('cannot handle final unit %s w/o pilot information' % uid)
@@ -146,6 +157,7 @@ class BackfillingScheduler(Scheduler):
 
                             del self.runqs[pid][uid]
                             self.pilots[pid]['caps'] += unit.description.cores
+                            self._index_pilot (pid)
                             self._reschedule (target_pid=pid)
                             found_unit = True
 
@@ -181,6 +193,7 @@ class BackfillingScheduler(Scheduler):
     
     
                 self.pilots[pid]['state'] = state
+                self._index_pilot (pid)
                 logger.debug ("[SchedulerCallback]: ComputePilot %s changed to %s" % (pid, state))
     
                 if  state in [ACTIVE] :
@@ -268,6 +281,7 @@ class BackfillingScheduler(Scheduler):
 
                     # we can't use this pilot anymore...  
                     del self.pilots[pid]
+                    self._index_pilot (pid)
                     # FIXME: how can I *un*register a pilot callback?
                     
     
@@ -305,6 +319,7 @@ class BackfillingScheduler(Scheduler):
             self.pilots[pid]['caps'] += int((100+OVERSUBSCRIPTION_RATE) \
                                             * pilot.description.cores   \
                                             / 100.0)
+            self._index_pilot (pid)
 
             # make sure we register callback only once per pmgr
             pmgr = pilot.pilot_manager
@@ -328,6 +343,7 @@ class BackfillingScheduler(Scheduler):
             # UM what happens to those.
 
             del self.pilots[pid]
+            self._index_pilot (pid)
             # FIXME: how can I *un*register a pilot callback?
 
             # no need to schedule, really
@@ -341,6 +357,7 @@ class BackfillingScheduler(Scheduler):
 
             # this call really just adds the incoming units to the wait queue and
             # then calls reschedule() to have them picked up.
+            new_units = list()
             for unit in units :
 
                 uid = unit.uid
@@ -357,10 +374,11 @@ class BackfillingScheduler(Scheduler):
                     #        'SCHEDULING', this is only reached here...
                     raise RuntimeError ('Unit %s not in NEW or UNSCHEDULED state (%s)' % (unit.uid, unit.state))
 
-                self.waitq[uid] = unit
+                self._waitq_add (unit)
+                new_units.append (unit)
 
             # lets see what we can do about the known units...
-            self._reschedule ()
+            self._reschedule (new_units=new_units)
 
     
     # -------------------------------------------------------------------------
@@ -384,7 +402,7 @@ class BackfillingScheduler(Scheduler):
                 # NOTE: we don't care if that pilot had any CUs active -- its up to the
                 # UM what happens to those.
 
-                del self.waitq[uid]
+                self._waitq_remove (uid)
                 # FIXME: how can I *un*register a pilot callback?
                 # FIXME: is this is a race condition with the unit state callback
                 #        actions on the queues?
@@ -392,14 +410,112 @@ class BackfillingScheduler(Scheduler):
 
     # -------------------------------------------------------------------------
     #
-    def _reschedule (self, target_pid=None, uid=None) :
+    def _waitq_add (self, unit) :
+
+        cores = unit.description.cores
+
+        if  cores not in self.buckets :
+            self.buckets[cores] = collections.OrderedDict ()
+            bisect.insort (self.sizes, cores)
+
+        self.buckets[cores][unit.uid] = unit
+        self.waitq[unit.uid] = unit
+
+
+    # -------------------------------------------------------------------------
+    #
+    def _waitq_remove (self, uid) :
+
+        unit  = self.waitq.pop (uid)
+        cores = unit.description.cores
+
+        del self.buckets[cores][uid]
+
+        if  not self.buckets[cores] :
+            del self.buckets[cores]
+            del self.sizes[bisect.bisect_left (self.sizes, cores)]
+
+        return unit
+
+
+    # -------------------------------------------------------------------------
+    #
+    def _index_pilot (self, pid) :
+        """
+        Update the entry of a pilot in the free capacity index, after its caps
+        or state changed.  Only active pilots are indexed.
+        """
+
+        entry = self.freeidx.pop (pid, None)
+        if  entry :
+            del self.free[bisect.bisect_left (self.free, entry)]
+
+        if  pid in self.pilots and self.pilots[pid]['state'] in [ACTIVE] :
+            entry = [self.pilots[pid]['caps'], pid]
+            bisect.insort (self.free, entry)
+            self.freeidx[pid] = entry
+
+
+    # -------------------------------------------------------------------------
+    #
+    def _assign (self, unit, pid, schedule) :
+
+        uid = unit.uid
+
+        # sanity check on unit state
+        if  unit.state not in [NEW, SCHEDULING, UNSCHEDULED] :
+            raise RuntimeError ("scheduler requires NEW or UNSCHEDULED units (%s:%s)"\
+                            % (uid, unit.state))
+
+        # scheduled units are removed from the waitq
+        self._waitq_remove (uid)
+        self.runqs[pid][uid]      = unit
+        self.pilots[pid]['caps'] -= unit.description.cores
+        schedule['units'][unit]   = pid
+
+
+    # -------------------------------------------------------------------------
+    #
+    def _fill (self, pid, schedule) :
+        """
+        Assign waiting units to the given pilot for as long as any of them fit
+        its free capacity.  The largest fitting units go first, and units of
+        the same size in submission order.
+        """
+
+        pilot = self.pilots[pid]
+
+        while self.sizes :
+
+            idx = bisect.bisect_right (self.sizes, pilot['caps'])
+            if  not idx :
+                break
+
+            bucket = self.buckets[self.sizes[idx - 1]]
+            self._assign (bucket[next (iter (bucket))], pid, schedule)
+
+        self._index_pilot (pid)
+
+
+    # -------------------------------------------------------------------------
+    #
+    def _reschedule (self, target_pid=None, uid=None, new_units=None) :
 
         with self.lock :
 
-            # dig through the list of waiting CUs, and try to find a pilot for each
-            # of them.  This enacts first-come-first-served, but will be unbalanced
-            # if the units in the queue are of different sizes.  That problem is
-            # ignored at this point.
+            # try to find a pilot for waiting CUs.  We maintain the invariant
+            # that no waiting unit fits the free capacity of any active pilot
+            # after a reschedule, so we only need to look at what changed:
+            #
+            #   - a single unit returned to the waitq (uid):
+            #     try the pilot with the largest free capacity
+            #   - a pilot freed capacity, or became active (target_pid):
+            #     fill that pilot
+            #   - new units (new_units):
+            #     fill all pilots which can hold the smallest waiting unit
+            #
+            # Units of the same size are served first-come-first-served, but
+            # larger units are preferred over smaller ones.
             #
             # if any units get scheduled, we push a dictionary to the UM to enact
             # the schedule:
@@ -409,6 +525,8 @@ class BackfillingScheduler(Scheduler):
             #     unit_4: [pilot_id_2, pilot_resource_name]
             #     ...
             #   }
+            # New units which cannot be scheduled are listed with pilot 'None'.
+            # The units waiting from earlier schedules are not listed again.
 
             if  not len(self.pilots.keys ()) :
                 # no pilots to  work on, yet.
@@ -426,8 +544,9 @@ class BackfillingScheduler(Scheduler):
 
             logger.debug ("schedule (%s units waiting)" % len(self.waitq))
 
+            if  new_units is None :
+                new_units = list()
 
-            units_to_schedule = list()
             if  uid :
 
                 if  uid not in self.waitq :
@@ -435,58 +554,40 @@ class BackfillingScheduler(Scheduler):
                     logger.warning ("cannot schedule -- unknown unit %s" % uid)
                     raise RuntimeError ("Invalid unit (%s)" % uid)
 
-                units_to_schedule.append (self.waitq[uid])
-
-            else :
-                # just copy the whole waitq
-                for uid in self.waitq :
-                    units_to_schedule.append (self.waitq[uid])
-
-
-            for unit in units_to_schedule :
-
-                uid = unit.uid
-                ud  = unit.description
-
-                # sanity check on unit state
-                if  unit.state not in [NEW, SCHEDULING, UNSCHEDULED] :
-                    raise RuntimeError ("scheduler requires NEW or UNSCHEDULED units (%s:%s)"\
-                                    % (uid, unit.state))
-
-              # logger.debug ("examine unit  %s (%s cores)" % (uid, ud.cores))
+                unit = self.waitq[uid]
+                new_units.append (unit)
 
-                for pid in self.pilots :
+                if  self.free and self.free[-1][0] >= unit.description.cores :
+                    pid = self.free[-1][1]
+                    self._assign (unit, pid, schedule)
+                    self._index_pilot (pid)
 
-                  # logger.debug ("        pilot %s (%s caps, state %s)" \
-                  #            % (pid, self.pilots[pid]['state'], self.pilots[pid]['caps']))
+            elif target_pid :
 
-                    if  self.pilots[pid]['state'] in [ACTIVE] :
+                if  target_pid in self.freeidx :
+                    self._fill (target_pid, schedule)
 
-                        if  ud.cores <= self.pilots[pid]['caps'] :
-                    
-                          # logger.debug ("        unit  %s fits on pilot %s" % (uid, pid))
+            elif self.sizes :
 
-                            self.pilots[pid]['caps'] -= ud.cores
-                            schedule['units'][unit]   = pid
-
-                            # scheduled units are removed from the waitq
-                            del self.waitq[uid]
-                            self.runqs[pid][uid] = unit
-                            break
+                # pilots with room for the smallest waiting unit, largest first
+                idx = bisect.bisect_left (self.free, [self.sizes[0], ''])
+                for caps, pid in reversed (self.free[idx:]) :
+                    if  not self.sizes :
+                        break
+                    self._fill (pid, schedule)
 
+            # new units were not scheduled...
+            max_cores = max ([p['cores'] for p in self.pilots.values ()])
+            for unit in new_units :
 
-                    # unit was not scheduled...
+                if  unit.uid in self.waitq :
                     schedule['units'][unit] = None
 
                 # print a warning if a unit cannot possibly be scheduled, ever
-                can_handle_unit = False
-                for pid in self.pilots :
-                    if  unit.description.cores <= self.pilots[pid]['cores'] :
-                        can_handle_unit=True
-                        break
+                if  unit.description.cores > max_cores :
+                    logger.warning ('cannot handle unit %s with current set of pilots' % unit.uid)
 
-                if  not can_handle_unit :
-                    logger.warning ('cannot handle unit %s with current set of pilots' % uid)
+            schedule['waitq_size'] = len(self.waitq)
 
           # pprint.pprint (schedule)
 
@@ -25,6 +25,8 @@ class DirectSubmissionScheduler(Scheduler):
     scheduling algorithm.
     """
 
+    synchronous = True
+
     # -------------------------------------------------------------------------
     #
     def __init__(self, manager, session):
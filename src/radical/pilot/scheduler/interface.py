@@ -19,6 +19,12 @@ class Scheduler(object):
     """Scheduler provides an abstsract interface for all schedulers.
     """
 
+    # Schedulers which return the complete schedule from schedule() (and don't
+    # call manager.handle_schedule() themselves) can schedule units before
+    # they are published.  The unit manager then inserts them into the
+    # database as assigned to their pilots.
+    synchronous = False
+
     # -------------------------------------------------------------------------
     # 
     def __init__(self, manager, session):
@@ -26,6 +26,8 @@ class RoundRobinScheduler(Scheduler):
     scheduling algorithm.
     """
 
+    synchronous = True
+
     # -------------------------------------------------------------------------
     #
     def __init__(self, manager, session):
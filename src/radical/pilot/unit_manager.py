@@ -23,9 +23,13 @@ from .states       import *
 from .exceptions   import *
 from .utils        import logger
 from .compute_unit import ComputeUnit
+from .compute_unit_description import ComputeUnitDescription
 from .controller   import UnitManagerController
 from .scheduler    import get_scheduler, SCHED_DEFAULT
 
+# number of units which are created, scheduled and published at once
+SUBMIT_BULK = 1024
+
 # -----------------------------------------------------------------------------
 #
 class UnitManager(object):
@@ -390,9 +394,17 @@ class UnitManager(object):
         **Arguments:**
 
             * **unit_descriptions** [:class:`radical.pilot.ComputeUnitDescription`
-              or list of :class:`radical.pilot.ComputeUnitDescription`]: The
+              or list (or any other iterable, like a generator) of
+              :class:`radical.pilot.ComputeUnitDescription`]: The
               description of the compute unit instance(s) to create.
 
+        The units are created, scheduled and published in chunks of
+        `SUBMIT_BULK` units, so that the units of the first chunks can be
+        transferred and executed while later chunks are still prepared, and so
+        that large iterables don't need to be expanded into a list.  Invalid
+        unit descriptions raise an exception when their chunk is reached --
+        the units of earlier chunks are submitted already.
+
         **Returns:**
 
               * A list of :class:`radical.pilot.ComputeUnit` objects.
@@ -406,13 +418,65 @@ class UnitManager(object):
             raise RuntimeError("instance is already closed")
 
         return_list_type = True
-        if not isinstance(unit_descriptions, list):
+        if isinstance(unit_descriptions, ComputeUnitDescription):
             return_list_type  = False
             unit_descriptions = [unit_descriptions]
 
-        if len(unit_descriptions) == 0:
+        if isinstance(unit_descriptions, list):
+            if len(unit_descriptions) == 0:
+                raise ValueError('cannot submit no unit descriptions')
+            logger.report.info('<<submit %d unit(s)\n\t' % len(unit_descriptions))
+        else:
+            logger.report.info('<<submit unit(s)\n\t')
+
+        # we return a list of compute units.  The units which synchronous
+        # schedulers could not schedule are counted over all chunks, so that
+        # the wait queue size is reported once per call.
+        units       = list()
+        chunk       = list()
+        unscheduled = 0
+
+        try:
+            for ud in unit_descriptions:
+                chunk.append(ud)
+                if len(chunk) >= SUBMIT_BULK:
+                    submitted, waiting = self._submit_chunk(chunk)
+                    units       += submitted
+                    unscheduled += len(waiting)
+                    chunk        = list()
+
+            if chunk:
+                submitted, waiting = self._submit_chunk(chunk)
+                units       += submitted
+                unscheduled += len(waiting)
+
+        finally:
+            if units and self._scheduler.synchronous:
+                self._set_wait_queue_size (unscheduled)
+
+        if not units:
             raise ValueError('cannot submit no unit descriptions')
 
+        if self._session._rec:
+            self._rec_id += 1
+
+        logger.report.ok('>>ok\n')
+
+        if  return_list_type :
+            return units
+        else :
+            return units[0]
+
+
+    # -------------------------------------------------------------------------
+    #
+    def _submit_chunk(self, unit_descriptions):
+        """create, schedule and publish the units for a chunk of unit
+        descriptions.  Returns the units, and those of them which a synchronous
+        scheduler could not schedule -- the caller reports the wait queue size
+        for those.
+        """
+
         for ud in unit_descriptions:
 
             if float(ud.cores) != int(ud.cores):
@@ -423,11 +487,6 @@ class UnitManager(object):
                 error_msg = "ComputeUnittDescription 'cores' must be positive."
                 raise BadParameter(error_msg)
 
-        logger.report.info('<<submit %d unit(s)\n\t' % len(unit_descriptions))
-
-        # we return a list of compute units
-        ret = list()
-
         # the scheduler will return a dictionary of the form:
         #   {
         #     ud_1 : pilot_id_a,
@@ -447,31 +506,51 @@ class UnitManager(object):
             units.append(u)
 
             if self._session._rec:
-                import radical.utils as ru
                 ru.write_json(ud.as_dict(), "%s/%s.batch.%03d.json" \
                         % (self._session._rec, u.uid, self._rec_id))
             logger.report.progress()
-        if self._session._rec:
-            self._rec_id += 1
 
-        self._worker.publish_compute_units (units=units)
+        # Schedulers which call back into handle_schedule() need the units to
+        # be published first.  Otherwise, we schedule before publishing, and
+        # insert the units as assigned to their pilots right away -- that
+        # saves the separate assignment and state updates per unit.
+        if not self._scheduler.synchronous:
+
+            self._worker.publish_compute_units (units=units)
+
+            schedule = None
+            try:
+                schedule = self._scheduler.schedule (units=units)
+
+            except Exception as e:
+                logger.exception ("Internal error - unit scheduler failed")
+                raise 
+
+            self.handle_schedule (schedule)
+
+            return units, []
 
         schedule = None
         try:
             schedule = self._scheduler.schedule (units=units)
-       
+
         except Exception as e:
             logger.exception ("Internal error - unit scheduler failed")
             raise 
 
-        self.handle_schedule (schedule)
+        pilot_cu_map, unscheduled, failed = self._prepare_schedule (schedule)
 
-        logger.report.ok('>>ok\n')
+        for pid in pilot_cu_map :
+            for unit in pilot_cu_map[pid] :
+                unit._pilot_uid     = pid
+                unit._pilot_sandbox = schedule['pilots'][pid]['sandbox']
+                unit._local_state   = PENDING_INPUT_STAGING
 
-        if  return_list_type :
-            return units
-        else :
-            return units[0]
+        self._worker.publish_compute_units (units=units)
+
+        self._handle_unscheduled (unscheduled, failed)
+
+        return units, unscheduled
 
 
     # -------------------------------------------------------------------------
@@ -490,8 +569,41 @@ class UnitManager(object):
       # import pprint
       # pprint.pprint (schedule)
       #
+        pilot_cu_map, unscheduled, failed = self._prepare_schedule (schedule)
+
+        # submit to all pilots which got something submitted to
+        for pid in pilot_cu_map.keys():
+
+            if  len(pilot_cu_map[pid]) :
+                self._worker.schedule_compute_units (pilot_uid=pid,
+                                                     units=pilot_cu_map[pid])
+
+        # schedulers which don't list all waiting units in each schedule report
+        # the size of their wait queue
+        waitq_size = schedule.get ('waitq_size')
+        if  waitq_size is None :
+            waitq_size = len(unscheduled)
+
+        self._set_wait_queue_size (waitq_size)
+        self._handle_unscheduled  (unscheduled, failed)
+
+
+    # -------------------------------------------------------------------------
+    #
+    def _prepare_schedule (self, schedule) :
+        """
+        Collect the units of a schedule per pilot, set their sandboxes and
+        expand their kernels.  Returns the map of pilots to units, and the lists
+        of unscheduled units and of units for which the kernel expansion failed.
+        Units assigned to a lost pilot are in neither of those.
+        """
+
         pilot_cu_map = dict()
         unscheduled  = list()
+        failed       = list()
+
+        if  not schedule :
+            return pilot_cu_map, unscheduled, failed
 
         pilot_ids = self.list_pilots ()
 
@@ -514,7 +626,6 @@ class UnitManager(object):
                 pilot_cu_map[pid].append (unit)
 
 
-        # submit to all pilots which got something submitted to
         for pid in pilot_cu_map.keys():
 
             units_to_schedule = list()
@@ -540,9 +651,7 @@ class UnitManager(object):
                         logger.error ("Kernels are not supported in" \
                               "compute unit descriptions -- install " \
                               "radical.ensemblemd.mdkernels!")
-                        # FIXME: unit needs a '_set_state() method or something!
-                        self._session._dbs.set_compute_unit_state (unit._uid, FAILED, 
-                                ["kernel expansion failed"])
+                        failed.append (unit)
                         continue
 
                     pilot_resource = schedule['pilots'][pid]['resource']
@@ -558,19 +667,39 @@ class UnitManager(object):
 
                 units_to_schedule.append (unit)
 
-            if  len(units_to_schedule) :
-                self._worker.schedule_compute_units (pilot_uid=pid,
-                                                     units=units_to_schedule)
+            pilot_cu_map[pid] = units_to_schedule
+
+        return pilot_cu_map, unscheduled, failed
+
 
+    # -------------------------------------------------------------------------
+    #
+    def _set_wait_queue_size (self, waitq_size) :
+        """
+        report any change in wait_queue_size
+        """
 
-        # report any change in wait_queue_size
-        old_wait_queue_size = self.wait_queue_size
+        old_wait_queue_size  = self.wait_queue_size
+        self.wait_queue_size = waitq_size
 
-        self.wait_queue_size = len(unscheduled)
         if  old_wait_queue_size != self.wait_queue_size :
             self._worker.fire_manager_callback (WAIT_QUEUE_SIZE, self,
                                                 self.wait_queue_size)
 
+
+    # -------------------------------------------------------------------------
+    #
+    def _handle_unscheduled (self, unscheduled, failed) :
+        """
+        Update the state of the units which were not scheduled, or for which
+        the kernel expansion failed, after they have been published.
+        """
+
+        for unit in failed :
+            # FIXME: unit needs a '_set_state() method or something!
+            self._session._dbs.set_compute_unit_state (unit._uid, FAILED, 
+                    ["kernel expansion failed"])
+
         if  len(unscheduled) :
             self._worker.unschedule_compute_units (units=unscheduled)
 
@@ -664,55 +793,36 @@ class UnitManager(object):
             unit_ids = [unit_ids]
 
 
-        units  = self.get_units(unit_ids)
-        start  = time.time()
+        if unit_ids is None:
+            unit_ids = self.list_units()
 
-        logger.report.info('<<wait for %d unit(s)\n\t' % len(units))
+        logger.report.info('<<wait for %d unit(s)\n\t' % len(unit_ids))
 
-        # We don't want to iterate over all units again and again, as that would
-        # duplicate checks on units which were found in matching states.  So we
-        # create a dict and record units we have checked already.
-        checked_units = {unit: False for unit in units}
-
-        # Initially we need to check all units
-        to_check = units
+        def _arrived(unit_id, unit_state):
+            if unit_state in [FAILED]:
+                logger.report.idle(color='error', c='-')
+            elif unit_state in [CANCELED]:
+                logger.report.idle(color='warn', c='*')
+            else:
+                logger.report.idle(color='ok', c='+')
 
+        # the controller notifies us about the units arriving in the requested
+        # states, so we don't need to check all units again and again.
         logger.report.idle(mode='start')
-        while to_check and not self._session._terminate.is_set():
-
-            logger.report.idle()
-
-            for unit in to_check:
-                if unit.state in state:
-                    # stop watching this unit
-                    checked_units[unit] = True
-                    if unit.state in [FAILED]:
-                        logger.report.idle(color='error', c='-')
-                    elif unit.state in [CANCELED]:
-                        logger.report.idle(color='warn', c='*')
-                    else:
-                        logger.report.idle(color='ok', c='+')
-
-            # check if units remain to be waited for.
-            to_check = [unit for unit in checked_units if not checked_units[unit]]
-
-            # check timeout
-            if  (None != timeout) and (timeout <= (time.time() - start)):
-                if  to_check :
-                    logger.debug ("wait timed out")
-                break
-
-            # if units remain to be watched and we have still time
-            if to_check:
-                time.sleep (0.5)
-
+        to_check = self._worker.wait_units(unit_ids, state, timeout, _arrived,
+                                           logger.report.idle)
         logger.report.idle(mode='stop')
 
         if not to_check: logger.report.ok(  '>>ok\n')
         else           : logger.report.warn('>>timeout\n')
 
         # grab the current states to return
-        states = [unit.state for unit in checked_units]
+        states = list()
+        for unit_id in unit_ids:
+            try:
+                states.append(self._worker.get_compute_unit_data(unit_id)['state'])
+            except KeyError:
+                states.append(None)
 
         # done waiting
         if  return_list_type :
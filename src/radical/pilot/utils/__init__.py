@@ -14,7 +14,9 @@ logger.info('radical.pilot        version: %s' % version_detail)
 from db_utils           import *
 from prof_utils         import *
 from misc               import *
+from serializer         import *
 from queue              import *
+from unit_store         import *
 from pubsub             import *
 from analysis           import *
 from session            import *
@@ -92,7 +92,28 @@ _info_entries = [
 
 # ------------------------------------------------------------------------------
 #
-tmp = None
+def _filter_mask(frame, filters):
+    """
+    Return a boolean series which is True for all rows of the frame which match
+    any of the given filter dicts, ie. which match all col/pat pairs of one of
+    the filters.
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    mask = np.zeros(len(frame), dtype=bool)
+    for f in filters:
+        match = np.ones(len(frame), dtype=bool)
+        for col, pat in f.iteritems():
+            match &= (frame[col] == pat).values
+        mask |= match
+
+    return pd.Series(mask, index=frame.index)
+
+
+# ------------------------------------------------------------------------------
+#
 def add_concurrency (frame, tgt, spec):
     """
     add a column 'tgt' which is a cumulative sum of conditionals of another row.
@@ -131,74 +152,28 @@ def add_concurrency (frame, tgt, spec):
                }
         add_concurrency (df, 'concurrently_running', spec)
     """
-    
+
     import numpy as np
+    import pandas as pd
 
-    # create a temporary row over which we can do the commulative sum
-    # --------------------------------------------------------------------------
-    def _conc (row, spec):
-
-        # row must match any filter dict in 'spec[in/out]' 
-        # for any filter dict it must match all col/pat pairs
-
-        # for each in filter
-        for f in spec['in']:
-            match = 1 
-            # for each col/val in that filter
-            for col, pat in f.iteritems():
-                if row[col] != pat:
-                    match = 0
-                    break
-            if match:
-                # one filter matched!
-              # print " + : %-20s : %.2f : %-20s : %s " % (row['uid'], row['time'], row['event'], row['message'])
-                return 1
-
-        # for each out filter
-        for f in spec['out']:
-            match = 1 
-            # for each col/val in that filter
-            for col, pat in f.iteritems():
-                if row[col] != pat:
-                    match = 0
-                    break
-            if match:
-                # one filter matched!
-              # print " - : %-20s : %.2f : %-20s : %s " % (row['uid'], row['time'], row['event'], row['message'])
-                return -1
-
-        # no filter matched
-      # print "   : %-20s : %.2f : %-20s : %s " % (row['uid'], row['time'], row['event'], row['message'])
-        return  np.NaN
-    # --------------------------------------------------------------------------
+    # a unit entering counts +1, a unit leaving counts -1 (entering wins if
+    # a row matches both).  Other rows are NaN, and are skipped by the
+    # cumulative sum.
+    m_in  = _filter_mask(frame, spec['in'])
+    m_out = _filter_mask(frame, spec['out'])
+    conc  = pd.Series(np.where(m_in, 1.0, np.where(m_out, -1.0, np.NaN)),
+                      index=frame.index).cumsum()
+
+    # sanitize concurrency: negative values indicate incorrect event ordering,
+    # so we set the respective values to NaN
+    conc  = conc.mask(conc < 0)
 
     # we only want to later look at changes of the concurrency -- leading or trailing 
     # idle times are to be ignored.  We thus set repeating values of the cumsum to NaN, 
     # so that they can be filtered out when ploting: df.dropna().plot(...).  
     # That specifically will limit the plotted time range to the area of activity. 
     # The full time range can still be plotted when ommitting the dropna() call.
-    # --------------------------------------------------------------------------
-    def _time (x):
-        global tmp
-        if     x != tmp: tmp = x
-        else           : x   = np.NaN
-        return x
-
-
-    # --------------------------------------------------------------------------
-    # sanitize concurrency: negative values indicate incorrect event ordering,
-    # so we set the repesctive values to 0
-    # --------------------------------------------------------------------------
-    def _abs (x):
-        if x < 0:
-            return np.NaN
-        return x
-    # --------------------------------------------------------------------------
-    
-    frame[tgt] = frame.apply(lambda row: _conc(row, spec), axis=1).cumsum()
-    frame[tgt] = frame.apply(lambda row: _abs (row[tgt]),  axis=1)
-    frame[tgt] = frame.apply(lambda row: _time(row[tgt]),  axis=1)
-  # print frame[[tgt, 'time']]
+    frame[tgt] = conc.where(conc != conc.shift())
 
     return frame
 
@@ -219,19 +194,24 @@ def add_frequency(frame, tgt, window, spec):
     The method looks backwards, so the resulting frequency column contains the
     frequency which applied *up to* that point in time.
     """
-    
-    # --------------------------------------------------------------------------
-    def _freq(t, _tmp, _window):
-        # get sequence of frame which falls within the time window, and return
-        # length of that sequence
-        return len(_tmp.uid[(_tmp.time > t-_window) & (_tmp.time <= t)])
-    # --------------------------------------------------------------------------
-    
+
+    import numpy as np
+    import pandas as pd
+
     # filter the frame by the given spec
     tmp = frame
     for key,val in spec.iteritems():
         tmp = tmp[tmp[key].isin([val])]
-    frame[tgt] = tmp.time.apply(_freq, args=[tmp, window])
+
+    # the number of events in the window (t-window, t] is the number of events
+    # up to t, minus the number of events up to t-window.  We find both by
+    # bisecting the sorted event times.
+    times  = tmp['time'].values.astype(float)
+    ref    = np.sort(times)
+    counts = np.searchsorted(ref, times,          side='right') \
+           - np.searchsorted(ref, times - window, side='right')
+
+    frame[tgt] = pd.Series(counts, index=tmp.index)
 
     return frame
 
@@ -267,7 +247,6 @@ def add_event_count(frame, tgt, spec):
 
 # ------------------------------------------------------------------------------
 #
-t0 = None
 def calibrate_frame(frame, spec):
     """
     move the time axis of a profiling frame so that t_0 is at the first event
@@ -275,49 +254,14 @@ def calibrate_frame(frame, spec):
     'add_concurrency' (list of dicts with col:pat filters)
     """
 
-    # --------------------------------------------------------------------------
-    def _find_t0 (row, spec):
-
-        # row must match any filter dict in 'spec[in/out]' 
-        # for any filter dict it must match all col/pat pairs
-        global t0
-        if t0 is not None:
-            # already found t0
-            return
-
-        # for each col/val in that filter
-        for f in spec:
-            match = 1 
-            for col, pat in f.iteritems():
-                if row[col] != pat:
-                    match = 0
-                    break
-            if match:
-                # one filter matched!
-                t0 = row['time']
-                return
-    # --------------------------------------------------------------------------
-
-    # --------------------------------------------------------------------------
-    def _calibrate (row, t0):
-
-        if t0 is None:
-            # no t0...
-            return
-
-        return row['time'] - t0
-    # --------------------------------------------------------------------------
-
-    # we need to iterate twice over the frame: first to find t0, then to
-    # calibrate the time axis
-    global t0
-    t0 = None # no t0
-    frame.apply(lambda row: _find_t0  (row, spec), axis=1)
+    mask = _filter_mask(frame, spec)
 
-    if t0 == None:
+    if not mask.any():
         print "Can't recalibrate, no matching timestamp found"
         return
-    frame['time'] = frame.apply(lambda row: _calibrate(row, t0  ), axis=1)
+
+    t0 = frame['time'][mask].iloc[0]
+    frame['time'] = frame['time'] - t0
 
     return frame
 
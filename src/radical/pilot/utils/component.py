@@ -1,11 +1,14 @@
 
 import os
 import sys
+import zmq
 import time
+import errno
 import signal
 
 import threading       as mt
 import multiprocessing as mp
+import collections     as mc
 import radical.utils   as ru
 
 from ..states    import *
@@ -23,6 +26,22 @@ from .pubsub     import PUBSUB_ZMQ   as rpu_PUBSUB_ZMQ
 from .pubsub     import PUBSUB_PUB   as rpu_PUBSUB_PUB
 from .pubsub     import PUBSUB_SUB   as rpu_PUBSUB_SUB
 
+from .serializer import Serializer   as rpu_Serializer
+from .unit_store import UnitStore    as rpu_UnitStore
+
+# the main event loop wakes up at least this often to check for termination, and
+# at most this often to check for idle callbacks which are due (in seconds)
+_MAX_POLL_TIMEOUT = 1.0
+_MIN_POLL_TIMEOUT = 0.01
+
+# units leave the agent in these states
+_STATES_LEAVE      = [DONE, FAILED, CANCELED, PENDING_OUTPUT_STAGING]
+
+# state notifications only carry the unit fields the update worker needs (the
+# output fields only when the unit leaves the agent)
+_STATE_KEYS        = ['_id', 'state', 'state_timestamp', 'cbase', 'query', 'update']
+_STATE_KEYS_OUTPUT = ['stdout', 'stderr', 'exit_code']
+
 # TODO:
 #   - add PENDING states
 #   - for notifications, change msg from [topic, unit] to [topic, msg]
@@ -88,12 +107,14 @@ class Component(mp.Process):
     Further, the class must implement the declared work methods, with
     a signature of:
 
-        work(self, unit)
+        work(self, units)
 
-    The method is expected to change the unit state.  Units will not be pushed
-    to outgoing channels automatically -- to do so, the work method has to call
+    where 'units' is a list of units which all are in the same state (work
+    methods should also accept a single unit though).  The method is expected
+    to change the unit states.  Units will not be pushed to outgoing channels
+    automatically -- to do so, the work method has to call
 
-        self.advance(unit)
+        self.advance(units)
 
     Until that method is called, the component is considered the sole owner of
     the unit.  After that method is called, the unit is considered disowned by
@@ -157,6 +178,8 @@ class Component(mp.Process):
         self._cb_lock       = mt.Lock()   # guard threaded callback invokations
         self._clone_cb      = None        # allocate resources on cloning units
         self._drop_cb       = None        # free resources on dropping clones
+        self._store         = None        # unit store for slim queue messages
+        self._working       = dict()      # units in a worker, not handed off yet
 
         # use agent_name for one log per agent, cname for one log per agent and component
         log_name = self._cname
@@ -370,6 +393,11 @@ class Component(mp.Process):
                     self._prof.prof("finalize")
                     self.finalize_child()
                     self._prof.prof("finalized")
+
+                    # send out all collected notifications
+                    for publishers in self._publishers.values():
+                        for p in publishers:
+                            p.flush()
                     self._prof.prof("stopped")
                     self._prof.close()
                 else:
@@ -416,7 +444,11 @@ class Component(mp.Process):
         addr = self._addr_map[input]['source']
         self._log.debug("using addr %s for input %s" % (addr, input))
 
-        q = rpu_Queue.create(rpu_QUEUE_ZMQ, input, rpu_QUEUE_OUTPUT, addr)
+        # number of units to prefetch from the queue bridge per round trip
+        bulk = self._cfg.get('queue_bulk_size')
+
+        q = rpu_Queue.create(rpu_QUEUE_ZMQ, input, rpu_QUEUE_OUTPUT, addr, bulk,
+                             serializer=self._cfg.get('serializer'))
         self._inputs.append([q, states])
 
         for state in states:
@@ -460,7 +492,8 @@ class Component(mp.Process):
                 self._log.debug("using addr %s for output %s" % (addr, output))
 
                 # non-final state, ie. we want a queue to push to
-                q = rpu_Queue.create(rpu_QUEUE_ZMQ, output, rpu_QUEUE_INPUT, addr)
+                q = rpu_Queue.create(rpu_QUEUE_ZMQ, output, rpu_QUEUE_INPUT, addr,
+                                     serializer=self._cfg.get('serializer'))
                 self._outputs[state] = q
 
                 self._log.debug('declared output    : %s : %s : %s' \
@@ -473,14 +506,15 @@ class Component(mp.Process):
         """
         This method will associate a unit state with a specific worker.  Upon
         unit arrival, the unit state will be used to lookup the respective
-        worker, and the unit will be handed over.  Workers should call
-        self.advance(unit), in order to push the unit toward the next component.
-        If, for some reason, that is not possible before the worker returns, the
-        component will retain ownership of the unit, and should call advance()
-        asynchronously at a later point in time.
+        worker, and the unit will be handed over.  Units arriving together are
+        handed over together, as a list of units in the same state.  Workers
+        should call self.advance(units), in order to push the units toward the
+        next component.  If, for some reason, that is not possible before the
+        worker returns, the component will retain ownership of the units, and
+        should call advance() asynchronously at a later point in time.
 
         Worker invocation is synchronous, ie. the main event loop will only
-        check for the next unit once the worker method returns.
+        check for the next units once the worker method returns.
         """
 
         if not isinstance(states, list):
@@ -502,6 +536,12 @@ class Component(mp.Process):
     # --------------------------------------------------------------------------
     #
     def declare_idle_cb(self, cb, timeout=0.0):
+        """
+        Register a callback which is invoked by the main event loop every
+        'timeout' seconds (or as soon as possible thereafter).  The callback
+        is invoked whether or not units are currently arriving, and may
+        return 'True' to indicate that it did some work.
+        """
 
         if None == timeout:
             timeout = 0.0
@@ -534,7 +574,10 @@ class Component(mp.Process):
         addr = self._addr_map[pubsub]['sink']
         self._log.debug("using addr %s for pubsub %s" % (addr, pubsub))
 
-        q = rpu_Pubsub.create(rpu_PUBSUB_ZMQ, pubsub, rpu_PUBSUB_PUB, addr)
+        # notifications are collected for 'pubsub_flush_delay' seconds
+        q = rpu_Pubsub.create(rpu_PUBSUB_ZMQ, pubsub, rpu_PUBSUB_PUB, addr,
+                              flush_delay=self._cfg.get('pubsub_flush_delay'),
+                              serializer=self._cfg.get('serializer'))
         self._publishers[topic].append(q)
 
         self._log.debug('declared publisher : %s : %s : %s' \
@@ -567,10 +610,11 @@ class Component(mp.Process):
         def _subscriber(q, callback):
             try:
                 while not self._terminate.is_set():
-                    topic, msg = q.get_nowait(1000) # timout in ms
-                    if topic and msg:
+                    topic, msgs = q.get_nowait(1000) # timout in ms
+                    if topic and msgs:
                         with self._cb_lock:
-                            callback (topic=topic, msg=msg)
+                            for msg in msgs:
+                                callback (topic=topic, msg=msg)
             except Exception as e:
                 self._log.exception("subscriber failed")
                 if self._exit_on_error:
@@ -582,7 +626,8 @@ class Component(mp.Process):
         self._log.debug("using addr %s for pubsub %s" % (addr, pubsub))
 
         # create a pubsub subscriber, and subscribe to the given topic
-        q = rpu_Pubsub.create(rpu_PUBSUB_ZMQ, pubsub, rpu_PUBSUB_SUB, addr)
+        q = rpu_Pubsub.create(rpu_PUBSUB_ZMQ, pubsub, rpu_PUBSUB_SUB, addr,
+                              serializer=self._cfg.get('serializer'))
         q.subscribe(topic)
 
         t = mt.Thread(target=_subscriber, args=[q,cb],
@@ -629,16 +674,136 @@ class Component(mp.Process):
                 raise RuntimeError('subscriber %s died' % t.name)
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _work(self, input, states, units):
+        """
+        Hand a batch of units received on the given input over to the
+        respective workers.  Units are grouped by state, and each group is
+        passed to the worker in a single call.
+        """
+
+        batches = mc.OrderedDict()
+
+        if self._store:
+            units = [self._store.get(unit) for unit in units]
+
+        for unit in units:
+
+            state = unit['state']
+            uid   = unit['_id']
+
+            # assert that the unit is in an expected state
+            if state not in states:
+                self.advance(unit, FAILED, publish=True, push=False)
+                self._prof.prof(event='failed', msg="unexpected state %s" % state,
+                        uid=unit['_id'], state=unit['state'], logger=self._log.error)
+                continue
+
+            # depending on the queue we got the unit from, we can either
+            # drop units or clone them to inject new ones
+            unit = drop_units(self._cfg, unit, self.ctype, 'input',
+                              drop_cb=self._drop_cb, logger=self._log)
+            if not unit:
+                self._prof.prof(event='drop', state=state,
+                        uid=uid, msg=input.name)
+                continue
+
+            for _unit in clone_units(self._cfg, unit, self.ctype, 'input',
+                                     clone_cb=self._clone_cb, logger=self._log):
+                self._prof.prof(event='get', state=state, uid=_unit['_id'], msg=input.name)
+                if state not in batches:
+                    batches[state] = list()
+                batches[state].append(_unit)
+
+        for state, batch in batches.iteritems():
+
+            # check if we have a suitable worker (this should always be the
+            # case, as per the assertion done before we started the main loop.
+            # But, hey... :P
+            if not state in self._workers:
+                self._log.error("%s cannot handle state %s: %s" \
+                        % (self._cname, state, [u['_id'] for u in batch]))
+                continue
+
+            # we have an acceptable state and a matching worker -- hand the
+            # batch over, and wait for completion.  Workers hand units off one
+            # by one, so we keep track of the units not handed off yet.
+            self._working = dict([[u['_id'], u] for u in batch])
+            try:
+                for _unit in batch:
+                    self._prof.prof(event='work start', state=state, uid=_unit['_id'])
+                with self._cb_lock:
+                    self._workers[state](batch)
+                for _unit in batch:
+                    self._prof.prof(event='work done ', state=state, uid=_unit['_id'])
+
+            except Exception as e:
+                # units which the worker pushed (or which left the agent) are
+                # handed downstream, and may hold resources -- only fail the
+                # remaining ones
+                failed = [u for u in batch if u['_id'] in self._working]
+                self.advance(failed, FAILED, publish=True, push=False)
+                for _unit in failed:
+                    self._prof.prof(event='failed', msg=str(e), uid=_unit['_id'], state=state)
+                self._log.exception("units %s failed" % [u['_id'] for u in failed])
+
+                if self._exit_on_error:
+                    raise
+
+            finally:
+                self._working = dict()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _call_idlers(self):
+        """
+        invoke all idle callbacks which are due
+        """
+
+        now = time.time()
+
+        for idler in self._idlers:
+
+            if (now - idler['last']) >= idler['timeout']:
+
+                idler['last'] = now
+
+                try:
+                    with self._cb_lock:
+                        idler['cb']()
+                except Exception as e:
+                    self._log.exception('idle cb failed')
+                    if self._exit_on_error:
+                        raise
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _poll_timeout(self):
+        """
+        return the time (in seconds) until the next idle callback is due
+        """
+
+        now     = time.time()
+        timeout = _MAX_POLL_TIMEOUT
+
+        for idler in self._idlers:
+            timeout = min(timeout, idler['last'] + idler['timeout'] - now)
+
+        return max(timeout, _MIN_POLL_TIMEOUT)
+
+
     # --------------------------------------------------------------------------
     #
     def run(self):
         """
         This is the main routine of the component, as it runs in the component
         process.  It will first initialize the component in the process context.
-        Then it will attempt to get new units from all input queues
-        (round-robin).  For each unit received, it will route that unit to the
-        respective worker method.  Once the unit is worked upon, the next
-        attempt ar getting a unit is up.
+        Then it will wait for new units on all input queues.  The units
+        received are routed to the respective worker methods in bulk.  Once the
+        units are worked upon, the loop waits for the next units.
         """
 
         self._is_parent = False
@@ -671,6 +836,12 @@ class Component(mp.Process):
             self._log = ru.get_logger(log_name, log_tgt, self._debug)
             self._log.info('running %s' % self._cname)
 
+            # if configured, units are passed over queues via the unit store
+            # (see unit_store.py), which is shared by all agent components
+            if self._cfg.get('unit_store'):
+                self._store = rpu_UnitStore(os.path.join(self._cfg['workdir'], 'unit.store'),
+                                            rpu_Serializer.create(self._cfg.get('serializer')))
+
             # initialize_child() should declare all input and output channels, and all
             # workers and notification callbacks
             self._prof.prof('initialize')
@@ -689,110 +860,43 @@ class Component(mp.Process):
                                         % self._cname, state)
 
 
-            # The main event loop will repeatedly iterate over all input
-            # channels, probing
+            # The main event loop waits for units on all input channels at
+            # once, and for the next idle callback to become due.  Whenever
+            # units arrive, all units which are available without a further
+            # round trip to the queue bridge are handed to the workers in bulk.
+            poller = zmq.Poller()
+            for input, states in self._inputs:
+                poller.register(input.socket, zmq.POLLIN)
+
             while not self._terminate.is_set():
 
-                # if no action occurs in this iteration, invoke idle callbacks
                 active = False
 
-                # FIXME: for the default case where we have only one input
-                #        channel, we can probably use a more efficient method to
-                #        pull for units -- such as blocking recv() (with some
-                #        timeout for eventual shutdown)
-                # FIXME: a simple, 1-unit caching mechanism would likely remove
-                #        the req/res overhead completely (for any non-trivial
-                #        worker).
                 for input, states in self._inputs:
 
-                    # FIXME: the timeouts have a large effect on throughput, but
-                    #        I am not yet sure how best to set them...
-                    unit = input.get_nowait(1000) # timeout in microseconds
-                    if not unit:
-                        continue
-
-                    state = unit['state']
-                    uid   = unit['_id']
-
-                    # assert that the unit is in an expected state
-                    if state not in states:
-                        self.advance(unit, FAILED, publish=True, push=False)
-                        self._prof.prof(event='failed', msg="unexpected state %s" % state,
-                                uid=unit['_id'], state=unit['state'], logger=self._log.error)
-                        continue
-
-                    # depending on the queue we got the unit from, we can either
-                    # drop units or clone them to inject new ones
-                    unit = drop_units(self._cfg, unit, self.ctype, 'input',
-                                      drop_cb=self._drop_cb, logger=self._log)
-                    if not unit:
-                        self._prof.prof(event='drop', state=state,
-                                uid=uid, msg=input.name)
-                        continue
-
-                    units = clone_units(self._cfg, unit, self.ctype, 'input',
-                                        clone_cb=self._clone_cb, logger=self._log)
-
-                    for _unit in units:
-
-                        uid = _unit['_id']
+                    # this does not block, but makes sure that a request for
+                    # more units is pending on the input
+                    units = input.get_bulk_nowait(0)
+                    if units:
                         active = True
-                        self._prof.prof(event='get', state=state, uid=uid, msg=input.name)
-
+                        self._work(input, states, units)
 
-                        # check if we have a suitable worker (this should always be
-                        # the case, as per the assertion done before we started the
-                        # main loop.  But, hey... :P
-                        if not state in self._workers:
-                            self._log.error("%s cannot handle state %s: %s" \
-                                    % (self._cname, state, _unit))
-                            continue
+                # invoke idle callbacks which are due, even under load
+                self._call_idlers()
 
-                        # we have an acceptable state and a matching worker -- hand
-                        # it over, wait for completion, and then pull for the next
-                        # unit
+                if not active:
+                    # nothing arrived: block until something does, or until the
+                    # next idle callback is due
+                    timeout = self._poll_timeout()
+                    if not self._inputs:
+                        time.sleep(timeout)
+                    else:
                         try:
-                            self._prof.prof(event='work start', state=state, uid=uid)
-                            with self._cb_lock:
-                                self._workers[state](_unit)
-                            self._prof.prof(event='work done ', state=state, uid=uid)
-
-                        except Exception as e:
-                            self.advance(_unit, FAILED, publish=True, push=False)
-                            self._prof.prof(event='failed', msg=str(e), uid=uid, state=state)
-                            self._log.exception("unit %s failed" % uid)
-
-                            if self._exit_on_error:
+                            poller.poll(timeout * 1000)  # timeout in ms
+                        except zmq.ZMQError as e:
+                            if e.errno != errno.EINTR:
                                 raise
 
-
-                # if nothing happened, we can call the idle callbacks.  Don't
-                # call them more frequently than what they specified as sleep
-                # time though!
-                if not active:
-
-                    now = time.time()
-
-                    for idler in self._idlers:
-
-                        if (now - idler['last']) > idler['timeout']:
-
-                            try:
-                                with self._cb_lock:
-                                    if idler['cb']():
-                                        # something happened!
-                                        idler['last'] = now
-                                        active = True
-                            except Exception as e:
-                                self._log.exception('idle cb failed')
-                                if self._exit_on_error:
-                                    raise
-
-                if not active:
-                    # FIXME: make configurable
-                    time.sleep(0.1)
-
-
         except Exception as e:
             # We should see that exception only on process termination -- and of
             # course on incorrect implementations of component workers.  We
@@ -821,7 +925,9 @@ class Component(mp.Process):
         Units which have been operated upon are pushed down into the queues
         again, only to be picked up by the next component, according to their
         state.  This method will update the unit state, and push it into the
-        output queue declared as target for that state.
+        output queue declared as target for that state.  State notifications
+        for all units are published as a single message, and all units
+        targeted at the same output queue are pushed as a single bulk.
 
         units:   list of units to advance
         state:   new state to set for the units
@@ -837,69 +943,116 @@ class Component(mp.Process):
         if not isinstance(units, list):
             units = [units]
 
-        for unit in units:
-
-            uid = unit['_id']
+        if not units:
+            return
 
-            if state:
-                unit['state']          = state
+        if state:
+            for unit in units:
+                unit['state']           = state
                 unit['state_timestamp'] = timestamp
-                if prof:
+
+            if prof and self._prof.enabled:
+                for unit in units:
                     self._prof.prof('advance', uid=unit['_id'], state=state,
                             timestamp=timestamp)
-            else:
-                state = unit['state']
-
-            if publish:
-                # send state notifications
-                self.publish('state', unit)
-                self._prof.prof('publish', uid=unit['_id'], state=unit['state'])
 
-            if push:
-                if state not in self._outputs:
+        if publish:
+            # send state notifications for all units in one message
+            msgs = list()
+            for unit in units:
+                msg = dict()
+                for key in _STATE_KEYS:
+                    if key in unit:
+                        msg[key] = unit[key]
+                if unit['state'] in _STATES_LEAVE:
+                    for key in _STATE_KEYS_OUTPUT:
+                        if key in unit:
+                            msg[key] = unit[key]
+                msgs.append(msg)
+            self.publish('state', msgs)
+            if self._prof.enabled:
+                for unit in units:
+                    self._prof.prof('publish', uid=unit['_id'], state=unit['state'])
+
+        if self._working:
+            # units are handed off once they are pushed or leave the agent --
+            # units published in an intermediate state are still ours
+            for unit in units:
+                if push or unit['state'] in _STATES_LEAVE:
+                    self._working.pop(unit['_id'], None)
+
+        if self._store:
+            # units leaving the agent are not sent via the store anymore
+            for unit in units:
+                if unit['state'] in _STATES_LEAVE:
+                    self._store.forget(unit['_id'])
+
+        if push:
+
+            # collect the units to push for each output, so that we can push
+            # them in bulk
+            bulks = list()   # [[output, [units]], ...]
+            bulk  = dict()   # output -> [units]
+
+            for unit in units:
+
+                _state = unit['state']
+                uid    = unit['_id']
+
+                if _state not in self._outputs:
                     # unknown target state -- error
                     self._log.error("%s can't route state %s (%s)" \
-                            % (self._cname, state, self._outputs.keys()))
+                            % (self._cname, _state, self._outputs.keys()))
                     continue
 
-                if not self._outputs[state]:
+                if not self._outputs[_state]:
                     # empty output -- drop unit
-                    self._log.debug('%s %s ===| %s' % ('state', unit['id'], unit['state']))
+                    self._log.debug('%s %s ===| %s' % ('state', uid, _state))
                     continue
 
-
-                output = self._outputs[state]
+                output = self._outputs[_state]
 
                 # depending on the queue we got the unit from, we can now either
                 # drop units or clone them to inject new ones
                 unit = drop_units(self._cfg, unit, self.ctype, 'output',
                                   drop_cb=self._drop_cb, logger=self._log)
                 if not unit:
-                    self._prof.prof(event='drop', state=state, uid=uid, msg=output.name)
+                    self._prof.prof(event='drop', state=_state, uid=uid, msg=output.name)
                     continue
 
-                units = clone_units(self._cfg, unit, self.ctype, 'output',
-                                    clone_cb=self._clone_cb, logger=self._log)
+                if output not in bulk:
+                    bulk[output] = list()
+                    bulks.append([output, bulk[output]])
 
-                for _unit in units:
-                    # FIXME: we should assert that the unit is in a PENDING state.
-                    #        Better yet, enact the *_PENDING transition right here...
-                    #
-                    # push the unit down the drain
-                    output.put(_unit)
-                    self._prof.prof('put', uid=_unit['_id'], state=state, msg=output.name)
+                # FIXME: we should assert that the unit is in a PENDING state.
+                #        Better yet, enact the *_PENDING transition right here...
+                bulk[output].extend(clone_units(self._cfg, unit, self.ctype,
+                                                'output', clone_cb=self._clone_cb,
+                                                logger=self._log))
+
+            for output, _units in bulks:
+
+                # push the units down the drain
+                if self._store:
+                    output.put([self._store.put(_unit) for _unit in _units])
+                else:
+                    output.put(_units)
+
+                if self._prof.enabled:
+                    for _unit in _units:
+                        self._prof.prof('put', uid=_unit['_id'],
+                                        state=_unit['state'], msg=output.name)
 
 
     # --------------------------------------------------------------------------
     #
     def publish(self, topic, msg):
         """
-        push information into a publication channel
+        push information into a publication channel.  'msg' can be a list of
+        messages (such as a list of units), which is then sent as a single
+        notification -- subscribers will receive that list as is.
         """
 
-        if not isinstance(msg, list):
-            msg = [msg]
-
         if topic not in self._publishers:
             self._log.error("%s can't route notification '%s:%s' (%s)" \
                     % (self._cname, topic, msg, self._publishers.keys()))
@@ -910,9 +1063,8 @@ class Component(mp.Process):
                     % (self._cname, topic, msg, self._publishers.keys()))
             return
 
-        for m in msg:
-            for p in self._publishers[topic]:
-                p.put (topic, m)
+        for p in self._publishers[topic]:
+            p.put (topic, msg)
 
 
 
@@ -4,6 +4,7 @@ import sys
 import copy
 import time
 import errno
+import codecs
 import datetime
 import pymongo
 import threading
@@ -31,6 +32,52 @@ def tail(txt, maxlen=MAX_IO_LOGLENGTH):
         return txt
 
 
+# ------------------------------------------------------------------------------
+#
+def tail_file(path, maxlen=MAX_IO_LOGLENGTH, sample=4096):
+
+    # return the last <maxlen> characters of a utf-8 encoded file, shortened
+    # like tail(), without reading the whole file.  We only read a sample of
+    # the file head and a window at the end of the file.  If either does not
+    # decode as utf-8, the file is considered binary, and None is returned.
+
+    window = 4 * maxlen  # utf-8 uses at most 4 bytes per character
+
+    with open(path, 'rb') as f:
+
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+
+        f.seek(0)
+        head = f.read(min(sample, size))
+
+        offset = max(0, size - window)
+        f.seek(offset)
+        data = f.read(window)
+
+    try:
+        # the sample may end in the middle of a character
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=(len(head) == size))
+
+        # the window may start in the middle of a character: skip continuation
+        # bytes (at most 3)
+        if offset:
+            skip = 0
+            while skip < 3 and skip < len(data) and 0x80 <= ord(data[skip]) < 0xc0:
+                skip += 1
+            data = data[skip:]
+
+        txt = data.decode('utf-8')
+
+    except UnicodeDecodeError:
+        return None
+
+    if offset and len(txt) <= maxlen:
+        return "[... CONTENT SHORTENED ...]\n%s" % txt
+
+    return tail(txt, maxlen)
+
+
 # ------------------------------------------------------------------------------
 #
 def get_rusage():
@@ -1,7 +1,11 @@
 import os
 import csv
+import atexit
 import copy
 import time
+import collections
+import struct
+import weakref
 import threading
 
 
@@ -9,6 +13,26 @@ import threading
 #
 _prof_fields  = ['time', 'name', 'uid', 'state', 'event', 'msg']
 
+# binary profiles (RADICAL_PILOT_PROFILE_MODE=binary) consist of segments (one
+# per profiler process), each starting with the magic string.  A segment
+# contains string records, which assign an id to a string, and fixed size event
+# records, which refer to those ids.  bprof2csv() converts binary profiles into
+# the CSV format.
+_BPROF_MAGIC  = 'RPBPROF1'
+_BPROF_STRING = struct.Struct('!cIH')        # 'S', id, length  [+ string]
+_BPROF_TIME   = struct.Struct('!cd')         # 'E', time        [+ ids]
+_BPROF_IDS    = struct.Struct('!IIIIII')     # name, tid, uid, state, event, msg
+_BPROF_EVENT  = struct.Struct('!cdIIIIII')   # both of the above
+_BPROF_EVENTS = 100000     # events queued before flushing inline
+_BPROF_FLUSH  = 1.0        # seconds between flushes
+_BPROF_CACHE  = 100000     # strings and id tuples per segment
+_BPROF_READ   = 1024 * 1024                  # bytes read at once
+_BPROF_RECORD = _BPROF_STRING.size + 0xFFFF  # max record size
+
+_MAX_RUNS     = 16         # unsorted sections merged per profile
+_MAX_READERS  = 128        # open files for the sections of all profiles
+_PARQUET_ROWS = 100000     # rows per parquet row group
+
 
 # ------------------------------------------------------------------------------
 #
@@ -20,6 +44,11 @@ class Profiler (object):
     (prof()) of writing lines with timestamp and events to that file.  Any
     profiling intelligence is applied when reading and evaluating the created
     profiles.
+
+    If RADICAL_PILOT_PROFILE_MODE is set to 'binary', events are instead queued
+    in memory, and a thread flushes them as binary records to a '.bprof' file.
+    On close(), that file is converted into the CSV format and appended to
+    '<name>.prof'.
     """
 
     # --------------------------------------------------------------------------
@@ -40,7 +69,26 @@ class Profiler (object):
 
         self._ts_zero, self._ts_abs, self._ts_mode = self._timestamp_init()
 
-        self._name  = name
+        self._name   = name
+        self._binary = os.environ.get('RADICAL_PILOT_PROFILE_MODE') == 'binary'
+
+        if self._binary:
+            # events are queued by _bprof() in place of prof()
+            self.prof    = self._bprof
+            self._events = collections.deque()
+            self._tnames = threading.local()
+            self._closed = False
+            self._bprof_init()
+
+            # don't lose queued events if we are not closed.  The hook only
+            # holds a weak reference, so that it doesn't keep us alive.
+            atexit.register(_bprof_atexit, weakref.ref(self))
+
+            self._events.append((0.0, self._name, "", "", "", 'sync abs',
+                                 "%s:%s:%s:%s" % (time.time(), self._ts_zero,
+                                                  self._ts_abs, self._ts_mode)))
+            return
+
         self._handle = open("%s.prof"  % self._name, 'a')
 
         # write header and time normalization info
@@ -67,7 +115,11 @@ class Profiler (object):
 
         if self._enabled:
             self.prof("QED")
-            self._handle.close()
+
+            if self._binary:
+                self._bprof_close()
+            else:
+                self._handle.close()
 
 
     # ------------------------------------------------------------------------------
@@ -76,6 +128,14 @@ class Profiler (object):
 
         if self._enabled:
             self.prof("flush")
+
+            if self._binary:
+                if self._closed:
+                    return
+                self._bprof_flush()
+                os.fsync(self._fd)
+                return
+
             self._handle.flush()
             # https://docs.python.org/2/library/stdtypes.html?highlight=file%20flush#file.flush
             os.fsync(self._handle.fileno())
@@ -118,6 +178,181 @@ class Profiler (object):
                 % (timestamp, name, tid, uid, state, event, msg))
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _bprof_init(self):
+
+        # this is also called in a forked child, which then writes its own
+        # profile, with a new string table.  The file name is unique per
+        # process and profiler.
+        self._pid     = os.getpid()
+        self._lock    = threading.Lock()   # serializes flushes
+        self._strings = dict()             # string -> id
+        self._ids     = dict()             # event fields -> packed ids
+        self._bpath   = "%s.%d.%x.bprof" % (self._name, self._pid, id(self))
+        self._fd      = os.open(self._bpath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        self._stop    = threading.Event()
+
+        os.write(self._fd, _BPROF_MAGIC)
+
+        # the flusher only holds a weak reference, too
+        self._flusher = threading.Thread(target=_bprof_flusher,
+                                         args=(weakref.ref(self), self._stop),
+                                         name="%s.prof" % self._name)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _bprof_close(self):
+
+        if self._closed:
+            return
+
+        if self._pid != os.getpid():
+            # we got forked, and did not flush since
+            self._bprof_init()
+
+        self._bprof_stop()
+
+        # late flushes (from the atexit hook or other threads) must not write
+        # into the closed (and maybe reused) fd
+        with self._lock:
+            self._closed = True
+            os.close(self._fd)
+
+        bprof2csv(self._bpath, "%s.prof" % self._name)
+        os.unlink(self._bpath)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _bprof_stop(self):
+
+        if self._closed:
+            return
+
+        self._stop.set()
+        self._flusher.join()
+        self._bprof_flush()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _bprof(self, event, uid=None, state=None, msg=None, timestamp=None,
+               logger=None, name=None):
+
+        # this is prof() in binary mode, and is kept as short as possible: we
+        # only queue the event, and leave everything else to the flusher.
+        # deque appends are thread safe.
+        if logger:
+            logger("%s (%10s%s) : %s", event, uid, state, msg)
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        # thread names are cached per thread (threads are named on creation).
+        # NOTE: we queue the thread name, not the thread: tuples of strings
+        #       are not tracked by the garbage collector
+        try:
+            tid = self._tnames.name
+        except AttributeError:
+            tid = self._tnames.name = threading.current_thread().name
+
+        self._events.append((timestamp, name, tid, uid, state, event, msg))
+
+        if len(self._events) > _BPROF_EVENTS:
+            # the flusher does not keep up (or we got forked)
+            self._bprof_flush()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _bprof_flush(self):
+
+        if self._closed:
+            # events queued after close() are dropped
+            self._events.clear()
+            return
+
+        if self._pid != os.getpid():
+            # we got forked -- the child writes its own profile.  Events queued
+            # before the fork end up in both profiles, unless the parent
+            # flushed before forking.
+            self._bprof_init()
+
+        with self._lock:
+
+            if self._closed:
+                # closed while we waited for the lock
+                return
+
+            events = self._events
+            ids    = self._ids
+            data   = list()
+
+            if len(ids) > _BPROF_CACHE or len(self._strings) > _BPROF_CACHE:
+                # start a new segment, to limit the cache sizes
+                self._strings.clear()
+                ids.clear()
+                data.append(_BPROF_MAGIC)
+
+            for _ in xrange(len(events)):
+
+                timestamp, name, tid, uid, state, event, msg = events.popleft()
+
+                if timestamp > (100 * 1000 * 1000):
+                    # absolute timestamp (see prof())
+                    timestamp -= self._ts_zero
+
+                if not msg:
+                    msg = ''
+                elif not isinstance(msg, basestring):
+                    msg = str(msg)
+
+                fields = (name or self._name, tid, uid or '', state or '',
+                          event, msg)
+
+                packed = ids.get(fields)
+                if packed is None:
+                    packed = _BPROF_IDS.pack(*[self._intern(string, data)
+                                               for string in fields])
+                    ids[fields] = packed
+
+                data.append(_BPROF_TIME.pack('E', timestamp))
+                data.append(packed)
+
+            data = ''.join(data)
+            pos  = 0
+            while pos < len(data):
+                pos += os.write(self._fd, buffer(data, pos))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _intern(self, string, data):
+
+        # must be called with the lock held.  New strings are appended to the
+        # data to write.
+        sid = self._strings.get(string)
+
+        if sid is None:
+            sid = len(self._strings)
+            self._strings[string] = sid
+
+            if isinstance(string, unicode):
+                string = string.encode('utf-8')
+            else:
+                string = str(string)
+            string = string[:0xFFFF]
+
+            data.append(_BPROF_STRING.pack('S', sid, len(string)))
+            data.append(string)
+
+        return sid
+
+
     # --------------------------------------------------------------------------
     #
     def _timestamp_init(self):
@@ -153,12 +388,106 @@ class Profiler (object):
         return float(time.time()) - self._ts_zero
 
 
+# ------------------------------------------------------------------------------
+#
+def _bprof_flusher(ref, stop):
+
+    # flush a binary profiler until it is stopped or garbage collected
+    while not stop.wait(_BPROF_FLUSH):
+        prof = ref()
+        if prof is None:
+            break
+        prof._bprof_flush()
+        del prof
+
+
+# ------------------------------------------------------------------------------
+#
+def _bprof_atexit(ref):
+
+    prof = ref()
+    if prof is not None:
+        prof._bprof_stop()
+
+
 # --------------------------------------------------------------------------
 #
 def timestamp():
     # human readable absolute UTC timestamp for log entries in database
     return time.time()
 
+# ------------------------------------------------------------------------------
+#
+def read_bprof(path):
+    """
+    Read a binary profile, and yield its events as lines in the CSV format.
+    The profile is read in chunks of _BPROF_READ bytes.
+    """
+
+    with open(path, 'rb') as f:
+
+        data    = ''
+        pos     = 0
+        eof     = False
+        strings = dict()
+
+        while True:
+
+            # keep at least one complete record in the buffer
+            if not eof and len(data) - pos < _BPROF_RECORD:
+                chunk = f.read(_BPROF_READ)
+                eof   = not chunk
+                data  = data[pos:] + chunk
+                pos   = 0
+
+            if pos >= len(data):
+                break
+
+            if data.startswith(_BPROF_MAGIC, pos):
+                # new segment
+                strings = dict()
+                pos    += len(_BPROF_MAGIC)
+                yield "#%s\n" % (','.join(_prof_fields))
+
+            elif data[pos] == 'S':
+                _, sid, n = _BPROF_STRING.unpack_from(data, pos)
+                pos += _BPROF_STRING.size
+                strings[sid] = data[pos:pos + n]
+                pos += n
+
+            elif data[pos] == 'E':
+                rec  = _BPROF_EVENT.unpack_from(data, pos)
+                pos += _BPROF_EVENT.size
+                yield "%.4f,%s:%s,%s,%s,%s,%s\n" \
+                    % ((rec[1],) + tuple([strings[sid] for sid in rec[2:]]))
+
+            else:
+                raise ValueError('invalid binary profile %s at %d' % (path, pos))
+
+
+# ------------------------------------------------------------------------------
+#
+def bprof2csv(src, tgt=None):
+    """
+    Convert a binary profile into the CSV format, and append it to 'tgt'
+    (default: the source name with the extension '.prof').
+    """
+
+    if not tgt:
+        tgt = "%s.prof" % src.rsplit('.bprof', 1)[0]
+
+    text = ''.join(read_bprof(src))
+
+    # one write, so that concurrent conversions don't interleave
+    fd = os.open(tgt, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+    try:
+        os.write(fd, text)
+    finally:
+        os.close(fd)
+
+    return tgt
+
+
 # ------------------------------------------------------------------------------
 #
 def prof2frame(prof):
@@ -167,6 +496,7 @@ def prof2frame(prof):
     Write that profile to a temp csv and let pandas parse it into a frame.
     """
 
+    import numpy  as np
     import pandas as pd
 
     # create data frame from profile dicts
@@ -174,24 +504,14 @@ def prof2frame(prof):
 
     # --------------------------------------------------------------------------
     # add a flag to indicate entity type
-    def _entity (row):
-        if not row['uid']:
-            return 'session'
-        if 'unit' in row['uid']:
-            return 'unit'
-        if 'pilot' in row['uid']:
-            return 'pilot'
-        return 'session'
-    frame['entity'] = frame.apply(lambda row: _entity (row), axis=1)
+    uid  = frame['uid'].fillna('')
+    unit = uid.str.contains('unit',  regex=False).values
+    plt  = uid.str.contains('pilot', regex=False).values
+    frame['entity'] = np.select([unit, plt], ['unit', 'pilot'], 'session')
 
     # --------------------------------------------------------------------------
     # add a flag to indicate if a unit / pilot / ... is cloned
-    def _cloned (row):
-        if not row['uid']:
-            return False
-        else:
-            return 'clone' in row['uid'].lower()
-    frame['cloned'] = frame.apply(lambda row: _cloned (row), axis=1)
+    frame['cloned'] = uid.str.lower().str.contains('clone', regex=False)
 
     return frame
 
@@ -262,7 +582,224 @@ def get_experiment_frames(experiments, datadir=None):
 
 # ------------------------------------------------------------------------------
 #
-def combine_profiles(profiles):
+def _read_records(prof, offset=0):
+    """
+    Yield the event records of a (CSV or binary) profile as tuples (offset,
+    fields), skipping headers and empty lines.  For CSV profiles, the offset is
+    the file position of the record, and reading can start at such an offset.
+    Binary profiles are converted on the fly, and have no offsets (None).
+    """
+
+    if prof.endswith('.bprof'):
+        for rec in csv.reader(read_bprof(prof)):
+            if rec and not rec[0].startswith('#'):
+                yield None, rec
+        return
+
+    with open(prof, 'rb') as f:
+
+        f.seek(offset)
+        pos = [offset]
+
+        def lines():
+            for line in f:
+                pos[0] += len(line)
+                yield line
+
+        # the csv reader pulls the lines of one record at a time
+        for rec in csv.reader(lines()):
+            if rec and not rec[0].startswith('#'):
+                yield offset, rec
+            offset = pos[0]
+
+
+# ------------------------------------------------------------------------------
+#
+def _scan_profile(prof):
+    """
+    First pass over a profile: find its time reference, its sync ref events,
+    its smallest timestamp, and the sections (runs) in which its events are
+    sorted by time.  Events are not globally sorted if several processes or
+    threads wrote to the same profile.
+    """
+
+    info = {'tref'  : None,   # 'abs' or 'rel'
+            'sync'  : None,   # the fields of the first sync abs / rel event
+            'refs'  : dict(), # sync ref msg -> time of the first such event
+            'qed'   : 0,      # number of QED events
+            'n'     : 0,      # number of events
+            't_min' : None,   # smallest timestamp
+            'runs'  : list()} # [start, end, offset] of time sorted sections
+
+    t_last = None
+    for offset, rec in _read_records(prof):
+
+        t     = float(rec[0])
+        event = rec[4] if len(rec) > 4 else None
+        msg   = rec[5] if len(rec) > 5 else None
+
+        # find first tref
+        if not info['tref']:
+            if event == 'sync rel':
+                info['tref'] = 'rel'
+                info['sync'] = [t, msg]
+            if event == 'sync abs':
+                info['tref'] = 'abs'
+                info['sync'] = [t] + msg.split(':')
+
+        if event == 'sync ref' and msg not in info['refs']:
+            info['refs'][msg] = t
+
+        # Record closing entries
+        if event == 'QED':
+            info['qed'] += 1
+
+        if t_last is None or t < t_last:
+            info['runs'].append([info['n'], None, offset])
+        info['runs'][-1][1] = info['n'] + 1
+
+        if info['t_min'] is None or t < info['t_min']:
+            info['t_min'] = t
+
+        t_last     = t
+        info['n'] += 1
+
+    return info
+
+
+# ------------------------------------------------------------------------------
+#
+def _read_run(prof, offset, count, t_off, idx):
+    """
+    Yield 'count' events (all if None) of a profile, starting at the given file
+    offset, as sortable tuples (time, idx, n, row), with the time corrected by
+    't_off'.
+    """
+
+    import itertools
+
+    nf   = len(_prof_fields)
+    recs = itertools.islice(_read_records(prof, offset), count)
+    for n, (_, rec) in enumerate(recs):
+
+        if len(rec) == nf:
+            row = dict(zip(_prof_fields, rec))
+        else:
+            # like csv.DictReader
+            row = dict(itertools.izip_longest(_prof_fields, rec[:nf]))
+            if len(rec) > nf:
+                row[None] = rec[nf:]
+
+        row['time'] = float(row['time']) + t_off
+        yield (row['time'], idx, n, row)
+
+
+# ------------------------------------------------------------------------------
+#
+def stream_profiles(profiles):
+    """
+    This is the streaming version of combine_profiles(): it yields the rows of
+    the combined profile in time order, without holding the profiles in memory.
+
+    We make a first pass over all profiles to find their sync events, and
+    a second pass to merge their events.  Profiles (or sections of profiles)
+    are sorted by time when written, so a k-way merge keeps only one event
+    per section in memory.  Each profile is read sequentially, once.  The
+    sections of unsorted CSV profiles are read separately (each from its file
+    offset) if they have at most _MAX_RUNS sections, and if all sections
+    together need at most _MAX_READERS open files.  Other unsorted profiles
+    are sorted in memory.
+    """
+
+    import heapq
+
+    infos = dict()
+    for prof in profiles:
+        info = _scan_profile(prof)
+
+        if info['tref']:
+            infos[prof] = info
+        elif info['n']:
+            print 'WARNING: skipping profile %s (no sync)' % prof
+
+        # Check for proper closure of profiling files
+        if info['qed'] == 0:
+            print 'WARNING: profile "%s" not correctly closed.' % prof
+        if info['qed'] > 1:
+            print 'WARNING: profile "%s" closed %d times.' % (prof, info['qed'])
+
+    # the profile created an entry t_rel at t_abs.  The offset is thus
+    # t_abs - t_rel, and all timestamps in the profile need to be corrected by
+    # that to get absolute time
+    offsets = dict()
+    for prof in profiles:
+        info = infos.get(prof)
+        if info and info['tref'] == 'abs':
+            t_rel = float(info['sync'][0])
+            t_abs = float(info['sync'][3])
+            offsets[prof] = t_abs - t_rel
+
+    # a 'sync rel' message was created at time t_rel, and corresponds to a
+    # 'sync ref' event in an absolute profile, created at (absolute) t_ref.
+    # All timestamps in the profile thus need to be corrected by
+    # (t_ref - t_rel)
+    for prof in profiles:
+        info = infos.get(prof)
+        if not info or info['tref'] != 'rel':
+            continue
+
+        t_rel, t_msg = info['sync']
+        t_ref = None
+        for _prof in profiles:
+            if  _prof in offsets                 and \
+                infos[_prof]['tref'] == 'abs'    and \
+                t_msg in infos[_prof]['refs']:
+                t_ref = infos[_prof]['refs'][t_msg] + offsets[_prof]
+                break
+
+        if t_ref == None:
+            print "WARNING: 'sync rel' reference not found %s" % prof
+            continue
+
+        offsets[prof] = t_ref - t_rel
+
+    # we make timestamps relative to the smallest timestamp over all profiles
+    t_min = 9999999999.9 # future...
+    for prof in offsets:
+        t_min = min(t_min, infos[prof]['t_min'] + offsets[prof])
+
+    # merge the sorted runs of all profiles.  Sorted profiles need one open
+    # file each, the remaining files are spent on the sections of unsorted
+    # profiles.
+    profs = [prof for prof in profiles if prof in offsets]
+    files = _MAX_READERS - len([prof for prof in profs
+                                     if len(infos[prof]['runs']) == 1])
+    runs  = list()
+    for prof in profs:
+
+        info  = infos[prof]
+        t_off = offsets[prof]
+        n     = len(info['runs'])
+
+        if n == 1:
+            runs.append(_read_run(prof, 0, None, t_off, len(runs)))
+
+        elif n <= min(_MAX_RUNS, files) and info['runs'][0][2] is not None:
+            files -= n
+            for start, end, offset in info['runs']:
+                runs.append(_read_run(prof, offset, end - start, t_off,
+                                      len(runs)))
+        else:
+            runs.append(iter(sorted(_read_run(prof, 0, None, t_off, len(runs)))))
+
+    for _, _, _, row in heapq.merge(*runs):
+        row['time'] -= t_min
+        yield row
+
+
+# ------------------------------------------------------------------------------
+#
+def combine_profiles(profiles, tgt=None):
     """
     We first read all profiles as CSV files and parse them.  For each profile,
     we back-calculate global time (epoch) from the synch timestamps.  Then all
@@ -277,124 +814,125 @@ def combine_profiles(profiles):
     abs'ed, then the first profile will be normalized based on the synchronizity
     of the 'sync rel' and 'sync ref' events.
 
-    This method is somewhat convoluted -- I would not be surprised if it can be
-    written much shorter and clearer with some python or pandas magic...
+    The combined profile is returned as list of rows (dicts).  For large
+    profiles, specify a 'tgt' file name instead: the combined profile is then
+    streamed into that file (see write_profile()), and 'tgt' is returned.  Use
+    read_profile() to load it as data frame.
     """
-    rd_abs = dict() # dict of absolute time refs
-    rd_rel = dict() # dict of relative time refs
-    pd_abs = dict() # profiles which have absolute time refs
-    pd_rel = dict() # profiles which have relative time refs
 
-    for prof in profiles:
-        p     = list()
-        tref  = None
-        qed = 0
-        with open(prof, 'r') as csvfile:
-            reader = csv.DictReader(csvfile, fieldnames=_prof_fields)
-            empty  = True
-            for row in reader:
-
-                # skip header
-                if row['time'].startswith('#'):
-                    continue
-
-                empty = False
-                row['time'] = float(row['time'])
-    
-                # find first tref
-                if not tref:
-                    if row['event'] == 'sync rel' : 
-                        tref = 'rel'
-                        rd_rel[prof] = [row['time'], row['msg']]
-                    if row['event'] == 'sync abs' : 
-                        tref = 'abs'
-                        rd_abs[prof] = [row['time']] + row['msg'].split(':')
-
-                # Record closing entries
-                if row['event'] == 'QED':
-                    qed += 1
-
-                # store row in profile
-                p.append(row)
-    
-        if   tref == 'abs': pd_abs[prof] = p
-        elif tref == 'rel': pd_rel[prof] = p
-        elif not empty    : print 'WARNING: skipping profile %s (no sync)' % prof
+    rows = stream_profiles(profiles)
 
-        # Check for proper closure of profiling files
-        if qed == 0:
-            print 'WARNING: profile "%s" not correctly closed.' % prof
-        if qed > 1:
-            print 'WARNING: profile "%s" closed %d times.' % (prof, qed)
-
-    # make all timestamps absolute for pd_abs profiles
-    for prof, p in pd_abs.iteritems():
-    
-        # the profile created an entry t_rel at t_abs.
-        # The offset is thus t_abs - t_rel, and all timestamps
-        # in the profile need to be corrected by that to get absolute time
-        t_rel   = float(rd_abs[prof][0])
-        t_stamp = float(rd_abs[prof][1])
-        t_zero  = float(rd_abs[prof][2])
-        t_abs   = float(rd_abs[prof][3])
-        t_off   = t_abs - t_rel
-    
-        for row in p:
-            row['time'] = row['time'] + t_off
-    
-    # combine the abs profiles into a global one.  We will add rel rpfiles as
-    # they are corrected.
-    p_glob = list()
-    for prof, p in pd_abs.iteritems():
-        p_glob += p
-
-    
-    # reference relative profiles
-    for prof, p in pd_rel.iteritems():
-    
-        # a sync message was created at time t_rel
-        t_rel = rd_rel[prof][0]
-        t_msg = rd_rel[prof][1]
-    
-        # now find the referenced sync point in other, absolute profiles
-        t_ref = None
-        for _prof, _p in pd_abs.iteritems():
-            if not t_ref:
-                for _row in _p:
-                    if  _row['event'] == 'sync ref' and \
-                        _row['msg']   == t_msg:
-                        t_ref = _row['time'] # referenced timestamp
-                        break
-    
-        if t_ref == None:
-            print "WARNING: 'sync rel' reference not found %s" % prof
-            continue
-    
-        # the profile's sync reference t_rel was created at the t_abs of the
-        # referenced point (t_ref), so all timestamps in the profile need to be
-        # corrected by (t_ref - t_rel)
-        t_off = t_ref - t_rel
-    
-        for row in p:
-            row['time'] = row['time'] + t_off
-            p_glob.append(row)
-
-    # we now have all profiles combined into one large profile, and can make
-    # timestamps relative to its smallest timestamp again
-    
-    # find the smallest time over all profiles
-    t_min = 9999999999.9 # future...
-    for row in p_glob:
-        t_min = min(t_min, row['time'])
-    
-    # make times relative to t_min again
-    for row in p_glob:
-        row['time'] -= t_min
-    
-    # sort by time and return
-    p_glob = sorted(p_glob[:], key=lambda k: k['time']) 
+    if tgt:
+        write_profile(rows, tgt)
+        return tgt
+
+    return list(rows)
+
+
+# ------------------------------------------------------------------------------
+#
+def write_profile(rows, tgt):
+    """
+    Write profile rows (dicts) into a columnar file, depending on the file
+    extension:
+
+      - '.npz'    : numpy arrays (needs numpy).  The string columns are stored
+                    as integer codes (column 'uid') and unique values (column
+                    'uid_values')
+      - '.parquet': parquet file (needs pyarrow), written in row groups of
+                    _PARQUET_ROWS rows
+
+    The string columns are dictionary encoded either way, so memory use stays
+    small for large profiles.
+    """
+
+    import numpy as np
+
+    if tgt.endswith('.parquet'):
+        _write_parquet(rows, tgt)
+        return
+
+    if not tgt.endswith('.npz'):
+        raise ValueError('unknown profile format %s' % tgt)
+
+    import array
+
+    cols  = _prof_fields[1:]
+    times = array.array('d')
+    codes = dict([[col, array.array('i')] for col in cols])
+    vals  = dict([[col, dict()]           for col in cols])
+
+    for row in rows:
+        times.append(row['time'])
+        for col in cols:
+            val  = row[col] or ''
+            code = vals[col].get(val)
+            if code is None:
+                code = vals[col][val] = len(vals[col])
+            codes[col].append(code)
+
+    data = {'time' : np.frombuffer(times, dtype='d')}
+    for col in cols:
+        values = [None] * len(vals[col])
+        for val, code in vals[col].iteritems():
+            values[code] = val
+        data[col]             = np.frombuffer(codes[col], dtype='i')
+        data['%s_values' % col] = np.array(values, dtype=object)
+
+    np.savez(tgt, **data)
+
+
+# ------------------------------------------------------------------------------
+#
+def _write_parquet(rows, tgt):
+
+    import itertools
+    import pyarrow         as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        while True:
+
+            chunk = list(itertools.islice(rows, _PARQUET_ROWS))
+            if not chunk:
+                break
+
+            table = pa.Table.from_arrays(
+                    [pa.array([row['time'] for row in chunk], type=pa.float64())] +
+                    [pa.array([row[col]    for row in chunk]).dictionary_encode()
+                                           for col in _prof_fields[1:]],
+                    names=_prof_fields)
+
+            if not writer:
+                writer = pq.ParquetWriter(tgt, table.schema)
+            writer.write_table(table)
+
+    finally:
+        if writer:
+            writer.close()
+
+
+# ------------------------------------------------------------------------------
+#
+def read_profile(src):
+    """
+    Load a profile file written by write_profile() into a data frame, with
+    categorical string columns.
+    """
+
+    import numpy  as np
+    import pandas as pd
+
+    if src.endswith('.parquet'):
+        return pd.read_parquet(src)
+
+    data  = np.load(src, allow_pickle=True)
+    frame = pd.DataFrame({'time' : data['time']})
+    for col in _prof_fields[1:]:
+        frame[col] = pd.Categorical.from_codes(data[col], data['%s_values' % col])
 
-    return p_glob
+    return frame[_prof_fields]
 
 
 # ------------------------------------------------------------------------------
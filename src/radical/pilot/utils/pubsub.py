@@ -4,12 +4,16 @@ import zmq
 import json
 import time
 import errno
+import atexit
 import pprint
 import signal
+import threading       as mt
 import Queue           as pyq
 import multiprocessing as mp
 import radical.utils   as ru
 
+from .serializer import Serializer
+
 # --------------------------------------------------------------------------
 # defines for pubsub roles
 PUBSUB_PUB    = 'pub'
@@ -25,6 +29,9 @@ _USE_MULTIPART   =  False  # send [topic, data] as multipart message
 _BRIDGE_TIMEOUT  =      1  # how long to wait for bridge startup
 _LINGER_TIMEOUT  =    250  # ms to linger after close
 _HIGH_WATER_MARK =      0  # number of bytes to buffer before dropping
+_FLUSH_DELAY     =   0.01  # seconds to collect messages before sending them
+_BULK_SIZE       =   1024  # number of messages to collect at most
+_STATS_INTERVAL  =   10.0  # seconds between bridge stats log entries
 
 
 # --------------------------------------------------------------------------
@@ -59,16 +66,26 @@ def _uninterruptible(f, *args, **kwargs):
 # have different scope (bound to the channel name).  Only one specific topic is
 # predefined: 'state' will be used for unit state updates.
 #
+# Publishers collect messages per topic for up to 'flush_delay' seconds (or
+# _BULK_SIZE messages), and send them as a single notification.  Subscribers
+# thus receive lists of messages.  Subscriptions are topic prefixes, and are
+# forwarded by the bridge to the publishers, which filter the messages.
+#
 class Pubsub(object):
     """
     This is a factory for pubsub endpoints.
     """
 
-    def __init__(self, flavor, channel, role, address=None):
+    def __init__(self, flavor, channel, role, address=None, flush_delay=None,
+                 serializer=None):
         """
         Addresses are of the form 'tcp://host:port'.  Both 'host' and 'port' can
         be wildcards for BRIDGE roles -- the bridge will report the in and out
         addresses as obj.bridge_in and obj.bridge_out.
+
+        'flush_delay' is the time (in seconds) a publisher collects messages
+        before sending them (0 disables collecting).  'serializer' names the
+        message encoding (see serializer.py).
         """
 
         self._flavor     = flavor
@@ -80,10 +97,15 @@ class Pubsub(object):
         self._log        = ru.get_logger('rp.bridges', target="%s.log" % self._name)
         self._bridge_in  = None           # bridge input  addr
         self._bridge_out = None           # bridge output addr
+        self._flush_delay = flush_delay
+        self._ser        = Serializer.create(serializer)
 
         if not self._addr:
             self._addr = 'tcp://*:*'
 
+        if self._flush_delay is None:
+            self._flush_delay = _FLUSH_DELAY
+
         self._log.info("create %s - %s - %s", self._channel, self._role, self._addr)
 
     @property
@@ -108,7 +130,8 @@ class Pubsub(object):
     # This class-method creates the appropriate sub-class for the Pubsub.
     #
     @classmethod
-    def create(cls, flavor, channel, role, address=None):
+    def create(cls, flavor, channel, role, address=None, flush_delay=None,
+               serializer=None):
 
         # Make sure that we are the base-class!
         if cls != Pubsub:
@@ -119,7 +142,7 @@ class Pubsub(object):
                 PUBSUB_ZMQ     : PubsubZMQ,
             }[flavor]
           # print 'instantiating %s' % impl
-            return impl(flavor, channel, role, address)
+            return impl(flavor, channel, role, address, flush_delay, serializer)
         except KeyError:
             raise RuntimeError("Pubsub type '%s' unknown!" % flavor)
 
@@ -172,6 +195,12 @@ class Pubsub(object):
         raise NotImplementedError('put() is not implemented')
 
 
+    # --------------------------------------------------------------------------
+    #
+    def flush(self):
+        raise NotImplementedError('flush() is not implemented')
+
+
     # --------------------------------------------------------------------------
     #
     def get(self):
@@ -194,15 +223,21 @@ class Pubsub(object):
 #
 class PubsubZMQ(Pubsub):
 
-    def __init__(self, flavor, channel, role, address=None):
+    def __init__(self, flavor, channel, role, address=None, flush_delay=None,
+                 serializer=None):
         """
         This PubSub implementation is built upon, as you may have guessed
         already, the ZMQ pubsub communication pattern.
+
+        Messages are sent as '<topic> <n> <data>', where 'data' is the
+        serialized list of 'n' messages.
         """
 
         self._p = None  # the bridge process
+        self._t = None  # the publisher's flush thread
 
-        Pubsub.__init__(self, flavor, channel, role, address)
+        Pubsub.__init__(self, flavor, channel, role, address, flush_delay,
+                        serializer)
 
 
         # ----------------------------------------------------------------------
@@ -215,6 +250,22 @@ class PubsubZMQ(Pubsub):
             self._q.hwm    = _HIGH_WATER_MARK
             self._q.connect(str(self._addr))
 
+            # messages are collected per topic, and sent by a flush thread.
+            # The lock protects the bulks and the socket.
+            self._lock  = mt.Lock()
+            self._bulks = dict()   # topic -> [first put time, [msgs]]
+            self._stop  = mt.Event()
+
+            if self._flush_delay:
+                self._t = mt.Thread(target=self._flusher,
+                                    name="%s.flusher" % self._name)
+                self._t.daemon = True
+                self._t.start()
+
+                # stop the flusher (and send what is left) before the
+                # interpreter tears down the modules it uses
+                atexit.register(self.stop)
+
 
         # ----------------------------------------------------------------------
         elif self._role == PUBSUB_BRIDGE:
@@ -252,6 +303,7 @@ class PubsubZMQ(Pubsub):
                     _out = ctx.socket(zmq.XPUB)
                     _out.linger = _LINGER_TIMEOUT
                     _out.hwm    = _HIGH_WATER_MARK
+                    _out.setsockopt(zmq.XPUB_VERBOSE, 1)  # see all subscriptions
                     _out.bind(addr)
 
                     # communicate the bridge ports to the parent process
@@ -267,6 +319,8 @@ class PubsubZMQ(Pubsub):
                     _poll.register(_in,  zmq.POLLIN)
                     _poll.register(_out, zmq.POLLIN)
 
+                    stats = _BridgeStats(self._log, self._name)
+
                     while True:
 
                         _socks = dict(_uninterruptible(_poll.poll, timeout=1000)) # timeout in ms
@@ -275,9 +329,13 @@ class PubsubZMQ(Pubsub):
                             if _USE_MULTIPART:
                                 msg = _uninterruptible(_in.recv_multipart, flags=zmq.NOBLOCK)
                                 _uninterruptible(_out.send_multipart, msg)
+                                stats.forward(msg[0], int(msg[1]), len(msg[2]))
                             else:
                                 msg = _uninterruptible(_in.recv, flags=zmq.NOBLOCK)
                                 _uninterruptible(_out.send, msg)
+                                i = msg.find(' ')
+                                j = msg.find(' ', i + 1)
+                                stats.forward(msg[:i], int(msg[i + 1:j]), len(msg))
                           # self._log.debug("-> %s", msg)
 
 
@@ -285,11 +343,15 @@ class PubsubZMQ(Pubsub):
                             if _USE_MULTIPART:
                                 msg = _uninterruptible(_out.recv_multipart)
                                 _uninterruptible(_in.send_multipart, msg)
+                                stats.subscribe(msg[0])
                             else:
                                 msg = _uninterruptible(_out.recv)
                                 _uninterruptible(_in.send, msg)
+                                stats.subscribe(msg)
                           # self._log.debug("<- %s", msg)
 
+                        stats.report()
+
                 except Exception as e:
                     self._log.exception('bridge error: %s', e)
             # ------------------------------------------------------------------
@@ -338,6 +400,14 @@ class PubsubZMQ(Pubsub):
     #
     def stop(self):
 
+        if self._t:
+            self._stop.set()
+            self._t.join()
+            self._t = None
+
+        if self._role == PUBSUB_PUB:
+            self.flush()
+
         if self._p:
             self._p.terminate()
 
@@ -355,6 +425,37 @@ class PubsubZMQ(Pubsub):
         _uninterruptible(self._q.setsockopt, zmq.SUBSCRIBE, topic)
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _send(self, topic, msgs):
+
+        # must be called with the lock held
+        data = self._ser.dumps(msgs)
+
+        if _USE_MULTIPART:
+          # self._log.debug("-> %s", str([topic, data]))
+            _uninterruptible(self._q.send_multipart, [topic, str(len(msgs)), data])
+
+        else:
+          # self._log.debug("-> %s %s", topic, data)
+            _uninterruptible(self._q.send, "%s %d %s" % (topic, len(msgs), data))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _flusher(self):
+
+        # send all bulks which are older than the flush delay
+        while not self._stop.wait(self._flush_delay / 2):
+
+            with self._lock:
+                now = time.time()
+                for topic, bulk in self._bulks.items():
+                    if now - bulk[0] >= self._flush_delay:
+                        self._send(topic, bulk[1])
+                        del(self._bulks[topic])
+
+
     # --------------------------------------------------------------------------
     #
     def put(self, topic, msg):
@@ -363,58 +464,160 @@ class PubsubZMQ(Pubsub):
             raise RuntimeError("channel %s (%s) can't put()" % (self._channel, self._role))
 
         topic = topic.replace(' ', '_')
-        data = json.dumps(msg)
+
+        with self._lock:
+
+            if not self._flush_delay:
+                self._send(topic, [msg])
+                return
+
+            if topic not in self._bulks:
+                self._bulks[topic] = [time.time(), list()]
+
+            bulk = self._bulks[topic]
+            bulk[1].append(msg)
+
+            if len(bulk[1]) >= _BULK_SIZE:
+                self._send(topic, bulk[1])
+                del(self._bulks[topic])
+
+
+    # --------------------------------------------------------------------------
+    #
+    def flush(self):
+        """
+        send all collected messages
+        """
+
+        if not self._role == PUBSUB_PUB:
+            raise RuntimeError("channel %s (%s) can't flush()" % (self._channel, self._role))
+
+        with self._lock:
+            for topic, bulk in self._bulks.iteritems():
+                self._send(topic, bulk[1])
+            self._bulks = dict()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _recv(self, flags=0):
 
         if _USE_MULTIPART:
-          # self._log.debug("-> %s", str([topic, data]))
-            _uninterruptible(self._q.send_multipart, [topic, data])
+            topic, _, data = _uninterruptible(self._q.recv_multipart, flags=flags)
 
         else:
-          # self._log.debug("-> %s %s", topic, data)
-            _uninterruptible(self._q.send, "%s %s" % (topic, data))
+            raw = _uninterruptible(self._q.recv, flags=flags)
+            topic, _, data = raw.split(' ', 2)
+
+        msgs = self._ser.loads(data)
+      # self._log.debug("<- %s", str([topic, pprint.pformat(msgs)]))
+        return [topic, msgs]
 
 
     # --------------------------------------------------------------------------
     #
     def get(self):
+        """
+        Returns the topic and the list of messages of the next notification.
+        """
 
         if not self._role == PUBSUB_SUB:
             raise RuntimeError("channel %s (%s) can't get()" % (self._channel, self._role))
 
-        if _USE_MULTIPART:
-            topic, data = _uninterruptible(self._q.recv_multipart)
-
-        else:
-            raw = _uninterruptible(self._q.recv)
-            topic, data = raw.split(' ', 1)
-
-        msg = json.loads(data)
-      # self._log.debug("<- %s", str([topic, pprint.pformat(msg)]))
-        return [topic, msg]
+        return self._recv()
 
 
     # --------------------------------------------------------------------------
     #
     def get_nowait(self, timeout=None): # timeout in ms
+        """
+        Like get(), but returns [None, None] if no notification arrives within
+        the timeout.
+        """
 
         if not self._role == PUBSUB_SUB:
             raise RuntimeError("channel %s (%s) can't get_nowait()" % (self._channel, self._role))
 
         if _uninterruptible(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
+            return self._recv(flags=zmq.NOBLOCK)
 
-            if _USE_MULTIPART:
-                topic, data = _uninterruptible(self._q.recv_multipart, flags=zmq.NOBLOCK)
+        else:
+            return [None, None]
 
-            else:
-                raw = _uninterruptible(self._q.recv)
-                topic, data = raw.split(' ', 1)
 
-            msg = json.loads(data)
-            self._log.debug(">> %s", str([topic, pprint.pformat(msg)]))
-            return [topic, msg]
+# ==============================================================================
+#
+class _BridgeStats(object):
+    """
+    Message and byte counters per topic, for a pubsub bridge.  The bridge also
+    sees the subscriptions (topic prefixes) forwarded to the publishers, so we
+    can count how many messages are delivered to subscribers (fan-out).  The
+    counters are logged and reset every _STATS_INTERVAL seconds.
+    """
 
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, log, name):
+
+        self._log    = log
+        self._name   = name
+        self._subs   = dict()  # prefix -> number of subscribers
+        self._fanout = dict()  # topic  -> number of subscribers
+        self._stats  = dict()  # topic  -> [notifications, msgs, bytes, delivered]
+        self._last   = time.time()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def subscribe(self, msg):
+
+        # subscriptions are '\x01<prefix>', unsubscriptions are '\x00<prefix>'
+        if not msg or msg[0] not in ['\x00', '\x01']:
+            return
+
+        prefix = msg[1:]
+        if msg[0] == '\x01':
+            self._subs[prefix] = self._subs.get(prefix, 0) + 1
         else:
-            return [None, None]
+            self._subs[prefix] = max(0, self._subs.get(prefix, 0) - 1)
+
+        # recount fan-out on the next messages
+        self._fanout = dict()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def forward(self, topic, nmsgs, nbytes):
+
+        if topic not in self._fanout:
+            self._fanout[topic] = sum([n for prefix, n in self._subs.iteritems()
+                                         if topic.startswith(prefix)])
+        if topic not in self._stats:
+            self._stats[topic] = [0, 0, 0, 0]
+
+        stats     = self._stats[topic]
+        stats[0] += 1
+        stats[1] += nmsgs
+        stats[2] += nbytes
+        stats[3] += nmsgs * self._fanout[topic]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def report(self):
+
+        now = time.time()
+        if now - self._last < _STATS_INTERVAL:
+            return
+
+        for topic, stats in self._stats.iteritems():
+            self._log.info('stats %s : %s : %d notifications, %d msgs, '
+                           '%d bytes, %d msgs delivered (%.1f msgs/s)',
+                           self._name, topic, stats[0], stats[1], stats[2],
+                           stats[3], stats[1] / (now - self._last))
+
+        self._stats = dict()
+        self._last  = now
 
 
 # ------------------------------------------------------------------------------
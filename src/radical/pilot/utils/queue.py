@@ -1,6 +1,7 @@
 
 import os
 import zmq
+import json
 import time
 import errno
 import pprint
@@ -10,6 +11,8 @@ import threading       as mt
 import multiprocessing as mp
 import radical.utils   as ru
 
+from .serializer import Serializer
+
 # --------------------------------------------------------------------------
 # defines for queue roles
 QUEUE_INPUT   = 'input'
@@ -26,6 +29,7 @@ QUEUE_TYPES   = [QUEUE_THREAD, QUEUE_PROCESS, QUEUE_ZMQ]
 _BRIDGE_TIMEOUT  =      1  # how long to wait for bridge startup
 _LINGER_TIMEOUT  =    250  # ms to linger after close
 _HIGH_WATER_MARK =      0  # number of bytes to buffer before dropping
+_BULK_SIZE       =      1  # max number of messages served per request
 
 # --------------------------------------------------------------------------
 #
@@ -84,6 +88,13 @@ def _uninterruptible(f, *args, **kwargs):
 #   get()
 #   get_nowait()
 #
+# and additionally
+#
+#   get_bulk_nowait()
+#
+# which returns a list of all messages available at that point (which, for zmq,
+# means all messages which can be obtained without a further round trip).
+#
 # Not implemented is, at the moment:
 #
 #   qsize
@@ -95,6 +106,10 @@ def _uninterruptible(f, *args, **kwargs):
 #   task_done
 #   join
 #
+# As an extension to the Queue.Queue semantics, 'put()' also accepts a list of
+# messages, which is equivalent to (but for zmq much cheaper than) putting the
+# list elements individually, in order.
+#
 # Our Queue additionally takes 'name', 'role' and 'address' parameter on the
 # constructor.  'role' can be 'input', 'bridge' or 'output', where 'input' is
 # the end of a queue one can 'put()' messages into, and 'output' the end of the
@@ -102,7 +117,10 @@ def _uninterruptible(f, *args, **kwargs):
 # forwarder.  'address' denominates a connection endpoint, and 'name' is
 # a unique identifier: if multiple instances in the current process space use
 # the same identifier, they will get the same queue instance.  Those parameters
-# are mostly useful for the zmq queue.
+# are mostly useful for the zmq queue.  'bulk_size' is only used by the zmq
+# queue, and determines how many messages an output end will fetch from the
+# bridge in one round trip (see QueueZMQ).  'serializer' is also only used by
+# the zmq queue, and names the message encoding (see serializer.py).
 #
 class _QueueRegistry(object):
 
@@ -145,12 +163,15 @@ class Queue(object):
     """
     This is really just the queue interface we want to implement
     """
-    def __init__(self, flavor, qname, role, address=None):
+    def __init__(self, flavor, qname, role, address=None, bulk_size=None,
+                 serializer=None):
 
         self._flavor = flavor
         self._qname  = qname
         self._role   = role
         self._addr   = address
+        self._bulk   = bulk_size
+        self._ser    = Serializer.create(serializer)
         self._debug  = False
         self._name   = "queue.%s.%s" % (self._qname, self._role)
         self._log    = ru.get_logger('rp.bridges', target="%s.log" % self._name)
@@ -158,6 +179,9 @@ class Queue(object):
         if not self._addr:
             self._addr = 'tcp://*:*'
 
+        if not self._bulk:
+            self._bulk = _BULK_SIZE
+
         if role in [QUEUE_INPUT, QUEUE_OUTPUT]:
             self._log.info("create %s - %s - %s - %s", flavor, qname, role, address)
 
@@ -181,13 +205,18 @@ class Queue(object):
     def addr(self):
         return self._addr
 
+    @property
+    def bulk_size(self):
+        return self._bulk
+
 
     # --------------------------------------------------------------------------
     #
     # This class-method creates the appropriate sub-class for the Queue.
     #
     @classmethod
-    def create(cls, flavor, name, role, address=None):
+    def create(cls, flavor, name, role, address=None, bulk_size=None,
+               serializer=None):
 
         # Make sure that we are the base-class!
         if cls != Queue:
@@ -200,7 +229,7 @@ class Queue(object):
                 QUEUE_ZMQ     : QueueZMQ,
             }[flavor]
           # print 'instantiating %s' % impl
-            return impl(flavor, name, role, address)
+            return impl(flavor, name, role, address, bulk_size, serializer)
         except KeyError:
             raise RuntimeError("Queue type '%s' unknown!" % flavor)
 
@@ -235,6 +264,12 @@ class Queue(object):
         raise NotImplementedError('get_nowait() is not implemented')
 
 
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk_nowait(self):
+        raise NotImplementedError('get_bulk_nowait() is not implemented')
+
+
     # --------------------------------------------------------------------------
     #
     def stop(self):
@@ -245,9 +280,10 @@ class Queue(object):
 #
 class QueueThread(Queue):
 
-    def __init__(self, flavor, name, role, address=None):
+    def __init__(self, flavor, name, role, address=None, bulk_size=None,
+                 serializer=None):
 
-        Queue.__init__(self, flavor, name, role, address)
+        Queue.__init__(self, flavor, name, role, address, bulk_size, serializer)
         self._q = _registry.get(flavor, name, pyq.Queue)
 
 
@@ -258,7 +294,11 @@ class QueueThread(Queue):
         if not self._role == QUEUE_INPUT:
             raise RuntimeError("queue %s (%s) can't put()" % (self._qname, self._role))
 
-        self._q.put(msg)
+        if isinstance(msg, list):
+            for m in msg:
+                self._q.put(m)
+        else:
+            self._q.put(msg)
 
 
     # --------------------------------------------------------------------------
@@ -284,13 +324,29 @@ class QueueThread(Queue):
             return None
 
 
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk_nowait(self):
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get_bulk_nowait()" % (self._qname, self._role))
+
+        msgs = list()
+        try:
+            while True:
+                msgs.append(self._q.get_nowait())
+        except pyq.Empty:
+            return msgs
+
+
 # ==============================================================================
 #
 class QueueProcess(Queue):
 
-    def __init__(self, flavor, name, role, address=None):
+    def __init__(self, flavor, name, role, address=None, bulk_size=None,
+                 serializer=None):
 
-        Queue.__init__(self, flavor, name, role, address)
+        Queue.__init__(self, flavor, name, role, address, bulk_size, serializer)
         self._q = _registry.get(flavor, name, mp.Queue)
 
 
@@ -301,7 +357,11 @@ class QueueProcess(Queue):
         if not self._role == QUEUE_INPUT:
             raise RuntimeError("queue %s (%s) can't put()" % (self._qname, self._role))
 
-        self._q.put(msg)
+        if isinstance(msg, list):
+            for m in msg:
+                self._q.put(m)
+        else:
+            self._q.put(msg)
 
 
     # --------------------------------------------------------------------------
@@ -327,12 +387,28 @@ class QueueProcess(Queue):
             return None
 
 
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk_nowait(self):
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get_bulk_nowait()" % (self._qname, self._role))
+
+        msgs = list()
+        try:
+            while True:
+                msgs.append(self._q.get_nowait())
+        except pyq.Empty:
+            return msgs
+
+
 # ==============================================================================
 #
 class QueueZMQ(Queue):
 
 
-    def __init__(self, flavor, name, role, address=None):
+    def __init__(self, flavor, name, role, address=None, bulk_size=None,
+                 serializer=None):
         """
         This Queue type sets up an zmq channel of this kind:
 
@@ -351,16 +427,30 @@ class QueueZMQ(Queue):
         Addresses are of the form 'tcp://host:port'.  Both 'host' and 'port' can
         be wildcards for BRIDGE roles -- the bridge will report the in and out
         addresses as obj.bridge_in and obj.bridge_out.
+
+        Messages are transferred in bulk where possible: a list passed to
+        'put()' is sent as a single multipart message (one frame per list
+        element), and the bridge buffers all incoming frames.  An output
+        requests up to 'bulk_size' messages per round trip, and the bridge
+        replies with as many buffered frames as it has (but at least one).
+        The output keeps those messages in a local prefetch buffer, from which
+        'get()' and 'get_nowait()' serve without any further round trip.
+        A 'bulk_size' of 1 results in the original one-message-per-request
+        behavior, which gives the fairest routing between multiple outputs.
+
+        Messages are encoded by the queue's serializer.  The bridge never
+        decodes messages, so it does not need to know the serializer.
         """
 
         self._p          = None           # the bridge process
         self._q          = None           # the zmq queue
-        self._lock       = mt.RLock()     # for _requested
+        self._lock       = mt.RLock()     # for _requested and _cache
         self._requested  = False          # send/recv sync
+        self._cache      = list()         # prefetched messages (raw frames)
         self._bridge_in  = None           # bridge input  addr
         self._bridge_out = None           # bridge output addr
 
-        Queue.__init__(self, flavor, name, role, address)
+        Queue.__init__(self, flavor, name, role, address, bulk_size, serializer)
 
         # ----------------------------------------------------------------------
         # behavior depends on the role...
@@ -399,9 +489,6 @@ class QueueZMQ(Queue):
 
                     self._log.info('start bridge %s on %s', self._name, addr)
 
-                    # FIXME: should we cache messages coming in at the pull/push 
-                    #        side, so as not to block the push end?
-
                     ctx = zmq.Context()
                     _in = ctx.socket(zmq.PULL)
                     _in.linger = _LINGER_TIMEOUT
@@ -421,17 +508,45 @@ class QueueZMQ(Queue):
 
                     self._log.info('bound bridge %s to %s : %s', self._name, _in_port, _out_port)
 
-                    # start polling for messages
+                    # We cache messages coming in at the pull side, so as not
+                    # to block the push end.  The messages are never decoded
+                    # here, but are passed on as the raw frames we received.
+                    # A request on the rep side carries the number of messages
+                    # the requester is willing to accept.  While a request is
+                    # pending we can't receive the next one, so we stop polling
+                    # the rep side until we were able to reply.
+                    buf       = list()
+                    requested = 0
+
                     _poll = zmq.Poller()
+                    _poll.register(_in,  zmq.POLLIN)
                     _poll.register(_out, zmq.POLLIN)
 
                     while True:
 
                         events = dict(_uninterruptible(_poll.poll, 1000)) # timeout in ms
 
+                        if _in in events:
+                            # drain whatever is available right now
+                            while True:
+                                try:
+                                    buf.extend(_in.recv_multipart(flags=zmq.NOBLOCK))
+                                except zmq.Again:
+                                    break
+
                         if _out in events:
                             req = _uninterruptible(_out.recv)
-                            _uninterruptible(_out.send_json, _uninterruptible(_in.recv_json))
+                            try:
+                                requested = max(1, int(req))
+                            except ValueError:
+                                requested = 1  # plain 'request'
+                            _poll.unregister(_out)
+
+                        if requested and buf:
+                            _uninterruptible(_out.send_multipart, buf[:requested])
+                            del(buf[:requested])
+                            requested = 0
+                            _poll.register(_out, zmq.POLLIN)
 
                 except Exception as e:
                     self._log.exception('bridge error: %s', e)
@@ -484,6 +599,18 @@ class QueueZMQ(Queue):
         return self._bridge_out
 
 
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def socket(self):
+        """
+        The zmq socket of an input or output, to be used in a zmq.Poller.  Note
+        that outputs only become readable when a request is pending, so
+        a get_bulk_nowait() call should be issued before polling.
+        """
+        return self._q
+
+
     # --------------------------------------------------------------------------
     #
     def poll(self):
@@ -510,7 +637,38 @@ class QueueZMQ(Queue):
             raise RuntimeError("queue %s (%s) can't put()" % (self._qname, self._role))
 
       # self._log.debug("-> %s", pprint.pformat(msg))
-        _uninterruptible(self._q.send_json, msg)
+        if isinstance(msg, list):
+            if msg:
+                _uninterruptible(self._q.send_multipart, [self._ser.dumps(m) for m in msg])
+        else:
+            _uninterruptible(self._q.send, self._ser.dumps(msg))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _request(self):
+        """
+        ask the bridge for the next batch of messages.  Must be called with
+        self._lock held.
+        """
+
+        if not self._requested:
+            # we can only send the request once per recieval
+            _uninterruptible(self._q.send, str(self._bulk))
+            self._requested = True
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _receive(self):
+        """
+        receive a batch of messages into the prefetch cache.  Must be called
+        with self._lock held, and after _request().
+        """
+
+        # reverse, so that we can cheaply pop() messages in order
+        self._cache = _uninterruptible(self._q.recv_multipart)[::-1]
+        self._requested = False
 
 
     # --------------------------------------------------------------------------
@@ -520,11 +678,15 @@ class QueueZMQ(Queue):
         if not self._role == QUEUE_OUTPUT:
             raise RuntimeError("queue %s (%s) can't get()" % (self._qname, self._role))
 
-        _uninterruptible(self._q.send, 'request')
+        with self._lock:
 
-        msg = _uninterruptible(self._q.recv_json)
-      # self._log.debug("<- %s", pprint.pformat(msg))
-        return msg
+            if not self._cache:
+                self._request()
+                self._receive()
+
+            msg = self._ser.loads(self._cache.pop())
+          # self._log.debug("<- %s", pprint.pformat(msg))
+            return msg
 
 
     # --------------------------------------------------------------------------
@@ -534,30 +696,44 @@ class QueueZMQ(Queue):
         if not self._role == QUEUE_OUTPUT:
             raise RuntimeError("queue %s (%s) can't get_nowait()" % (self._qname, self._role))
 
-        with self._lock: # need to protect self._requested
+        with self._lock: # need to protect self._requested and self._cache
 
-            if not self._requested:
-                # we can only send the request once per recieval
-                _uninterruptible(self._q.send, 'request')
-                self._requested = True
+            if not self._cache:
 
-          # try:
-          #     msg = self._q.recv_json(flags=zmq.NOBLOCK)
-          #     self._requested = False
-          #     self._log.debug("<< %s", pprint.pformat(msg))
-          #     return msg
-          #
-          # except zmq.Again:
-          #     return None
+                self._request()
 
-            if _uninterruptible(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
-                msg = _uninterruptible(self._q.recv_json)
-                self._requested = False
-              # self._log.debug("<< %s", pprint.pformat(msg))
-                return msg
+                if not _uninterruptible(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
+                    return None
 
-            else:
-                return None
+                self._receive()
+
+            msg = self._ser.loads(self._cache.pop())
+          # self._log.debug("<< %s", pprint.pformat(msg))
+            return msg
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk_nowait(self, timeout=None): # timeout in ms
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get_bulk_nowait()" % (self._qname, self._role))
+
+        with self._lock: # need to protect self._requested and self._cache
+
+            if not self._cache:
+
+                self._request()
+
+                if not _uninterruptible(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
+                    return list()
+
+                self._receive()
+
+            msgs = [self._ser.loads(m) for m in reversed(self._cache)]
+            self._cache = list()
+          # self._log.debug("<< %s", pprint.pformat(msgs))
+            return msgs
 
 
 # ------------------------------------------------------------------------------
@@ -0,0 +1,159 @@
+
+import json
+import radical.utils as ru
+
+try:
+    import msgpack
+    # the pure python fallback of msgpack is much slower than json
+    if msgpack.Packer.__module__ == 'msgpack.fallback':
+        msgpack = None
+except ImportError:
+    msgpack = None
+
+
+# --------------------------------------------------------------------------
+# defines for serializer types
+SERIALIZER_JSON    = 'json'
+SERIALIZER_MSGPACK = 'msgpack'
+SERIALIZER_TYPES   = [SERIALIZER_JSON, SERIALIZER_MSGPACK]
+
+_DEFAULT_SERIALIZER = SERIALIZER_JSON
+
+
+# ==============================================================================
+#
+# Messages sent over queues and pubsub channels are serialized.  The serialized
+# form starts with a one byte tag which identifies the serializer, so that
+# endpoints which use different serializers fail loudly, instead of passing on
+# garbage.  Both serializers return unicode strings on decoding, and lists for
+# tuples, so that the receiving components see the same messages for either
+# serializer.
+#
+# msgpack is a dependency of radical.pilot, but if it is not installed (or not
+# compiled), we fall back to json (with a warning).  All endpoints of a channel must be configured
+# alike.
+#
+class Serializer(object):
+    """
+    This is a factory for serializers.
+    """
+
+    tag = None
+
+    def __init__(self, flavor):
+
+        self._flavor = flavor
+
+    @property
+    def flavor(self):
+        return self._flavor
+
+
+    # --------------------------------------------------------------------------
+    #
+    # This class-method creates the appropriate sub-class for the Serializer.
+    #
+    @classmethod
+    def create(cls, flavor=None):
+
+        # Make sure that we are the base-class!
+        if cls != Serializer:
+            raise TypeError("Serializer Factory only available to base class!")
+
+        if not flavor:
+            flavor = _DEFAULT_SERIALIZER
+
+        if flavor == SERIALIZER_MSGPACK and not msgpack:
+            ru.get_logger('rp.bridges').warn('msgpack not available, using json')
+            flavor = SERIALIZER_JSON
+
+        try:
+            impl = {
+                SERIALIZER_JSON    : SerializerJSON,
+                SERIALIZER_MSGPACK : SerializerMsgpack,
+            }[flavor]
+            return impl(flavor)
+        except KeyError:
+            raise RuntimeError("Serializer type '%s' unknown!" % flavor)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def dumps(self, msg):
+        raise NotImplementedError('dumps() is not implemented')
+
+
+    # --------------------------------------------------------------------------
+    #
+    def loads(self, data):
+        raise NotImplementedError('loads() is not implemented')
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _check(self, data):
+
+        if not data or data[0] != self.tag:
+            raise RuntimeError("%s serializer can't decode message tagged '%s'"
+                               % (self._flavor, data[:1]))
+
+
+# ==============================================================================
+#
+class SerializerJSON(Serializer):
+
+    tag = 'j'
+
+    # --------------------------------------------------------------------------
+    #
+    def dumps(self, msg):
+
+        return self.tag + json.dumps(msg)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def loads(self, data):
+
+        self._check(data)
+        return json.loads(data[1:])
+
+
+# ==============================================================================
+#
+class SerializerMsgpack(Serializer):
+
+    tag = 'm'
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, flavor):
+
+        Serializer.__init__(self, flavor)
+
+        # strings are packed as msgpack 'raw', and unpacked as unicode (like
+        # json).  Older msgpack versions use the 'encoding' parameter for the
+        # latter.
+        if msgpack.version < (0, 5, 2):
+            self._unpack_args = {'encoding' : 'utf-8'}
+        else:
+            self._unpack_args = {'raw' : False}
+
+
+    # --------------------------------------------------------------------------
+    #
+    def dumps(self, msg):
+
+        return self.tag + msgpack.packb(msg, use_bin_type=False)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def loads(self, data):
+
+        self._check(data)
+        return msgpack.unpackb(buffer(data, 1), **self._unpack_args)
+
+
+# ------------------------------------------------------------------------------
+
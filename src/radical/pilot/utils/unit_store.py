@@ -0,0 +1,168 @@
+
+import os
+import mmap
+import threading as mt
+
+
+# keys which are always sent along with a unit, and are never stored
+_ENVELOPE_KEYS = ['_id', 'state', 'state_timestamp', '_store']
+
+# max size of the changed fields sent along with a unit, relative to the size
+# of the stored unit -- beyond that, the full unit is stored again
+_MAX_DELTA = 0.1
+
+
+# ==============================================================================
+#
+# Units are passed between agent components via queues.  Instead of sending the
+# full unit dict on every hop, the components can share an append-only unit
+# store: the full unit is stored once, and the queues only carry an envelope
+# with the unit id, its state, the location of the stored record, and those
+# fields which changed since the record was stored.  The next component reads
+# the record when it receives the envelope, and applies the changes.  When the
+# changes grow too large, the unit is stored again.
+#
+# The store is a file which all components append to, and which is memory
+# mapped for reading.  Records are only appended (O_APPEND makes that safe for
+# multiple processes), never changed or removed, so readers need no locking.
+# The store file is only consistent between processes on the same node, so it
+# must only be used if all agent components run on the same node.
+#
+# A component detects changed fields by comparing the unit to the stored record
+# it received.  The record is deserialized again for that comparison, so that
+# fields which are modified in place (like the scheduler's clone callback does
+# with the unit's slots) are detected as changed, too.
+#
+class UnitStore(object):
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, path, serializer):
+
+        self._path  = path
+        self._ser   = serializer
+        self._lock  = mt.Lock()       # protects the fd offset and the map
+        self._fd    = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0600)
+        self._map   = None            # read-only map of the store file
+        self._bases = dict()          # uid -> [location, stored record]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+
+        with self._lock:
+            if self._map:
+                self._map.close()
+                self._map = None
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _append(self, data):
+
+        # the write appends atomically, and leaves our file offset behind the
+        # written record
+        with self._lock:
+            n = os.write(self._fd, data)
+            if n != len(data):
+                raise IOError('short write to unit store %s' % self._path)
+            end = os.lseek(self._fd, 0, os.SEEK_CUR)
+
+        return [end - n, n]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _read(self, offset, length):
+
+        with self._lock:
+            if not self._map or offset + length > len(self._map):
+                # the store grew since we mapped it
+                if self._map:
+                    self._map.close()
+                self._map = mmap.mmap(self._fd, 0, mmap.MAP_SHARED, mmap.PROT_READ)
+
+            return self._map[offset:offset + length]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def put(self, unit):
+        """
+        Return the envelope to send instead of the given unit, and store the
+        unit if needed.
+        """
+
+        envelope = dict()
+        for key in _ENVELOPE_KEYS:
+            if key in unit:
+                envelope[key] = unit[key]
+
+        # if we received that unit from the store, and it did not change much,
+        # we only send the changes
+        base = self._bases.pop(unit['_id'], None)
+        if base:
+            location, data = base
+            stored  = self._ser.loads(data)
+            changed = dict()
+            for key, val in unit.iteritems():
+                if key not in _ENVELOPE_KEYS and \
+                   (key not in stored or stored[key] != val):
+                    changed[key] = val
+
+            removed = [key for key in stored if key not in unit]
+
+            if not removed and \
+               len(self._ser.dumps(changed)) <= location[1] * _MAX_DELTA:
+                envelope.update(changed)
+                envelope['_store'] = location
+                return envelope
+
+        record = dict()
+        for key, val in unit.iteritems():
+            if key not in _ENVELOPE_KEYS:
+                record[key] = val
+
+        envelope['_store'] = self._append(self._ser.dumps(record))
+        return envelope
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get(self, envelope):
+        """
+        Return the full unit for the given envelope.  Units which were not sent
+        via the store are returned as they are.
+        """
+
+        if '_store' not in envelope:
+            return envelope
+
+        offset, length = envelope['_store']
+
+        data = self._read(offset, length)
+        unit = self._ser.loads(data)
+
+        unit.update(envelope)
+        self._bases[unit['_id']] = [envelope['_store'], data]
+
+        return unit
+
+
+    # --------------------------------------------------------------------------
+    #
+    def forget(self, uid):
+        """
+        The unit will not be sent on (it is final, or got dropped), so we don't
+        need to keep its stored values.
+        """
+
+        self._bases.pop(uid, None)
+
+
+# ------------------------------------------------------------------------------
+
@@ -547,7 +547,8 @@ class Agent(rpu.Worker):
 
         self._cu.update(multi    = True,
                         spec     = {"_id"   : {"$in"     : cu_uids}},
-                        document = {"$set"  : {"control" : 'agent'}})
+                        document = {"$set"  : {"control" : 'agent'},
+                                    "$currentDate": {"modified": True}})
 
         self._log.info("units pulled: %4d"   % len(cu_list))
         self._prof.prof('get', msg="bulk size: %d" % len(cu_list), uid=self._pilot_id)
@@ -5,6 +5,7 @@ __license__   = "MIT"
 
 import time
 import threading
+import collections
 
 import radical.utils as ru
 
@@ -12,6 +13,170 @@ from .. import utils     as rpu
 from .. import states    as rps
 from .. import constants as rpc
 
+from ..utils.component import _STATES_LEAVE
+
+
+# the order of unit states, used to re-order state updates
+_S2I = {rps.NEW                          :  0,
+
+        rps.PENDING                      :  1,
+        rps.PENDING_LAUNCH               :  2,
+        rps.LAUNCHING                    :  3,
+        rps.PENDING_ACTIVE               :  4,
+        rps.ACTIVE                       :  5,
+
+        rps.UNSCHEDULED                  :  6,
+        rps.SCHEDULING                   :  7,
+        rps.PENDING_INPUT_STAGING        :  8,
+        rps.STAGING_INPUT                :  9,
+        rps.AGENT_STAGING_INPUT_PENDING  : 10,
+        rps.AGENT_STAGING_INPUT          : 11,
+        rps.ALLOCATING_PENDING           : 12,
+        rps.ALLOCATING                   : 13,
+        rps.EXECUTING_PENDING            : 14,
+        rps.EXECUTING                    : 15,
+        rps.AGENT_STAGING_OUTPUT_PENDING : 16,
+        rps.AGENT_STAGING_OUTPUT         : 17,
+        rps.PENDING_OUTPUT_STAGING       : 18,
+        rps.STAGING_OUTPUT               : 19,
+
+        rps.DONE                         : 20,
+        rps.CANCELING                    : 21,
+        rps.CANCELED                     : 22,
+        rps.FAILED                       : 23
+        }
+_I2S   = dict([[v, k] for k, v in _S2I.iteritems()])
+_S_MAX = _S2I[rps.FAILED]
+_FINAL = [rps.DONE, rps.FAILED, rps.CANCELED]
+
+# we get the units in this state
+_S_FIRST = _S2I[rps.AGENT_STAGING_INPUT_PENDING]
+
+# number of final units for which we remember that they are final
+_FINAL_CACHE_SIZE = 100000
+
+# a bulk is pushed when it reaches any of these limits (or when it gets too old)
+_BULK_SIZE  = 1024              # number of update requests
+_BULK_BYTES = 4 * 1024 * 1024   # estimated size of the updates
+
+# failed bulk pushes are retried with exponential backoff (seconds), and the
+# agent is shut down after that many consecutive failures
+_RETRY_DELAY = 1.0
+_RETRY_MAX   = 60.0
+_RETRIES     = 10
+
+
+# ------------------------------------------------------------------------------
+#
+def _estimate_size(update_dict):
+    """
+    Cheap estimate of the BSON size of an update dict: string values (like
+    stdout and stderr) dominate, everything else is accounted for by a small
+    constant.
+    """
+
+    size = 64
+    for op in update_dict.itervalues():
+        if isinstance(op, dict):
+            for val in op.itervalues():
+                if isinstance(val, basestring): size += len(val)
+                else                          : size += 16
+    return size
+
+
+# ==============================================================================
+#
+class UpdateBulk(object):
+    """
+    A set of update requests for one collection, which are pushed to the DB in
+    one ordered bulk operation.  All consecutive updates for a unit which use
+    only '$set' and '$push' (which is what state updates do) are merged into
+    a single update: the '$set' dicts are merged (later values win), and the
+    '$push' values are collected into '$push: {key: {$each: [...]}}'.  Any
+    other update is kept as is, and is not merged with later updates for the
+    same unit, to preserve the order of updates.
+    """
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self):
+
+        self._ops   = list()  # [query, update] or [query, set, push]
+        self._index = dict()  # uid -> mergeable op
+        self.uids   = list()  # [uid, state] per update request
+        self.size   = 0       # estimated size of all updates
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __len__(self):
+
+        return len(self.uids)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def add(self, uid, state, query_dict, update_dict):
+
+        self.uids.append([uid, state])
+        self.size += _estimate_size(update_dict)
+
+        mergeable = query_dict == {'_id' : uid} \
+                    and not set(update_dict.keys()) - set(['$set', '$push'])
+
+        if not mergeable:
+            # later updates must not be merged into an earlier op
+            self._index.pop(uid, None)
+            self._ops.append([query_dict, update_dict])
+            return
+
+        op = self._index.get(uid)
+        if not op:
+            op = [query_dict, dict(), dict()]
+            self._index[uid] = op
+            self._ops.append(op)
+
+        op[1].update(update_dict.get('$set', {}))
+
+        for key, val in update_dict.get('$push', {}).iteritems():
+            if key not in op[2]:
+                op[2][key] = list()
+            if isinstance(val, dict) and '$each' in val:
+                op[2][key].extend(val['$each'])
+            else:
+                op[2][key].append(val)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def ops(self):
+        """
+        return the list of [query, update] pairs to push
+        """
+
+        ret = list()
+        for op in self._ops:
+
+            if len(op) == 2:
+                ret.append(op)
+                continue
+
+            query_dict, set_dict, push_dict = op
+            update_dict = dict()
+
+            if set_dict:
+                update_dict['$set'] = set_dict
+
+            if push_dict:
+                update_dict['$push'] = dict()
+                for key, vals in push_dict.iteritems():
+                    if len(vals) == 1: update_dict['$push'][key] = vals[0]
+                    else             : update_dict['$push'][key] = {'$each' : vals}
+
+            ret.append([query_dict, update_dict])
+
+        return ret
+
 
 # ==============================================================================
 #
@@ -21,7 +186,11 @@ class Update(rpu.Worker):
     compete for update requests on the update_queue.  Those requests will be
     triplets of collection name, query dict, and update dict.  Update requests
     will be collected into bulks over some time (BULK_COLLECTION_TIME), to
-    reduce number of roundtrips.
+    reduce number of roundtrips.  Bulks are also pushed when they reach a
+    certain number of requests (BULK_COLLECTION_SIZE) or an estimated size
+    (BULK_COLLECTION_BYTES).  Updates for the same unit are merged within a
+    bulk.  Bulks are pushed by a separate flusher thread, so that the state
+    subscriber is never blocked on the DB.
     """
 
     # --------------------------------------------------------------------------
@@ -50,11 +219,24 @@ class Update(rpu.Worker):
         _, db, _, _, _      = ru.mongodb_connect(self._mongodb_url)
         self._mongo_db      = db
         self._cinfo         = dict()            # collection cache
+        self._retry         = list()            # [coll, bulk] failed to push
         self._lock          = threading.RLock() # protect _cinfo
         self._state_cache   = dict()            # used to preserve state ordering
+        self._final_cache   = collections.OrderedDict() # recently final units
+        self._final_size    = self._cfg.get('update_final_cache', _FINAL_CACHE_SIZE)
+
+        self._bulk_time     = self._cfg.get('bulk_collection_time')
+        self._bulk_size     = self._cfg.get('bulk_collection_size',  _BULK_SIZE)
+        self._bulk_bytes    = self._cfg.get('bulk_collection_bytes', _BULK_BYTES)
+
+        # run flusher thread
+        self._flush_evt = threading.Event()
+        self._terminate = threading.Event()
+        self._flusher   = threading.Thread(target=self._flush_loop, name="Flusher")
+        self._flusher.daemon = True
+        self._flusher.start()
 
         self.declare_subscriber('state', 'agent_state_pubsub', self.state_cb)
-        self.declare_idle_cb(self.idle_cb, self._cfg.get('bulk_collection_time'))
 
         # all components use the command channel for control messages
         self.declare_publisher ('command', rpc.AGENT_COMMAND_PUBSUB)
@@ -68,6 +250,11 @@ class Update(rpu.Worker):
     #
     def finalize_child(self):
 
+        # terminate flusher thread, which pushes all remaining updates
+        self._terminate.set()
+        self._flush_evt.set()
+        self._flusher.join()
+
         # communicate finalization
         self.publish('command', {'cmd' : 'final',
                                  'arg' : self.cname})
@@ -91,38 +278,14 @@ class Update(rpu.Worker):
                 check if all expected earlier states are pushed already
                 - yes: push this state also
                 - no:  only update state history
-        """
 
-        s2i = {rps.NEW                          :  0,
-
-               rps.PENDING                      :  1,
-               rps.PENDING_LAUNCH               :  2,
-               rps.LAUNCHING                    :  3,
-               rps.PENDING_ACTIVE               :  4,
-               rps.ACTIVE                       :  5,
-
-               rps.UNSCHEDULED                  :  6,
-               rps.SCHEDULING                   :  7,
-               rps.PENDING_INPUT_STAGING        :  8,
-               rps.STAGING_INPUT                :  9,
-               rps.AGENT_STAGING_INPUT_PENDING  : 10,
-               rps.AGENT_STAGING_INPUT          : 11,
-               rps.ALLOCATING_PENDING           : 12,
-               rps.ALLOCATING                   : 13,
-               rps.EXECUTING_PENDING            : 14,
-               rps.EXECUTING                    : 15,
-               rps.AGENT_STAGING_OUTPUT_PENDING : 16,
-               rps.AGENT_STAGING_OUTPUT         : 17,
-               rps.PENDING_OUTPUT_STAGING       : 18,
-               rps.STAGING_OUTPUT               : 19,
-
-               rps.DONE                         : 20,
-               rps.CANCELING                    : 21,
-               rps.CANCELED                     : 22,
-               rps.FAILED                       : 23
-               }
-        i2s = {v:k for k,v in s2i.items()}
-        s_max = rps.FAILED
+        For each unit we keep the rank of the last pushed state, a bitmask of
+        the ranks of the states received but not yet pushed, and a flag to
+        mark units which left the agent.  Units leave the agent in a final
+        state, or in PENDING_OUTPUT_STAGING (see _STATES_LEAVE).  Once such
+        a state has been pushed to the DB, the unit is evicted (see
+        _evict()).
+        """
 
         if not timestamp:
             timestamp = rpu.timestamp()
@@ -136,105 +299,209 @@ class Update(rpu.Worker):
 
       # self._log.debug(" === inp %s: %s" % (uid, state))
 
-        if uid not in self._state_cache:
-            self._state_cache[uid] = {'unsent' : list(),
-                                      'final'  : False,
-                                      'last'   : rps.AGENT_STAGING_INPUT_PENDING} # we get the cu in this state
-        cache = self._state_cache[uid]
+        # if unit is already final (and evicted), we don't push state
+        if uid in self._final_cache:
+          # self._log.debug(" === fin %s: %s" % (uid, state))
+            return update_dict
+
+        cache = self._state_cache.get(uid)
+        if not cache:
+            cache = [_S_FIRST, 0, False]  # last rank, unsent mask, final
+            self._state_cache[uid] = cache
 
         # if unit is already final, we don't push state
-        if cache['final']:
+        if cache[2]:
           # self._log.debug(" === fin %s: %s" % (uid, state))
             return update_dict
 
         # if unit becomes final, push state and remember it
-        if state in [rps.DONE, rps.FAILED, rps.CANCELED]:
-            cache['final'] = True
-            cache['last']  = state
+        if state in _FINAL:
+            cache[0] = _S2I[state]
+            cache[1] = 0
+            cache[2] = True
             update_dict['$set'] = {'state': state}
           # self._log.debug(" === Fin %s: %s" % (uid, state))
             return update_dict
 
-        # check if we have any consecutive list beyond 'last' in unsent
-        cache['unsent'].append(state)
-      # self._log.debug(" === lst %s: %s %s" % (uid, cache['last'], cache['unsent']))
-        new_state = None
-        for i in range(s2i[cache['last']]+1, s2i[s_max]):
-          # self._log.debug(" === chk %s: %s in %s" % (uid, i2s[i], cache['unsent']))
-            if i2s[i] in cache['unsent']:
-                new_state = i2s[i]
-                cache['unsent'].remove(i2s[i])
-              # self._log.debug(" === uns %s: %s" % (uid, new_state))
-            else:
-              # self._log.debug(" === brk %s: %s" % (uid, new_state))
-                break
-
-        if new_state:
-          # self._log.debug(" === new %s: %s" % (uid, new_state))
-            state = new_state
-            cache['last'] = state
-          # self._log.debug(" === set %s: %s" % (uid, state))
-            update_dict['$set'] = {'state': state}
+        # states we don't know, or which are older than the last pushed state,
+        # are never pushed
+        rank = _S2I.get(state)
+        if rank is None or rank <= cache[0]:
+            return update_dict
+
+        # check if we have any consecutive ranks beyond 'last' in unsent
+        last = cache[0]
+        mask = cache[1] | (1 << rank)
+      # self._log.debug(" === lst %s: %s %s" % (uid, last, bin(mask)))
+        while last + 1 < _S_MAX and mask & (1 << (last + 1)):
+            last += 1
+            mask &= ~(1 << last)
 
-        # record if final state is sent
-        if state in [rps.DONE, rps.FAILED, rps.CANCELED]:
-          # self._log.debug(" === FIN %s: %s" % (uid, state))
-            cache['final'] = True
+        cache[1] = mask
+
+        if last != cache[0]:
+            cache[0] = last
+            update_dict['$set'] = {'state': _I2S[last]}
+          # self._log.debug(" === set %s: %s" % (uid, _I2S[last]))
+
+            # the agent won't send any newer states for this unit
+            if _I2S[last] in _STATES_LEAVE:
+                cache[2] = True
 
         return update_dict
 
 
     # --------------------------------------------------------------------------
     #
-    def _timed_bulk_execute(self, cinfo):
+    def _evict(self, uids):
+        """
+        Remove the ordering state for all units in the given list which left
+        the agent, after their updates have been pushed.  We remember a bounded
+        number of those units as final, to ignore any late state updates.
+        """
 
-        # is there any bulk to look at?
-        if not cinfo['bulk']:
-            return False
+        for uid in uids:
 
-        now = time.time()
-        age = now - cinfo['last']
+            cache = self._state_cache.get(uid)
+            if not cache or not cache[2]:
+                continue
+
+            del(self._state_cache[uid])
+            self._final_cache[uid] = True
+
+        while len(self._final_cache) > self._final_size:
+            self._final_cache.popitem(last=False)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _is_due(self, cinfo, now):
+        """
+        check if the bulk for the given collection info should be pushed.  Must
+        be called with self._lock held.
+        """
 
-        # only push if collection time has been exceeded
-        if not age > self._cfg['bulk_collection_time']:
+        bulk = cinfo['bulk']
+
+        if not bulk:
             return False
 
-        res = cinfo['bulk'].execute()
-        self._log.debug("bulk update result: %s", res)
+        if len(bulk)  >= self._bulk_size : return True
+        if bulk.size  >= self._bulk_bytes: return True
+        if now - cinfo['last'] > self._bulk_time: return True
 
-        self._prof.prof('unit update bulk pushed (%d)' % len(cinfo['uids']), uid=self._pilot_id)
-        for entry in cinfo['uids']:
-            uid   = entry[0]
-            state = entry[1]
-            if state:
-                self._prof.prof('update', msg='unit update pushed (%s)' % state, uid=uid)
-            else:
-                self._prof.prof('update', msg='unit update pushed', uid=uid)
+        return False
 
-        cinfo['last'] = now
-        cinfo['bulk'] = None
-        cinfo['uids'] = list()
 
-        return True
+    # --------------------------------------------------------------------------
+    #
+    def _flush_loop(self):
+
+        failures = 0
+
+        while not self._terminate.is_set():
+
+            self._flush_evt.wait(self._bulk_time)
+            self._flush_evt.clear()
+
+            try:
+                self._flush()
+                failures = 0
+
+            except Exception as e:
+
+                # the bulks which failed to push are kept, and pushed first on
+                # the next attempt
+                failures += 1
+                if failures >= _RETRIES:
+                    self._log.exception("update flusher failed %d times - shutdown" % failures)
+                    self.publish('command', {'cmd' : 'shutdown',
+                                             'arg' : 'update flusher failed'})
+                    return
+
+                delay = min(_RETRY_DELAY * 2 ** (failures - 1), _RETRY_MAX)
+                self._log.exception("Error in update flusher - retry in %.1fs (%s)" % (delay, e))
+                self._terminate.wait(delay)
+
+        # push whatever is left
+        try:
+            self._flush(force=True)
+        except Exception as e:
+            self._log.exception("Error in update flusher - %d bulks lost (%s)" \
+                              % (len(self._retry), e))
 
 
     # --------------------------------------------------------------------------
     #
-    def idle_cb(self):
+    def _flush(self, force=False):
+        """
+        Push all bulks which are due (or all bulks if 'force' is set).  The
+        bulks are swapped out under the lock, but pushed without holding it.
+        Bulks which failed to push before are pushed first.  If a push fails,
+        the bulk and all bulks after it are kept for the next attempt, and the
+        error is raised.  Note that a failed bulk may have been pushed in parts,
+        so some updates of it may be applied twice.
+        """
+
+        now = time.time()
 
-        action = 0
         with self._lock:
-            for cname in self._cinfo:
-                action += self._timed_bulk_execute(self._cinfo[cname])
+            due         = self._retry
+            self._retry = list()
+            for cname, cinfo in self._cinfo.iteritems():
+                if cinfo['bulk'] and (force or self._is_due(cinfo, now)):
+                    due.append([cinfo['coll'], cinfo['bulk']])
+                    cinfo['bulk'] = UpdateBulk()
+                    cinfo['last'] = now
+
+        for idx, (coll, bulk) in enumerate(due):
+
+            try:
+                self._push(coll, bulk)
 
-        return bool(action)
+            except Exception:
+                with self._lock:
+                    self._retry = due[idx:]
+                raise
+
+        return bool(due)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _push(self, coll, bulk):
+
+        # stamp the units with the DB server time, so that the unit
+        # manager can pull the changed units only
+        mbulk = coll.initialize_ordered_bulk_op()
+        for query_dict, update_dict in bulk.ops():
+            update_dict['$currentDate'] = {'modified': True}
+            mbulk.find(query_dict).update(update_dict)
+
+        res = mbulk.execute()
+        self._log.debug("bulk update result: %s", res)
+
+        self._prof.prof('unit update bulk pushed (%d)' % len(bulk), uid=self._pilot_id)
+        for uid, state in bulk.uids:
+            if state:
+                self._prof.prof('update', msg='unit update pushed (%s)' % state, uid=uid)
+            else:
+                self._prof.prof('update', msg='unit update pushed', uid=uid)
+
+        # the pushed units which are final don't need to be tracked anymore
+        with self._lock:
+            self._evict([entry[0] for entry in bulk.uids])
 
 
     # --------------------------------------------------------------------------
     #
     def state_cb(self, topic, msg):
 
-        cu = msg
+        # we get either a single unit, or a list of units which all changed
+        # state at about the same time
+        units = msg
+        if not isinstance(units, list):
+            units = [units]
 
         # FIXME: we don't have any error recovery -- any failure to update unit
         #        state in the DB will thus result in an exception here and tear
@@ -243,14 +510,38 @@ class Update(rpu.Worker):
         # FIXME: at the moment, the update worker only operates on units.
         #        Should it accept other updates, eg. for pilot states?
         #
-        # got a new request.  Add to bulk (create as needed),
-        # and push bulk if time is up.
+        # got new requests.  Add to bulk (create as needed), and trigger the
+        # flusher if a bulk is due.
+        with self._lock:
+
+            cnames = set()
+            for cu in units:
+                cname = self._bulk_update(cu)
+                if cname:
+                    cnames.add(cname)
+
+            now = time.time()
+            for cname in cnames:
+                if self._is_due(self._cinfo[cname], now):
+                    self._flush_evt.set()
+                    break
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _bulk_update(self, cu):
+        """
+        Add the state update for a single unit to the bulk for the respective
+        collection, and return the collection name (or None if the unit is
+        ignored).  Must be called with self._lock held.
+        """
+
         uid       = cu['_id']
         state     = cu.get('state')
         timestamp = cu.get('state_timestamp', rpu.timestamp())
 
         if 'clone' in uid:
-            return
+            return None
 
         self._prof.prof('get', msg="update unit state to %s" % state, uid=uid)
 
@@ -276,32 +567,18 @@ class Update(rpu.Worker):
         # check if we handled the collection before.  If not, initialize
         cname = self._session_id + cbase
 
-        with self._lock:
-            if not cname in self._cinfo:
-                self._cinfo[cname] = {
-                        'coll' : self._mongo_db[cname],
-                        'bulk' : None,
-                        'last' : time.time(),  # time of last push
-                        'uids' : list()
-                        }
-
-
-            # check if we have an active bulk for the collection.  If not,
-            # create one.
-            cinfo = self._cinfo[cname]
-
-            if not cinfo['bulk']:
-                cinfo['bulk'] = cinfo['coll'].initialize_ordered_bulk_op()
-
+        if not cname in self._cinfo:
+            self._cinfo[cname] = {
+                    'coll' : self._mongo_db[cname],
+                    'bulk' : UpdateBulk(),
+                    'last' : time.time(),  # time of last push
+                    }
 
-            # push the update request onto the bulk
-            cinfo['uids'].append([uid, state])
-            cinfo['bulk'].find  (query_dict) \
-                         .update(update_dict)
-            self._prof.prof('bulk', msg='bulked (%s)' % state, uid=uid)
+        # push the update request onto the bulk
+        self._cinfo[cname]['bulk'].add(uid, state, query_dict, update_dict)
+        self._prof.prof('bulk', msg='bulked (%s)' % state, uid=uid)
 
-            # attempt a timed update
-            self._timed_bulk_execute(cinfo)
+        return cname
 
 
 # ------------------------------------------------------------------------------
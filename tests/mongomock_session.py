@@ -0,0 +1,36 @@
+
+# helpers for the tests which run the unit manager and its controller on
+# a mongomock DB.  Importing this module connects all DB sessions to mongomock,
+# so it needs to be imported before the DB sessions are created.
+
+import threading
+
+import mongomock
+
+import radical.utils as ru
+
+# the DB session connects to mongomock
+_client = mongomock.MongoClient()
+ru.mongodb_connect = lambda url: [_client, _client['rp'], None, None, None]
+
+
+# ------------------------------------------------------------------------------
+#
+class Prof(object):
+    def prof(self, *args, **kwargs):
+        pass
+
+
+class APISession(object):
+    """
+    the parts of the API session the unit manager and its controller use
+    """
+    def __init__(self, dbs):
+        self._dbs       = dbs
+        self._rec       = None
+        self._terminate = threading.Event()
+        self.prof       = Prof()
+
+    def get_dbs(self):
+        return self._dbs
+
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+# compare the vectorized profile analytics (prof2frame, add_concurrency,
+# add_frequency, calibrate_frame) with the original row-wise implementations on
+# a small synthetic profile, and measure them on a synthetic 10M row profile.
+# The profile contains units which pass the agent states in sequence, with
+# events from different components interleaved.
+
+import time
+
+import numpy  as np
+import pandas as pd
+
+import radical.pilot.utils as rpu
+
+N       = 10 * 1000 * 1000   # rows in the benchmark profile
+N_CHECK = 20 * 1000          # rows in the profile to compare results on
+WINDOW  = 0.5                # add_frequency window (s)
+
+STATES  = ['AgentStagingInputPending', 'AgentStagingInput',
+           'AllocatingPending',        'Allocating',
+           'ExecutingPending',         'Executing',
+           'AgentStagingOutputPending','AgentStagingOutput',
+           'PendingOutputStaging',     'Done']
+EVENTS  = ['advance', 'get', 'put', 'publish']
+
+CONC    = {'in'  : [{'state' : 'Executing',          'event' : 'advance'}],
+           'out' : [{'state' : 'AgentStagingOutput', 'event' : 'advance'},
+                    {'state' : 'Done',               'event' : 'advance'}]}
+FREQ    = {'state' : 'AgentStagingOutput', 'event' : 'advance'}
+CALIB   = [{'state' : 'Executing', 'event' : 'advance'}]
+
+
+# ------------------------------------------------------------------------------
+#
+def profile(n):
+    """
+    create a profile of n rows, as dict of columns
+    """
+
+    np.random.seed(1)
+
+    # each unit creates one row per state and event
+    per_unit = len(STATES) * len(EVENTS)
+    n_units  = n / per_unit + 1
+
+    uids   = np.array(['unit.%06d' % i for i in range(n_units)], dtype=object)
+    states = np.array(STATES, dtype=object)
+    events = np.array(EVENTS, dtype=object)
+
+    # some pilot and session rows, and cloned units
+    uids[::100] = np.array(['pilot.%04d' % i for i in range(len(uids[::100]))])
+    uids[1::97] = ''
+    uids[2::89] = np.array(['unit.clone.%06d' % i for i in range(len(uids[2::89]))])
+
+    uid   = np.repeat(uids, per_unit)[:n]
+    state = np.tile(np.repeat(states, len(EVENTS)), n_units)[:n]
+    event = np.tile(events, n_units * len(STATES))[:n]
+
+    # units overlap in time, and rows are sorted by time
+    start = np.repeat(np.arange(n_units) * 0.01, per_unit)[:n]
+    step  = np.tile(np.arange(per_unit) * 0.05, n_units)[:n]
+    t     = np.round(start + step + np.random.random(n) * 0.01, 4)
+    order = np.argsort(t, kind='mergesort')
+
+    return {'time'  : t[order],
+            'name'  : np.repeat(np.array(['agent_0'], dtype=object), n),
+            'uid'   : uid[order],
+            'state' : state[order],
+            'event' : event[order],
+            'msg'   : np.repeat(np.array([''], dtype=object), n)}
+
+
+# ------------------------------------------------------------------------------
+#
+# the original row-wise implementations, as reference
+#
+def ref_prof2frame(prof):
+
+    frame = pd.DataFrame(prof)
+
+    def _entity (row):
+        if not row['uid']        : return 'session'
+        if 'unit'  in row['uid'] : return 'unit'
+        if 'pilot' in row['uid'] : return 'pilot'
+        return 'session'
+    frame['entity'] = frame.apply(lambda row: _entity (row), axis=1)
+
+    def _cloned (row):
+        if not row['uid']: return False
+        else             : return 'clone' in row['uid'].lower()
+    frame['cloned'] = frame.apply(lambda row: _cloned (row), axis=1)
+
+    return frame
+
+
+def ref_add_concurrency(frame, tgt, spec):
+
+    def _conc (row, spec):
+        for f in spec['in']:
+            if all([row[col] == pat for col, pat in f.iteritems()]):
+                return 1
+        for f in spec['out']:
+            if all([row[col] == pat for col, pat in f.iteritems()]):
+                return -1
+        return np.NaN
+
+    tmp = [None]
+    def _time (x):
+        if x != tmp[0]: tmp[0] = x
+        else          : x      = np.NaN
+        return x
+
+    def _abs (x):
+        if x < 0: return np.NaN
+        return x
+
+    frame[tgt] = frame.apply(lambda row: _conc(row, spec), axis=1).cumsum()
+    frame[tgt] = frame.apply(lambda row: _abs (row[tgt]),  axis=1)
+    frame[tgt] = frame.apply(lambda row: _time(row[tgt]),  axis=1)
+
+    return frame
+
+
+def ref_add_frequency(frame, tgt, window, spec):
+
+    def _freq(t, _tmp, _window):
+        return len(_tmp.uid[(_tmp.time > t-_window) & (_tmp.time <= t)])
+
+    tmp = frame
+    for key,val in spec.iteritems():
+        tmp = tmp[tmp[key].isin([val])]
+    frame[tgt] = tmp.time.apply(_freq, args=[tmp, window])
+
+    return frame
+
+
+def ref_calibrate_frame(frame, spec):
+
+    t0 = [None]
+    def _find_t0 (row, spec):
+        if t0[0] is not None:
+            return
+        for f in spec:
+            if all([row[col] == pat for col, pat in f.iteritems()]):
+                t0[0] = row['time']
+                return
+
+    frame.apply(lambda row: _find_t0  (row, spec), axis=1)
+    frame['time'] = frame.apply(lambda row: row['time'] - t0[0], axis=1)
+
+    return frame
+
+
+# ------------------------------------------------------------------------------
+#
+def analyse(prof, prof2frame, add_concurrency, add_frequency, calibrate_frame):
+
+    times = dict()
+
+    start = time.time()
+    frame = prof2frame(prof)
+    times['prof2frame'] = time.time() - start
+
+    start = time.time()
+    add_concurrency(frame, 'executing', CONC)
+    times['add_concurrency'] = time.time() - start
+
+    start = time.time()
+    add_frequency(frame, 'rate_out', WINDOW, FREQ)
+    times['add_frequency'] = time.time() - start
+
+    start = time.time()
+    calibrate_frame(frame, CALIB)
+    times['calibrate_frame'] = time.time() - start
+
+    return frame, times
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    # compare with the reference implementation
+    prof = profile(N_CHECK)
+    ref, ref_times = analyse(prof, ref_prof2frame, ref_add_concurrency,
+                             ref_add_frequency, ref_calibrate_frame)
+    res, res_times = analyse(prof, rpu.prof2frame, rpu.add_concurrency,
+                             rpu.add_frequency, rpu.calibrate_frame)
+
+    for col in ref.columns:
+        assert ref[col].equals(res[col]) or \
+               np.allclose(ref[col].astype(float), res[col].astype(float),
+                           equal_nan=True), col
+
+    print "check: %d rows" % N_CHECK
+    for key in sorted(ref_times):
+        print "  %-16s: row-wise %7.2fs  vectorized %7.4fs" \
+            % (key, ref_times[key], res_times[key])
+
+    # benchmark the vectorized implementation
+    prof = profile(N)
+    res, res_times = analyse(prof, rpu.prof2frame, rpu.add_concurrency,
+                             rpu.add_frequency, rpu.calibrate_frame)
+
+    print "bench: %d rows" % N
+    for key in sorted(res_times):
+        print "  %-16s: %7.2fs (%10.1f rows/s)" \
+            % (key, res_times[key], N / res_times[key])
+
+test()
+
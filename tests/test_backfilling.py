@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+# simulate the backfilling scheduler with synthetic pilots and a stream of
+# units of different sizes.  Units are submitted in batches, half of the pilots
+# become active only after all units are submitted, and then units finish one
+# by one (each finished unit frees cores on its pilot, which triggers
+# a reschedule).  We compare the scheduler's capacity index with the original
+# scan over all waiting units and all pilots, measure the time per phase and
+# the number of units reported to the unit manager, and check that the pilots
+# are never overcommitted, and that no waiting unit is left which would fit an
+# active pilot.
+
+import time
+import random
+import collections
+
+import radical.pilot.states as rps
+
+from radical.pilot.scheduler import BackfillingScheduler
+
+SIZES  = [10 * 1000, 100 * 1000]   # units
+PILOTS = 32                        # pilots
+BATCH  = 1024                      # units per submission
+EVENTS = 1000                      # finishing units
+CORES  = [64, 128, 256, 512]       # pilot sizes
+UNITS  = [1, 1, 1, 2, 4, 8, 16]    # unit sizes
+LINEAR = 10 * 1000                 # max units for the linear scan
+
+
+# ------------------------------------------------------------------------------
+#
+class _Description(object):
+    def __init__(self, cores):
+        self.cores = cores
+
+
+class _Unit(object):
+
+    def __init__(self, i, cores):
+        self.uid         = 'unit.%06d' % i
+        self.description = _Description(cores)
+        self.state       = rps.NEW
+        self.pilot       = None
+
+    @property
+    def execution_details(self):
+        return {'pilot' : self.pilot}
+
+
+class _PilotManager(object):
+    def register_callback(self, cb):
+        pass
+
+
+class _Pilot(object):
+
+    def __init__(self, i, cores, state, pmgr):
+        self.uid           = 'pilot.%04d' % i
+        self.description   = _Description(cores)
+        self.state         = state
+        self.resource      = 'local.localhost'
+        self.sandbox       = '/tmp/%s' % self.uid
+        self.pilot_manager = pmgr
+
+
+class _Session(object):
+    def get_dbs(self):
+        return None
+
+
+class _UnitManager(object):
+    """
+    enacts the schedules on the units, and counts the units it is told about
+    """
+    def __init__(self):
+        self.reported = 0
+        self.running  = collections.deque()
+
+    def register_callback(self, cb):
+        pass
+
+    def handle_schedule(self, schedule):
+        for unit, pid in schedule['units'].iteritems():
+            self.reported += 1
+            if pid:
+                unit.pilot = pid
+                unit.state = rps.EXECUTING
+                self.running.append(unit)
+            else:
+                unit.state = rps.UNSCHEDULED
+
+
+# ------------------------------------------------------------------------------
+#
+class _LinearScheduler(BackfillingScheduler):
+    """
+    the original reschedule, as reference: all waiting units are matched
+    against all pilots, and all waiting units are reported
+    """
+
+    def _reschedule(self, target_pid=None, uid=None, new_units=None):
+
+        schedule           = dict()
+        schedule['units']  = dict()
+        schedule['pilots'] = self.pilots
+
+        if uid: units = [self.waitq[uid]]
+        else  : units = self.waitq.values()
+
+        for unit in units:
+            for pid in self.pilots:
+                if self.pilots[pid]['state'] in [rps.ACTIVE]:
+                    if unit.description.cores <= self.pilots[pid]['caps']:
+                        self.pilots[pid]['caps'] -= unit.description.cores
+                        schedule['units'][unit]   = pid
+                        self._waitq_remove(unit.uid)
+                        self.runqs[pid][unit.uid] = unit
+                        break
+                schedule['units'][unit] = None
+
+            can_handle_unit = False
+            for pid in self.pilots:
+                if unit.description.cores <= self.pilots[pid]['cores']:
+                    can_handle_unit = True
+                    break
+
+        self.manager.handle_schedule(schedule)
+
+
+# ------------------------------------------------------------------------------
+#
+def check(sched):
+
+    smallest = min(sched.sizes or [None])
+    for pid, pilot in sched.pilots.iteritems():
+        used = sum([u.description.cores for u in sched.runqs[pid].values()])
+        assert pilot['caps'] >= 0
+        assert pilot['caps'] + used == 3 * pilot['cores']
+        if pilot['state'] == rps.ACTIVE and smallest:
+            assert smallest > pilot['caps']
+
+
+# ------------------------------------------------------------------------------
+#
+def simulate(name, cls, n):
+
+    random.seed(1)
+
+    umgr   = _UnitManager()
+    pmgr   = _PilotManager()
+    sched  = cls(umgr, _Session())
+    pilots = list()
+    for i in range(PILOTS):
+        state = [rps.ACTIVE, rps.PENDING_ACTIVE][i % 2]
+        pilot = _Pilot(i, random.choice(CORES), state, pmgr)
+        sched.pilot_added(pilot)
+        pilots.append(pilot)
+
+    units = [_Unit(i, random.choice(UNITS)) for i in range(n)]
+    times = list()
+
+    # submit the units in batches
+    start = time.time()
+    for i in range(0, n, BATCH):
+        sched.schedule(units[i:i + BATCH])
+    times.append(time.time() - start)
+    check(sched)
+
+    # the remaining pilots become active
+    start = time.time()
+    for pilot in pilots:
+        if pilot.state != rps.ACTIVE:
+            pilot.state = rps.ACTIVE
+            sched._pilot_state_callback(pilot, rps.ACTIVE)
+    times.append(time.time() - start)
+    check(sched)
+
+    # units finish in the order they were scheduled
+    start = time.time()
+    for i in range(EVENTS):
+        unit = umgr.running.popleft()
+        unit.state = rps.DONE
+        sched._unit_state_callback(unit, rps.DONE)
+    times.append(time.time() - start)
+    check(sched)
+
+    print "  %-7s: submit %7.2fs  activate %6.2fs  %d done %7.2fs  " \
+          "(%d waiting, %d reported)" \
+        % (name, times[0], times[1], EVENTS, times[2], len(sched.waitq),
+           umgr.reported)
+
+    return len(sched.waitq)
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    for n in SIZES:
+
+        print "n     : %d units, %d pilots" % (n, PILOTS)
+
+        waiting = simulate('index', BackfillingScheduler, n)
+        assert waiting > 0
+
+        if n <= LINEAR:
+            simulate('linear', _LinearScheduler, n)
+
+test()
+
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# combine a set of component profiles, once with the original in-memory
+# combine_profiles, and once streamed into a columnar file.  One profile is
+# synced relative to another profile, and two profiles were written by two
+# processes (so their events are not sorted by time).  We check that both
+# combine to the same events, and measure time and peak memory (the streaming
+# version runs first, as the peak memory is per process).
+
+import os
+import csv
+import glob
+import time
+import shutil
+import random
+import resource
+import tempfile
+
+import radical.pilot.utils as rpu
+
+PROFILES = 100      # component profiles
+EVENTS   = 20000    # events per profile
+FORMATS  = ['npz', 'parquet']
+
+
+# ------------------------------------------------------------------------------
+#
+def write_profiles(tmp):
+
+    random.seed(1)
+
+    for i in range(PROFILES):
+
+        name = 'component_%03d' % i
+        lines = list()
+        lines.append("#time,name,uid,state,event,msg\n")
+
+        if i == 1:
+            # synced relative to the 'sync ref' in profile 0
+            lines.append("%.4f,%s:,,,sync rel,ref_1\n" % (0.5, name))
+        else:
+            t_abs = 1467000000.0 + random.random()
+            lines.append("%.4f,%s:,,,sync abs,%s:%s:%s:ntp\n"
+                         % (0.0, name, t_abs, t_abs, t_abs))
+        if i == 0:
+            lines.append("%.4f,%s:MainThread,,,sync ref,ref_1\n" % (0.1, name))
+
+        t = 1.0
+        for j in range(EVENTS):
+            t += random.random() / 100
+            lines.append("%.4f,%s:MainThread,unit.%06d,Executing,advance,\n"
+                         % (t, name, j))
+        lines.append("%.4f,%s:MainThread,,,QED,\n" % (t + 1, name))
+
+        if i == 2:
+            # interleave the second half with the first (like two writing
+            # processes)
+            half  = len(lines) / 2
+            lines = [l for pair in map(None, lines[:half], lines[half:])
+                       for l in pair if l]
+
+        if i == 3:
+            # append the second half before the first half
+            half  = len(lines) / 2
+            lines = lines[:2] + lines[half:] + lines[2:half]
+
+        with open('%s/%s.prof' % (tmp, name), 'w') as f:
+            f.writelines(lines)
+
+
+# ------------------------------------------------------------------------------
+#
+def combine_in_memory(profiles):
+    """
+    the original implementation of combine_profiles, as reference
+    """
+
+    rd_abs = dict()
+    rd_rel = dict()
+    pd_abs = dict()
+    pd_rel = dict()
+
+    for prof in profiles:
+        p    = list()
+        tref = None
+        with open(prof, 'r') as csvfile:
+            reader = csv.DictReader(csvfile, fieldnames=rpu.prof_utils._prof_fields)
+            for row in reader:
+                if row['time'].startswith('#'):
+                    continue
+                row['time'] = float(row['time'])
+                if not tref:
+                    if row['event'] == 'sync rel':
+                        tref = 'rel'
+                        rd_rel[prof] = [row['time'], row['msg']]
+                    if row['event'] == 'sync abs':
+                        tref = 'abs'
+                        rd_abs[prof] = [row['time']] + row['msg'].split(':')
+                p.append(row)
+
+        if   tref == 'abs': pd_abs[prof] = p
+        elif tref == 'rel': pd_rel[prof] = p
+
+    for prof, p in pd_abs.iteritems():
+        t_off = float(rd_abs[prof][3]) - float(rd_abs[prof][0])
+        for row in p:
+            row['time'] = row['time'] + t_off
+
+    p_glob = list()
+    for prof, p in pd_abs.iteritems():
+        p_glob += p
+
+    for prof, p in pd_rel.iteritems():
+        t_rel, t_msg = rd_rel[prof]
+        t_ref = None
+        for _prof, _p in pd_abs.iteritems():
+            if not t_ref:
+                for _row in _p:
+                    if _row['event'] == 'sync ref' and _row['msg'] == t_msg:
+                        t_ref = _row['time']
+                        break
+        if t_ref == None:
+            continue
+        t_off = t_ref - t_rel
+        for row in p:
+            row['time'] = row['time'] + t_off
+            p_glob.append(row)
+
+    t_min = min([row['time'] for row in p_glob])
+    for row in p_glob:
+        row['time'] -= t_min
+
+    return sorted(p_glob, key=lambda k: k['time'])
+
+
+# ------------------------------------------------------------------------------
+#
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d profiles, %d events" % (PROFILES, PROFILES * EVENTS)
+
+    tmp = tempfile.mkdtemp()
+
+    try:
+        write_profiles(tmp)
+        profiles = sorted(glob.glob('%s/*.prof' % tmp))
+        key      = lambda row: (row['time'], row['name'], row['uid'], row['event'])
+
+        # stream into columnar files
+        frames = dict()
+        for fmt in FORMATS:
+            tgt   = '%s/combined.%s' % (tmp, fmt)
+            start = time.time()
+            try:
+                rpu.combine_profiles(profiles, tgt=tgt)
+            except ImportError as e:
+                print "%-7s: not available (%s)" % (fmt, e)
+                continue
+            stop  = time.time()
+            frame = rpu.read_profile(tgt)
+            load  = time.time() - stop
+            print "%-7s: %5.2fs  %4d MB peak  %6.1f MB file  load %5.2fs" \
+                % (fmt, stop - start, maxrss(), os.path.getsize(tgt) / 1024.0**2, load)
+            frames[fmt] = frame
+
+        # in memory, as list of rows
+        start = time.time()
+        ref   = combine_in_memory(profiles)
+        stop  = time.time()
+        print "memory : %5.2fs  %4d MB peak" % (stop - start, maxrss())
+
+        res = sorted(rpu.combine_profiles(profiles), key=key)
+        ref = sorted(ref, key=key)
+        assert len(res) == len(ref) == PROFILES * (EVENTS + 2) + 1
+        assert res == ref
+
+        for fmt, frame in frames.iteritems():
+            assert list(frame['time']) == [row['time'] for row in
+                                           rpu.stream_profiles(profiles)]
+            assert sorted(zip(frame['time'], frame['uid'])) \
+                == sorted([(row['time'], row['uid']) for row in ref])
+
+    finally:
+        shutil.rmtree(tmp)
+
+test()
+
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# measure the per-unit latency through a chain of components.  Units are fed
+# into the first queue of the chain, and each component advances them to the
+# next state and pushes them into the next queue.  The driver reads units from
+# the last queue.  The latency is measured from the profiles the components
+# write (between 'get' in the first and 'put' in the last component), and end
+# to end in the driver.
+#
+# Run this on different code revisions to compare the event loop
+# implementations.
+
+import os
+import sys
+import glob
+import time
+
+os.environ['RADICAL_PILOT_PROFILE'] = 'True'
+
+import radical.pilot.utils as rpu
+
+N      = 10000
+CHAIN  = 4
+STATES = ['STATE_%d'    % i for i in range(CHAIN + 1)]
+QUEUES = ['lat_queue_%d' % i for i in range(CHAIN + 1)]
+
+
+# ------------------------------------------------------------------------------
+#
+class Relay(rpu.Component):
+
+    def __init__(self, cfg):
+
+        rpu.Component.__init__(self, 'Relay', cfg)
+        self._idx = cfg['number']
+
+
+    def initialize_child(self):
+
+        self.declare_input (STATES[self._idx],     QUEUES[self._idx])
+        self.declare_worker(STATES[self._idx],     self.work)
+        self.declare_output(STATES[self._idx + 1], QUEUES[self._idx + 1])
+
+
+    def work(self, units):
+
+        if not isinstance(units, list):
+            units = [units]
+
+        self.advance(units, STATES[self._idx + 1], publish=False, push=True)
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d" % N
+    print "chain : %d" % CHAIN
+
+    for f in glob.glob('*.Relay.*.prof'):
+        os.unlink(f)
+
+    cfg = {'agent_name'       : 'lat',
+           'bridge_addresses' : dict()}
+
+    bridges = list()
+    for q in QUEUES:
+        b = rpu.Queue.create(rpu.QUEUE_ZMQ, q, rpu.QUEUE_BRIDGE)
+        cfg['bridge_addresses'][q] = {'sink'   : b.bridge_in,
+                                      'source' : b.bridge_out}
+        bridges.append(b)
+
+    relays = list()
+    for i in range(CHAIN):
+        ccfg = dict(cfg)
+        ccfg['number'] = i
+        r = Relay(ccfg)
+        r.start()
+        relays.append(r)
+
+    q_in  = rpu.Queue.create(rpu.QUEUE_ZMQ, QUEUES[0],  rpu.QUEUE_INPUT,
+                             cfg['bridge_addresses'][QUEUES[0]]['sink'])
+    q_out = rpu.Queue.create(rpu.QUEUE_ZMQ, QUEUES[-1], rpu.QUEUE_OUTPUT,
+                             cfg['bridge_addresses'][QUEUES[-1]]['source'])
+
+    # give the components time to connect
+    time.sleep(3)
+
+    # feed units at a steady rate, so that we measure latency, not queue length
+    lat   = list()
+    start = time.time()
+    for i in range(N):
+        q_in.put({'_id'   : 'unit.%06d' % i,
+                  'state' : STATES[0],
+                  'sent'  : time.time()})
+        unit = q_out.get()
+        lat.append(time.time() - unit['sent'])
+    stop = time.time()
+
+    for r in relays:
+        r.stop()
+    for b in bridges:
+        b.stop()
+
+    lat.sort()
+    print "rate  : %8.1f units/s" % (N / (stop - start))
+    print "e2e   : avg %8.2f ms  med %8.2f ms  p99 %8.2f ms" \
+        % (1000 * sum(lat) / N, 1000 * lat[N / 2], 1000 * lat[int(N * 0.99)])
+
+    # now evaluate the component profiles
+    profs  = glob.glob('*.Relay.*.child.prof')
+    events = rpu.combine_profiles(profs)
+    t_get  = dict()
+    t_put  = dict()
+    for e in events:
+        if e['event'] == 'get' and e['name'].startswith('lat.Relay.0.'):
+            t_get[e['uid']] = float(e['time'])
+        elif e['event'] == 'put' and e['state'] == STATES[-1]:
+            t_put[e['uid']] = float(e['time'])
+
+    lat = sorted([t_put[uid] - t_get[uid] for uid in t_get if uid in t_put])
+    if lat:
+        n = len(lat)
+        print "prof  : avg %8.2f ms  med %8.2f ms  p99 %8.2f ms" \
+            % (1000 * sum(lat) / n, 1000 * lat[n / 2], 1000 * lat[int(n * 0.99)])
+
+test()
+
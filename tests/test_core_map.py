@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# microbenchmark for the continuous scheduler's slot allocation: compare the
+# CoreMap with the original list-of-strings slot structure, for different
+# numbers of cores.  We first fill the allocation with random requests, and
+# then repeatedly release a random allocation and allocate a new one.
+
+import time
+import random
+
+from radical.pilot.agent.scheduler.core_map import CoreMap
+
+FREE  = 'Free'
+BUSY  = 'Busy'
+CPN   = 16
+SIZES = [1000, 10000, 100000]
+N     = 1000
+
+
+# ------------------------------------------------------------------------------
+#
+class ListSlots(object):
+    """
+    the original slot structure and search of the continuous scheduler
+    """
+
+    def __init__(self, nodes, cpn):
+        self.cpn   = cpn
+        self.slots = [{'node' : node, 'cores' : [FREE] * cpn} for node in nodes]
+
+    def _find_sublist(self, haystack, needle):
+        n    = len(needle)
+        hits = [(needle == haystack[i:i+n]) for i in xrange(len(haystack)-n+1)]
+        try:
+            return hits.index(True)
+        except ValueError:
+            return None
+
+    def allocate(self, cores):
+        if cores <= self.cpn:
+            for slot in self.slots:
+                offset = self._find_sublist(slot['cores'], [FREE] * cores)
+                if offset is not None:
+                    task_slots = ['%s:%d' % (slot['node'], core)
+                                  for core in range(offset, offset + cores)]
+                    break
+            else:
+                return None
+        else:
+            all_cores = [c for slot in self.slots for c in slot['cores']]
+            offset    = self._find_sublist(all_cores, [FREE] * cores)
+            if offset is None:
+                return None
+            task_slots = ['%s:%d' % (self.slots[o / self.cpn]['node'], o % self.cpn)
+                          for o in range(offset, offset + cores)]
+        self.change(task_slots, BUSY)
+        return task_slots
+
+    def release(self, task_slots):
+        self.change(task_slots, FREE)
+
+    def change(self, task_slots, state):
+        for slot in task_slots:
+            node, core = slot.split(':')
+            entry = (s for s in self.slots if s['node'] == node).next()
+            entry['cores'][int(core)] = state
+
+
+# ------------------------------------------------------------------------------
+#
+class MapSlots(object):
+
+    def __init__(self, nodes, cpn):
+        self.cpn   = cpn
+        self.slots = CoreMap(nodes, cpn)
+
+    def allocate(self, cores):
+        offset = self.slots.find(cores, cores <= self.cpn)
+        if offset is None:
+            return None
+        self.slots.set_busy(offset, cores)
+        return self.slots.slots(offset, cores)
+
+    def release(self, task_slots):
+        self.slots.change(task_slots, False)
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(impl, ncores):
+
+    random.seed(42)
+    nodes  = ['node_%05d' % i for i in range(ncores / CPN)]
+    slots  = impl(nodes, CPN)
+    allocs = list()
+
+    # fill up
+    while True:
+        task_slots = slots.allocate(random.choice([1, 1, 2, 4, 8, 16, 32]))
+        if not task_slots:
+            break
+        allocs.append(task_slots)
+
+    # churn
+    start  = time.time()
+    misses = 0
+    for i in range(N):
+        slots.release(allocs.pop(random.randrange(len(allocs))))
+        task_slots = slots.allocate(random.choice([1, 1, 2, 4, 8, 16, 32]))
+        if task_slots:
+            allocs.append(task_slots)
+        else:
+            misses += 1
+    stop = time.time()
+
+    return (stop - start), misses
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d" % N
+
+    for ncores in SIZES:
+        for name, impl in [['list', ListSlots], ['map ', MapSlots]]:
+            if impl == ListSlots and ncores > 10000:
+                # this takes forever...
+                continue
+            diff, misses = bench(impl, ncores)
+            print "%s %6d : %6.2f (%8.1f ops/s, %4d misses)" \
+                % (name, ncores, diff, N / diff, misses)
+
+test()
+
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# measure the rate of client side input staging, for units with a few small
+# input files, some of which are shared between all units.  Sandboxes are local
+# (file://), and the units are inserted directly into the session's unit
+# collection, so this needs a MongoDB (RADICAL_PILOT_DBURL), but no resource.
+# We compare one unit at a time with sequential transfers (the old behavior)
+# against bulk claims with concurrent transfers, with and without deduplication
+# (shared files are then copied once, into a cache directory, and linked).
+
+import os
+import time
+import shutil
+import tempfile
+
+import radical.pilot as rp
+
+from radical.pilot.controller.input_file_transfer_worker import InputFileTransferWorker
+
+N      = 1000
+SHARED = 2      # input files shared by all units
+UNIQUE = 2      # input files per unit
+UMGR   = 'umgr.bench'
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(session, bulk_size, pool_size, dedup):
+
+    tmp  = tempfile.mkdtemp()
+    coll = session.get_db()['%s.cu' % session.uid]
+    coll.remove()
+
+    try:
+        os.mkdir('%s/src' % tmp)
+        for i in range(SHARED):
+            with open('%s/src/shared.%d' % (tmp, i), 'w') as f:
+                f.write('shared %d\n' % i)
+
+        units = list()
+        for i in range(N):
+            uid = 'unit.%06d' % i
+            sds = list()
+            for j in range(SHARED):
+                sds.append({'source' : '%s/src/shared.%d' % (tmp, j),
+                            'target' : 'shared.%d' % j,
+                            'flags'  : rp.DEFAULT_FLAGS})
+            for j in range(UNIQUE):
+                src = '%s/src/%s.%d' % (tmp, uid, j)
+                with open(src, 'w') as f:
+                    f.write('%s %d\n' % (uid, j))
+                sds.append({'source' : src,
+                            'target' : 'input.%d' % j,
+                            'flags'  : rp.DEFAULT_FLAGS})
+            units.append({'_id'                  : uid,
+                          'unitmanager'          : UMGR,
+                          'state'                : rp.PENDING_INPUT_STAGING,
+                          'statehistory'         : list(),
+                          'sandbox'              : 'file://localhost%s/%s/' % (tmp, uid),
+                          'FTW_Input_Directives' : sds})
+        coll.insert(units)
+
+        worker = InputFileTransferWorker(session, UMGR, number=0,
+                                         bulk_size=bulk_size,
+                                         pool_size=pool_size,
+                                         dedup=dedup)
+        start = time.time()
+        worker.start()
+        while coll.find({'state' : rp.AGENT_STAGING_INPUT_PENDING}).count() < N:
+            assert not coll.find({'state' : rp.FAILED}).count()
+            time.sleep(0.1)
+        stop = time.time()
+        worker.stop()
+
+        for i in range(N):
+            for j in range(SHARED):
+                path = '%s/unit.%06d/shared.%d' % (tmp, i, j)
+                assert os.path.exists(path)
+                assert os.path.islink(path) == dedup
+
+        if dedup:
+            assert len(os.listdir('%s/ftw_cache' % tmp)) == SHARED + N * UNIQUE
+
+        return stop - start
+
+    finally:
+        shutil.rmtree(tmp)
+        coll.remove()
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d units, %d files each" % (N, SHARED + UNIQUE)
+
+    session = rp.Session()
+    try:
+        for bulk_size, pool_size, dedup in [[1,   1, False],
+                                            [100, 8, False],
+                                            [100, 8, True ]]:
+            diff = bench(session, bulk_size, pool_size, dedup)
+            print "bulk %3d pool %2d dedup %-5s : %6.2fs (%8.1f units/s)" \
+                % (bulk_size, pool_size, dedup, diff, N / diff)
+    finally:
+        session.close()
+
+test()
+
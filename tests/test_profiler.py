@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# measure the overhead of profile events written in CSV mode and in binary
+# mode.  Like agent components, we create events in bursts, and idle between
+# bursts (which is when the binary profiler flushes).  We measure the time spent
+# in the bursts.  The binary profile is converted on close, and we check that it
+# results in the same CSV profile, and that combine_profiles reads binary
+# profiles, too.
+
+import os
+import glob
+import time
+import shutil
+import tempfile
+
+import radical.pilot.utils as rpu
+
+N     = 1000000
+BURST = 1000        # events per burst
+IDLE  = 0.002       # seconds between bursts
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(mode):
+
+    os.environ['RADICAL_PILOT_PROFILE']      = 'True'
+    os.environ['RADICAL_PILOT_PROFILE_MODE'] = mode
+
+    uids = ['unit.%06d' % (i % 1000) for i in range(BURST)]
+    msgs = ['slot %d'   % (i %   16) for i in range(BURST)]
+
+    prof = rpu.Profiler('bench')
+    used = 0.0
+    for i in range(0, N, BURST):
+        start = time.time()
+        for j in range(BURST):
+            prof.prof('advance', uid=uids[j], state='Executing', msg=msgs[j],
+                      timestamp=float(i + j) / N)
+        used += time.time() - start
+        time.sleep(IDLE)
+
+    prof.flush()
+    size  = sum([os.path.getsize(f) for f in glob.glob('bench*prof')])
+    start = time.time()
+    prof.close()
+    close = time.time() - start
+
+    print "%-6s: %5.2fs (%10.1f/s)  %3d bytes/event  close %5.2fs" \
+        % (mode, used, N / used, size / N, close)
+
+    with open('bench.prof') as f:
+        lines = f.readlines()
+    os.unlink('bench.prof')
+
+    # ignore the times of the sync, flush and QED events
+    return lines[:1] + lines[2:-2]
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d events" % N
+
+    pwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+
+    try:
+        os.chdir(tmp)
+
+        ref = bench('csv')
+        res = bench('binary')
+        assert res == ref
+        assert not [f for f in os.listdir(tmp) if f.endswith('.bprof')]
+
+        # a binary profile which was not converted
+        os.environ['RADICAL_PILOT_PROFILE_MODE'] = 'binary'
+        prof = rpu.Profiler('bench')
+        prof.prof('advance', uid='unit.000000', state='Executing')
+        prof.prof('QED')
+        prof.flush()
+        bprof = [f for f in os.listdir(tmp) if f.endswith('.bprof')]
+        assert len(bprof) == 1
+        rows  = rpu.combine_profiles(bprof)
+        assert [row['event'] for row in rows] \
+            == ['sync abs', 'advance', 'QED', 'flush'], rows
+
+    finally:
+        os.chdir(pwd)
+        shutil.rmtree(tmp)
+
+test()
+
@@ -1,4 +1,4 @@
-#!/usr/bin/env python 
+#!/usr/bin/env python
 
 import os
 import zmq
@@ -13,37 +13,68 @@ import radical.utils       as ru
 import radical.pilot.utils as rpu
 
 
-b  = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_BRIDGE)
+# ------------------------------------------------------------------------------
+#
+# send state notifications from two publishers to two subscribers, once
+# without and once with collecting notifications in the publishers.  A third
+# subscriber only subscribes to a different topic, and should not receive any
+# state notifications.
+#
+N = 50000
+print "n   : %d" % N
 
-s1 = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_SUB)
-s1.subscribe('state')
+for flush_delay in [0, 0.01]:
 
-s2 = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_SUB)
-s2.subscribe('state')
+    print "flush delay: %.2fs" % flush_delay
 
-p1 = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_PUB)
-p2 = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_PUB)
+    b  = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_BRIDGE)
 
-time.sleep (1)
+    s1 = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_SUB, b.bridge_out)
+    s1.subscribe('state')
 
-N = 500
-print "n   : %d" % N
+    s2 = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_SUB, b.bridge_out)
+    s2.subscribe('state')
+
+    s3 = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_SUB, b.bridge_out)
+    s3.subscribe('command')
+
+    p1 = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_PUB, b.bridge_in, flush_delay)
+    p2 = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, 'agent_state_pubsub', rpu.PUBSUB_PUB, b.bridge_in, flush_delay)
+
+    time.sleep (1)
+
+    # --------------------------------------------------------------------------
+    def recv(s, ret):
+        cnt = 0
+        while cnt < 2*N:
+            topic, msgs = s.get()
+            cnt += len(msgs)
+        ret.append(cnt)
+    # --------------------------------------------------------------------------
+
+    ret = list()
+    t1  = mt.Thread(target=recv, args=[s1, ret])
+    t2  = mt.Thread(target=recv, args=[s2, ret])
+    t1.start()
+    t2.start()
+
+    start = time.time()
+    for i in range(N):
+        p1.put('state', {'id' : "p1_%05d" % i})
+        p2.put('state', {'id' : "p2_%05d" % i})
+    p1.flush()
+    p2.flush()
+    stop = time.time()
+    print "sent: %4.2f (%8.1f)" % (stop-start, 2*N/(stop-start))
+
+    t1.join()
+    t2.join()
+    stop = time.time()
+    print "recv: %4.2f (%8.1f)" % (stop-start, 2*N/(stop-start))
+
+    assert ret == [2*N, 2*N], ret
+    assert s3.get_nowait(100) == [None, None]
 
-start = time.time()
-for i in range(N):
-    p1.put('state', {'id' : "p1_%05d" % i})
-    p2.put('state', {'id' : "p2_%05d" % i})
-stop = time.time()
-print "sent: %4.2f (%8.1f)" % (stop-start, 2*N/(stop-start))
-
-start = time.time()
-for i in range(2*N):
-    msg_1 = s1.get()
-    msg_2 = s2.get()
-  # print "<= s1 %s" % msg_1
-  # print "<= s2 %s" % msg_2
-stop = time.time()
-print "recv: %4.2f (%8.1f)" % (stop-start, 2*N/(stop-start))
-
-b.close()
+    for q in [p1, p2, s1, s2, s3, b]:
+        q.stop()
 
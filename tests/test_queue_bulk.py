@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import time
+import radical.pilot.utils as rpu
+
+# compare the throughput of the zmq queue for different bulk sizes.  A bulk
+# size of '1' with individual puts corresponds to the original QueueZMQ
+# behavior (one message per request/reply round trip).
+
+N     = 100000
+BULKS = [1, 10, 100, 1000]
+UNIT  = {'_id'         : 'unit.000000',
+         'state'       : 'ALLOCATING_PENDING',
+         'description' : {'executable' : '/bin/sleep',
+                          'arguments'  : ['10'],
+                          'cores'      : 1},
+         'workdir'     : '/tmp/unit.000000'}
+
+def test():
+
+    print "n  : %d" % N
+
+    q_bri = rpu.Queue.create(rpu.QUEUE_ZMQ, 'bulk_queue', rpu.QUEUE_BRIDGE)
+    q_in  = rpu.Queue.create(rpu.QUEUE_ZMQ, 'bulk_queue', rpu.QUEUE_INPUT,
+                             q_bri.bridge_in)
+
+    for bulk in BULKS:
+
+        q_out = rpu.Queue.create(rpu.QUEUE_ZMQ, 'bulk_queue', rpu.QUEUE_OUTPUT,
+                                 q_bri.bridge_out, bulk)
+
+        # single puts
+        start = time.time()
+        for i in range(N):
+            q_in.put(UNIT)
+        for i in range(N):
+            q_out.get()
+        stop = time.time()
+        diff = stop - start
+        print "zmq %4d single : %6.2f (%8.1f msg/s)" % (bulk, diff, N/diff)
+
+        # bulk puts
+        start = time.time()
+        for i in range(0, N, bulk):
+            q_in.put([UNIT] * bulk)
+        for i in range(N):
+            q_out.get()
+        stop = time.time()
+        diff = stop - start
+        print "zmq %4d bulk   : %6.2f (%8.1f msg/s)" % (bulk, diff, N/diff)
+
+    q_bri.stop()
+
+test()
+
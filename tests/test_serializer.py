@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# compare json and msgpack encoding of unit dicts, as they are passed between
+# agent components (full description, staging directives, slots and state
+# history).  We check that both serializers decode to the same dicts, and
+# that a message encoded with one serializer is rejected by the other.
+
+import time
+
+import radical.pilot.utils as rpu
+
+N     = 10000
+NODES = 4       # nodes in the unit's slot list
+CORES = 16      # cores per node
+
+
+# ------------------------------------------------------------------------------
+#
+def unit(i):
+
+    uid = 'unit.%06d' % i
+    sds = [{'source' : 'pilot:///input/data.%03d.dat' % j,
+            'target' : 'data.%03d.dat' % j,
+            'action' : 'Copy',
+            'flags'  : ['CreateParents'],
+            'priority' : 0} for j in range(8)]
+
+    return {'_id'          : uid,
+            'uid'          : uid,
+            'pilot'        : 'pilot.0000',
+            'state'        : 'AgentStagingInputPending',
+            'description'  : {'name'             : 'md.%06d' % i,
+                              'executable'       : '/usr/bin/gmx_mpi',
+                              'arguments'        : ['mdrun', '-s', 'topol.tpr',
+                                                    '-deffnm', 'md', '-nsteps',
+                                                    '50000', '-maxh', '0.5'],
+                              'environment'      : {'OMP_NUM_THREADS' : '1',
+                                                    'GMX_MAXBACKUP'   : '-1'},
+                              'cores'            : NODES * CORES,
+                              'mpi'              : True,
+                              'pre_exec'         : ['module load gromacs/5.1',
+                                                    'source ~/env.sh'],
+                              'post_exec'        : [],
+                              'input_staging'    : sds,
+                              'output_staging'   : [],
+                              'stdout'           : None,
+                              'stderr'           : None,
+                              'kernel'           : None,
+                              'restartable'      : False,
+                              'cleanup'          : False},
+            'Agent_Input_Directives'  : sds,
+            'Agent_Output_Directives' : [],
+            'opaque_slots' : {'task_slots'   : ['node%04d:%d' % (n, c)
+                                                for n in range(NODES)
+                                                for c in range(CORES)],
+                              'task_offsets' : [n * CORES for n in range(NODES)],
+                              'lm_info'      : {'version_info' : {}}},
+            'workdir'      : '/scratch/rp.session.0000/pilot.0000/%s' % uid,
+            'stdout'       : '',
+            'stderr'       : '',
+            'exit_code'    : None,
+            'statehistory' : [{'state'     : 'AgentStagingInputPending',
+                               'timestamp' : 1467312345.123 + i}]}
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    units = [unit(i) for i in range(N)]
+
+    print "n     : %d units" % N
+
+    ref = None
+    for flavor in rpu.SERIALIZER_TYPES:
+
+        ser = rpu.Serializer.create(flavor)
+        if ser.flavor != flavor:
+            print "%-7s: not available" % flavor
+            continue
+
+        start = time.time()
+        data  = [ser.dumps(u) for u in units]
+        enc   = time.time() - start
+
+        start = time.time()
+        res   = [ser.loads(d) for d in data]
+        dec   = time.time() - start
+
+        size  = sum([len(d) for d in data]) / N
+
+        print "%-7s: enc %5.2fs (%8.1f/s)  dec %5.2fs (%8.1f/s)  %5d bytes/unit" \
+            % (flavor, enc, N / enc, dec, N / dec, size)
+
+        if ref is None:
+            ref = res
+        else:
+            assert res == ref
+
+    # serializers don't decode each other's messages
+    if rpu.Serializer.create(rpu.SERIALIZER_MSGPACK).flavor == rpu.SERIALIZER_MSGPACK:
+        data = rpu.Serializer.create(rpu.SERIALIZER_MSGPACK).dumps(units[0])
+        try:
+            rpu.Serializer.create(rpu.SERIALIZER_JSON).loads(data)
+            assert False, 'json decoded a msgpack message'
+        except RuntimeError as e:
+            print "mixed : %s" % e
+
+test()
+
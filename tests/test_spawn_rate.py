@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# measure the sustained spawn rate for short running tasks, for the two ways
+# the Popen executor can launch units: via subprocess.Popen from the (large)
+# agent process, and via the spawner helper process.  To mimic the agent, the
+# benchmark process first grows its heap.  All tasks are launched in batches,
+# and the benchmark completes when all tasks are reaped.
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+
+import radical.pilot as rp
+
+N      = 2000
+BATCH  = 100
+HEAP   = 512   # MB
+CMD    = '/bin/true'
+HELPER = '%s/agent/radical-pilot-popen-spawner.py' % os.path.dirname(rp.__file__)
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_popen(tmp):
+
+    start = time.time()
+    procs = list()
+    for i in range(N):
+        out = open('%s/%d.out' % (tmp, i), 'w')
+        err = open('%s/%d.err' % (tmp, i), 'w')
+        procs.append(subprocess.Popen(CMD, shell=True, close_fds=True,
+                                      stdout=out, stderr=err, cwd=tmp))
+        out.close()
+        err.close()
+
+    n = 0
+    while n < N:
+        pid, status, rusage = os.wait4(-1, 0)
+        n += 1
+    stop = time.time()
+
+    for proc in procs:
+        proc.returncode = 0  # reaped already
+
+    return stop - start
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_helper(tmp):
+
+    helper = subprocess.Popen([sys.executable, HELPER], close_fds=True,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    # replies are read concurrently, as the executor's watcher thread does
+    def reader():
+        n = 0
+        while n < N:
+            msg = json.loads(helper.stdout.readline())
+            assert 'error' not in msg, msg
+            if 'status' in msg:
+                n += 1
+
+    watcher = threading.Thread(target=reader)
+    watcher.start()
+
+    start = time.time()
+    for b in range(0, N, BATCH):
+        reqs = ''
+        for i in range(b, min(N, b + BATCH)):
+            reqs += json.dumps({'uid'    : 'unit.%06d' % i,
+                                'cmd'    : CMD,
+                                'cwd'    : tmp,
+                                'stdout' : '%s/%d.out' % (tmp, i),
+                                'stderr' : '%s/%d.err' % (tmp, i)}) + '\n'
+        helper.stdin.write(reqs)
+        helper.stdin.flush()
+
+    watcher.join()
+    stop = time.time()
+
+    helper.stdin.close()
+    helper.wait()
+
+    return stop - start
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d" % N
+    print "heap  : %d MB" % HEAP
+
+    heap = bytearray(HEAP * 1024 * 1024)
+    for i in xrange(0, len(heap), 4096):
+        heap[i] = 1
+
+    for name, bench in [['popen ', bench_popen], ['helper', bench_helper]]:
+        tmp = tempfile.mkdtemp()
+        try:
+            diff = bench(tmp)
+        finally:
+            shutil.rmtree(tmp)
+        print "%s: %6.2fs (%8.1f tasks/s)" % (name, diff, N / diff)
+
+test()
+
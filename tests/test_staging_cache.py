@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+# compare agent input staging of a shared parameter file into many unit
+# sandboxes, with plain copies and via the staging cache.
+
+import os
+import time
+import shutil
+import tempfile
+
+from radical.pilot.agent.staging_input.cache import StagingCache
+
+N    = 1000
+SIZE = 4 * 1024 * 1024   # bytes
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(tmp, copy):
+
+    start = time.time()
+    for i in range(N):
+        workdir = '%s/unit.%06d' % (tmp, i)
+        os.mkdir(workdir)
+        copy('%s/params.dat' % tmp, '%s/params.dat' % workdir)
+    stop = time.time()
+
+    for i in range(N):
+        shutil.rmtree('%s/unit.%06d' % (tmp, i))
+
+    return stop - start
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d" % N
+    print "size  : %d MB" % (SIZE / 1024 / 1024)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        with open('%s/params.dat' % tmp, 'w') as f:
+            f.write(os.urandom(SIZE))
+
+        cache = StagingCache('%s/cache' % tmp, 10 * SIZE)
+
+        for name, copy in [['copy ', shutil.copyfile], ['cache', cache.copy]]:
+            diff = bench(tmp, copy)
+            print "%s : %6.2fs (%8.1f files/s)" % (name, diff, N / diff)
+
+        print "cache : %d hits, %d misses" % (cache.hits, cache.misses)
+        assert cache.hits == N - 1
+
+    finally:
+        shutil.rmtree(tmp)
+
+test()
+
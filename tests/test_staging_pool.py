@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# measure the throughput of agent input staging with and without the component
+# thread pool, on a slow filesystem.  The filesystem is simulated by adding
+# a fixed latency to every file copy.  The component is not started (no
+# channels), but its work method is called directly, and advanced units are
+# collected -- we check that every unit is advanced exactly once, after all its
+# input files are staged in order.
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+
+import radical.utils as ru
+
+import radical.pilot.states as rps
+import radical.pilot.agent.staging_input.default as sid
+
+from multiprocessing.pool import ThreadPool
+
+N       = 200
+FILES   = 4       # input files per unit
+LATENCY = 0.005   # seconds per copy
+BULK    = 64      # units per work call
+
+
+# ------------------------------------------------------------------------------
+#
+class SlowShutil(object):
+
+    def copyfile(self, src, tgt):
+        time.sleep(LATENCY)
+        shutil.copyfile(src, tgt)
+
+    def __getattr__(self, name):
+        return getattr(shutil, name)
+
+
+# ------------------------------------------------------------------------------
+#
+def component(tmp, threads):
+
+    comp = sid.Default.__new__(sid.Default)
+    comp._cfg      = {'workdir'        : tmp,
+                      'staging_area'   : 'staging_area',
+                      'staging_scheme' : 'staging'}
+    comp._log      = logging.getLogger('bench')
+    comp._prof     = ru.Profiler('bench')
+    comp._cache    = None
+    comp._cb_lock  = threading.RLock()
+    comp._pool     = ThreadPool(threads) if threads else None
+    comp._advanced = dict()
+
+    def advance(units, state, publish, push):
+        if not isinstance(units, list):
+            units = [units]
+        for cu in units:
+            comp._advanced.setdefault(cu['_id'], list()).append(state)
+            if state == rps.ALLOCATING_PENDING:
+                # the last input file is newest
+                mtimes = [os.stat('%s/input.%d' % (cu['workdir'], i)).st_mtime
+                          for i in range(FILES)]
+                assert mtimes == sorted(mtimes)
+    comp.advance = advance
+
+    return comp
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(tmp, threads):
+
+    comp  = component(tmp, threads)
+    units = list()
+    for i in range(N):
+        uid = 'unit.%06d.%d' % (i, threads)
+        sds = [{'source' : '%s/src/input.%d' % (tmp, j),
+                'target' : 'input.%d' % j,
+                'action' : 'Copy',
+                'flags'  : []} for j in range(FILES)]
+        units.append({'_id'                    : uid,
+                      'description'            : {},
+                      'Agent_Input_Directives' : sds})
+
+    start = time.time()
+    for i in range(0, N, BULK):
+        comp.work(units[i:i + BULK])
+    if comp._pool:
+        comp._pool.close()
+        comp._pool.join()
+    stop = time.time()
+
+    for cu in units:
+        assert comp._advanced[cu['_id']] == [rps.AGENT_STAGING_INPUT,
+                                             rps.ALLOCATING_PENDING], \
+               comp._advanced[cu['_id']]
+
+    return stop - start
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d units, %d files each" % (N, FILES)
+    print "delay : %.1fms per copy" % (LATENCY * 1000)
+
+    sid.shutil = SlowShutil()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        os.mkdir('%s/src' % tmp)
+        for j in range(FILES):
+            with open('%s/src/input.%d' % (tmp, j), 'w') as f:
+                f.write('input %d\n' % j)
+
+        for threads in [0, 4, 16]:
+            diff = bench(tmp, threads)
+            print "threads %2d : %6.2fs (%8.1f units/s)" \
+                % (threads, diff, N / diff)
+    finally:
+        shutil.rmtree(tmp)
+        sid.shutil = shutil
+
+test()
+
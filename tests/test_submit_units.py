@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# submit a large number of units, once as a list which is published first and
+# then assigned to the pilot and advanced unit by unit (like submit_units did
+# before), and once as a generator, which is scheduled and inserted as assigned
+# to the pilot in chunks.  Both run on a mongomock DB, with the round robin
+# scheduler and a single pilot.  We measure time and peak memory (the chunked
+# version runs first, as the peak memory is per process), and check that both
+# result in the same unit documents, and that the chunked units are reported to
+# the unit state callbacks.  Finally, we check that the units which are not
+# scheduled are reported once per call as wait queue size, not per chunk.
+
+import time
+import resource
+
+import radical.pilot.types  as rpt
+import radical.pilot.states as rps
+
+# connects the DB sessions to mongomock
+import mongomock_session as ms
+
+from radical.pilot.db                       import Session
+from radical.pilot.controller               import UnitManagerController
+from radical.pilot.unit_manager             import UnitManager
+from radical.pilot.scheduler                import RoundRobinScheduler
+from radical.pilot.compute_unit_description import ComputeUnitDescription
+
+N     = 4 * 1024      # units
+PILOT = 'pilot.0000'
+UMGR  = 'umgr.0000'
+
+
+# ------------------------------------------------------------------------------
+#
+class _Pilot(object):
+    uid      = PILOT
+    resource = 'local.localhost'
+    sandbox  = 'file://localhost/tmp/%s' % PILOT
+
+
+# ------------------------------------------------------------------------------
+#
+def umgr(name, synchronous):
+
+    dbs = Session('rp.session.%s' % name, name, 'mongodb://localhost/rp')
+    dbs._p.insert({'_id' : PILOT, 'sandbox' : _Pilot.sandbox})
+    dbs.unit_manager_add_pilots(UMGR, [PILOT])
+
+    session = ms.APISession(dbs)
+
+    # the unit manager without its constructor, which would start the
+    # controller thread and transfer workers
+    um = UnitManager.__new__(UnitManager)
+    um._session        = session
+    um._uid            = UMGR
+    um._rec_id         = 0
+    um._valid          = True
+    um.wait_queue_size = 0
+    um._worker         = UnitManagerController(UMGR, session,
+                                               input_transfer_workers=0,
+                                               output_transfer_workers=0)
+    um._scheduler      = RoundRobinScheduler(um, session)
+    um._scheduler.synchronous = synchronous
+    um._scheduler.pilot_added(_Pilot())
+
+    # the controller's run loop is not started, the units are only published
+    um._worker._initialized.set()
+
+    return um
+
+
+# ------------------------------------------------------------------------------
+#
+def descriptions():
+
+    for i in range(N):
+        cud = ComputeUnitDescription()
+        cud.executable     = '/bin/echo'
+        cud.arguments      = [str(i)]
+        cud.input_staging  = ['input.dat']
+        cud.output_staging = ['output.dat']
+        yield cud
+
+
+# ------------------------------------------------------------------------------
+#
+def docs(um):
+
+    ret = list()
+    for doc in um._worker._dbs._w.find():
+        ret.append([doc['description']['arguments'], doc['pilot'],
+                    doc['pilot_sandbox'], doc['state'],
+                    doc['sandbox'] == '%s/%s' % (doc['pilot_sandbox'], doc['_id']),
+                    doc['FTW_Input_Directives'],
+                    doc['Agent_Output_Directives']])
+    return sorted(ret)
+
+
+# ------------------------------------------------------------------------------
+#
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ------------------------------------------------------------------------------
+#
+def check_wait_queue():
+
+    um      = umgr('waitq', True)
+    waitq   = list()
+    um._worker.register_manager_callback(
+            lambda umgr, size: waitq.append(size), rpt.WAIT_QUEUE_SIZE)
+
+    # leave every other unit unscheduled
+    schedule = um._scheduler.schedule
+
+    def schedule_half(units):
+        ret = schedule(units)
+        for unit in units[::2]:
+            ret['units'][unit] = None
+        return ret
+
+    um._scheduler.schedule = schedule_half
+
+    um.submit_units(descriptions())
+    assert waitq == [N / 2], waitq
+    assert um.wait_queue_size == N / 2
+
+    um._worker._dbs.delete()
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n       : %d units" % N
+
+    res = dict()
+    for name, synchronous, uds in [['chunked', True,  descriptions()],
+                                   ['list',    False, list(descriptions())]]:
+
+        um    = umgr(name, synchronous)
+        seen  = list()
+        um._worker.register_manager_callback(
+                lambda unit, state: seen.append([unit.uid, state]), rpt.UNIT_STATE)
+
+        start = time.time()
+        units = um.submit_units(uds)
+        stop  = time.time()
+        print "%-8s: %6.2fs  %4d MB peak" % (name, stop - start, maxrss())
+
+        assert len(units) == N
+        assert len(um._worker._shared_data) == N
+
+        # the chunked units are published as assigned to the pilot, so the
+        # controller knows their state without pulling them again
+        if synchronous:
+            for unit in units:
+                assert unit.state == rps.PENDING_INPUT_STAGING
+            assert sorted(seen) == sorted([[unit.uid, rps.PENDING_INPUT_STAGING]
+                                           for unit in units])
+
+        res[name] = docs(um)
+        um._worker._dbs.delete()
+
+    assert res['chunked'] == res['list']
+    assert res['chunked'][0][3:5] == [rps.PENDING_INPUT_STAGING, True]
+
+    check_wait_queue()
+
+test()
+
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+# compare reading the tail of a large unit output file by reading and decoding
+# the whole file (the old agent output staging), and via rpu.tail_file().
+
+import os
+import time
+import tempfile
+
+import radical.pilot.utils as rpu
+
+SIZE = 256   # MB
+
+
+# ------------------------------------------------------------------------------
+#
+def read_all(path):
+
+    with open(path, 'r') as f:
+        try:
+            txt = unicode(f.read(), "utf-8")
+        except UnicodeDecodeError:
+            return None
+    return rpu.tail(txt)
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "size  : %d MB" % SIZE
+
+    fd, path = tempfile.mkstemp()
+    try:
+        line = 'some unit output line with a counter: %08d\n'
+        with os.fdopen(fd, 'w') as f:
+            for i in xrange(SIZE * 1024 * 1024 / len(line % 0)):
+                f.write(line % i)
+
+        for name, func in [['read ', read_all], ['tail ', rpu.tail_file]]:
+            start = time.time()
+            txt   = func(path)
+            stop  = time.time()
+            print "%s : %8.4fs" % (name, stop - start)
+
+        assert read_all(path) == rpu.tail_file(path)
+
+    finally:
+        os.unlink(path)
+
+test()
+
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+# compare the unit manager's full unit pull (all unit documents) with the pull
+# of changed units only (units stamped 'modified' since the last pull), on
+# a mongomock DB.  The unit manager controller runs its pull loop, and in every
+# cycle a small fraction of the units advance their state (final units also get
+# stdout and stderr).  We measure time and data volume of the controller's
+# pulls and of a full pull, and check that the controller reports exactly the
+# advanced units, and that final units are not pulled again after the
+# controller published their callback history.
+
+import json
+import time
+
+import radical.pilot.states as rps
+
+# connects the DB sessions to mongomock
+import mongomock_session as ms
+
+from radical.pilot.db         import Session
+from radical.pilot.controller import UnitManagerController
+
+SIZES   = [10 * 1000, 100 * 1000]  # units per session
+CYCLES  = 3                        # advancing slices per session
+CHANGE  = 0.01                     # fraction of units advancing per cycle
+TIMEOUT = 600                      # max seconds to wait for the controller
+UMGR    = 'umgr.0000'
+STATES  = [rps.AGENT_STAGING_INPUT_PENDING,
+           rps.EXECUTING,
+           rps.AGENT_STAGING_OUTPUT_PENDING,
+           rps.DONE]
+
+
+# ------------------------------------------------------------------------------
+#
+def unit(i):
+
+    ts = time.time()
+    return {'_id'          : 'unit.%06d' % i,
+            'description'  : {'executable' : '/bin/sleep',
+                              'arguments'  : ['10'],
+                              'cores'      : 1},
+            'unitmanager'  : UMGR,
+            'pilot'        : 'pilot.0000',
+            'state'        : rps.PENDING_INPUT_STAGING,
+            'statehistory' : [{'state' : rps.PENDING_INPUT_STAGING,
+                               'timestamp' : ts}],
+            'log'          : [],
+            'stdout'       : None,
+            'stderr'       : None}
+
+
+# ------------------------------------------------------------------------------
+#
+def advance(dbs, uids, state):
+
+    # the units are a consecutive range of uids
+    ts     = time.time()
+    query  = {'_id' : {'$gte' : uids[0], '$lte' : uids[-1]}}
+    update = {'state' : state}
+    if state == rps.DONE:
+        update['stdout'] = 'out ' * 256
+        update['stderr'] = 'err ' * 64
+
+    dbs.change_compute_units(query, update,
+                             {'statehistory' : {'state'     : state,
+                                                'timestamp' : ts}})
+
+
+# ------------------------------------------------------------------------------
+#
+def pull(func, *args, **kwargs):
+
+    start = time.time()
+    units = func(*args, **kwargs)
+    stop  = time.time()
+    size  = sum([len(json.dumps(u, default=str)) for u in units])
+
+    return units, stop - start, size / 1024.0 / 1024.0
+
+
+# ------------------------------------------------------------------------------
+#
+def notified(ctrl):
+    """
+    the number of state notifications the controller made per unit
+    """
+    return dict([[uid, len(hist)] for uid, hist
+                                  in ctrl._callback_histories.items()])
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(n):
+
+    sid = 'rp.session.%d' % n
+    dbs = Session(sid, sid, 'mongodb://localhost/rp')
+    dbs._w.insert_many([unit(i) for i in range(n)])
+
+    # record the controller's pulls: [units, time, MB]
+    pulls   = list()
+    changes = dbs.get_compute_unit_changes
+
+    def get_compute_unit_changes(*args, **kwargs):
+        units, t, s = pull(changes, *args, **kwargs)
+        pulls.append([len(units), t, s])
+        return units
+
+    dbs.get_compute_unit_changes = get_compute_unit_changes
+
+    # the controller's first pull gets all units
+    ctrl = UnitManagerController(UMGR, ms.APISession(dbs),
+                                 input_transfer_workers=0,
+                                 output_transfer_workers=0)
+    ctrl.start()
+    try:
+        assert ctrl._initialized.wait(TIMEOUT)
+
+        uids = sorted(ctrl._shared_data.keys())
+        step = int(n * CHANGE)
+
+        assert len(uids) == n
+        assert notified(ctrl) == dict([[uid, 1] for uid in uids])
+
+        print "n     : %d units, %d advancing per cycle" % (n, step)
+
+        for cycle in range(CYCLES):
+
+            before = notified(ctrl)
+            first  = len(pulls)
+
+            # the next slice of units advance through all states
+            changed = uids[cycle * step:(cycle + 1) * step]
+            for state in STATES:
+                advance(dbs, changed, state)
+
+            assert not ctrl.wait_units(changed, [rps.DONE], timeout=TIMEOUT)
+
+            # the controller reported the advanced units only, and only once as
+            # final
+            after = notified(ctrl)
+            seen  = [uid for uid in uids if after[uid] != before[uid]]
+            assert seen == changed
+            for uid in changed:
+                states = [h['state'] for h in ctrl._callback_histories[uid]]
+                assert states.count(rps.DONE) == 1
+
+            # the callback history of the final units is not stamped as
+            # a change, so they won't be pulled again
+            for doc in dbs._w.find({'_id' : {'$in' : changed}}):
+                data = ctrl.get_compute_unit_data(doc['_id'])
+                assert doc['modified'] == data['modified']
+                assert 'callbackhistory' in doc
+                assert 'stdout' not in data
+
+            _, t_full, s_full = pull(dbs.get_compute_units, UMGR)
+
+            delta   = pulls[first:]
+            t_delta = sum([p[1] for p in delta])
+            s_delta = sum([p[2] for p in delta])
+            print "  %d full : %7.2fs  %8.1f MB" % (cycle, t_full,  s_full)
+            print "  %d delta: %7.2fs  %8.1f MB  (%d pulls, %d units pulled)" \
+                % (cycle, t_delta, s_delta, len(delta),
+                   sum([p[0] for p in delta]))
+
+    finally:
+        # the controller thread would keep us alive
+        ctrl.stop()
+
+    # no more notifications after all slices arrived
+    assert notified(ctrl) == after
+
+    dbs.delete()
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    for n in SIZES:
+        bench(n)
+
+test()
+
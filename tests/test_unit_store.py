@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# measure the message size per unit and hop between agent components, with
+# full units and with unit store envelopes.  The units pass the same hops as in
+# the agent (agent -> staging input -> scheduler -> executor -> staging
+# output), and every hop changes the unit like the respective component does
+# (the clone hop modifies the unit in place).  We check that the units arriving
+# at the end are the same either way.
+
+import os
+import copy
+import time
+import shutil
+import tempfile
+
+import radical.pilot.utils as rpu
+
+N     = 10000
+NODES = 4       # nodes in the unit's slot list
+CORES = 16      # cores per node
+
+
+# ------------------------------------------------------------------------------
+#
+def unit(i):
+
+    uid = 'unit.%06d' % i
+    sds = [{'source' : 'pilot:///input/data.%03d.dat' % j,
+            'target' : 'data.%03d.dat' % j,
+            'action' : 'Copy',
+            'flags'  : ['CreateParents']} for j in range(8)]
+
+    return {'_id'          : uid,
+            'pilot'        : 'pilot.0000',
+            'state'        : 'AgentStagingInputPending',
+            'description'  : {'name'           : 'md.%06d' % i,
+                              'executable'     : '/usr/bin/gmx_mpi',
+                              'arguments'      : ['mdrun', '-s', 'topol.tpr',
+                                                  '-deffnm', 'md', '-nsteps',
+                                                  '50000', '-maxh', '0.5'],
+                              'environment'    : {'OMP_NUM_THREADS' : '1'},
+                              'cores'          : NODES * CORES,
+                              'mpi'            : True,
+                              'pre_exec'       : ['module load gromacs/5.1'],
+                              'post_exec'      : [],
+                              'input_staging'  : sds,
+                              'output_staging' : []},
+            'Agent_Input_Directives'  : sds,
+            'Agent_Output_Directives' : []}
+
+
+# ------------------------------------------------------------------------------
+#
+def staging_input(cu):
+    cu['state']       = 'AllocatingPending'
+    cu['workdir']     = '/scratch/pilot.0000/%s' % cu['_id']
+    cu['stdout_file'] = '%s/STDOUT' % cu['workdir']
+    cu['stderr_file'] = '%s/STDERR' % cu['workdir']
+    cu['gtod']        = '/scratch/pilot.0000/gtod'
+    cu['stdout']      = ''
+    cu['stderr']      = ''
+
+def scheduler(cu):
+    cu['state']        = 'ExecutingPending'
+    cu['opaque_slots'] = {'task_slots'   : ['node%04d:%d' % (n, c)
+                                            for n in range(NODES)
+                                            for c in range(CORES)],
+                          'task_offsets' : [n * CORES for n in range(NODES)],
+                          'lm_info'      : {}}
+
+def clone(cu):
+    # like the scheduler's clone callback, which changes the slots in place
+    cu['opaque_slots']['task_slots'][0] = 'node%04d:%d' % (NODES, 0)
+
+def executor(cu):
+    cu['state']     = 'AgentStagingOutputPending'
+    cu['pid']       = 12345
+    cu['exit_code'] = 0
+    cu['rusage']    = {'utime' : 1.5, 'stime' : 0.1, 'maxrss' : 20480}
+
+HOPS = [staging_input, scheduler, clone, executor]
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(units, ser, store):
+
+    nbytes = 0
+    start  = time.time()
+
+    msgs = list()
+    for cu in units:
+        msg     = store.put(cu) if store else cu
+        data    = ser.dumps(msg)
+        nbytes += len(data)
+        msgs.append(data)
+
+    for hop in HOPS:
+        out = list()
+        for data in msgs:
+            cu = ser.loads(data)
+            if store:
+                cu = store.get(cu)
+            hop(cu)
+            msg     = store.put(cu) if store else cu
+            data    = ser.dumps(msg)
+            nbytes += len(data)
+            out.append(data)
+        msgs = out
+
+    res = [ser.loads(data) for data in msgs]
+    if store:
+        res = [store.get(cu) for cu in res]
+        for cu in res:
+            del(cu['_store'])
+
+    stop = time.time()
+
+    return res, nbytes / len(units) / (len(HOPS) + 1), stop - start
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d units, %d hops" % (N, len(HOPS) + 1)
+
+    ser = rpu.Serializer.create(rpu.SERIALIZER_MSGPACK)
+    tmp = tempfile.mkdtemp()
+
+    try:
+        store = rpu.UnitStore('%s/unit.store' % tmp, ser)
+
+        ref, size, diff = bench([unit(i) for i in range(N)], ser, None)
+        print "full  : %6d bytes per unit and hop  %6.2fs" % (size, diff)
+
+        res, size, diff = bench([unit(i) for i in range(N)], ser, store)
+        print "store : %6d bytes per unit and hop  %6.2fs  (store: %d bytes per unit)" \
+            % (size, diff, os.path.getsize('%s/unit.store' % tmp) / N)
+
+        assert res == ref
+        store.close()
+
+    finally:
+        shutil.rmtree(tmp)
+
+test()
+
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# summarize a large number of final units (state, exit code, times, stdout,
+# stderr, log), on a mongomock DB.  The unit manager controller keeps the small
+# unit fields in memory, and pulls the large fields (stdout, stderr, log) in
+# bulk for many final units at once.  We compare that with pulling the full
+# unit document per unit (as the unit properties did before), on a sample of
+# the units, and check that both result in the same summary.  Note that
+# mongomock does not use indexes, so every query scans all units.
+
+import time
+
+import radical.pilot.states as rps
+
+# connects the DB sessions to mongomock
+import mongomock_session as ms
+
+from radical.pilot.db           import Session
+from radical.pilot.controller   import UnitManagerController
+from radical.pilot.compute_unit import ComputeUnit
+
+N      = 10 * 1000   # units
+SAMPLE = 100         # units to summarize with full documents
+UMGR   = 'umgr.0000'
+
+
+# ------------------------------------------------------------------------------
+#
+def unit(i):
+
+    ts = time.time()
+    return {'_id'          : 'unit.%06d' % i,
+            'description'  : {'executable' : '/bin/echo',
+                              'arguments'  : [str(i)],
+                              'cores'      : 1},
+            'unitmanager'  : UMGR,
+            'pilot'        : 'pilot.0000',
+            'sandbox'      : '/tmp/unit.%06d' % i,
+            'state'        : rps.DONE,
+            'statehistory' : [{'state' : s, 'timestamp' : ts}
+                              for s in [rps.NEW, rps.EXECUTING, rps.DONE]],
+            'submitted'    : ts,
+            'started'      : ts + 1,
+            'finished'     : ts + 2,
+            'exec_locs'    : ['node_1:0'],
+            'exit_code'    : i % 2,
+            'stdout'       : 'out %d\n' % i * 64,
+            'stderr'       : 'err %d\n' % i * 16,
+            'log'          : [{'message' : 'unit done', 'timestamp' : ts}]}
+
+
+# ------------------------------------------------------------------------------
+#
+def summary_full(dbs, uids):
+    """
+    pull the full unit document for each unit property
+    """
+
+    ret = list()
+    for uid in uids:
+        doc = lambda: list(dbs._w.find({'_id' : uid}))[0]
+        ret.append([uid, doc()['state'], doc()['exit_code'],
+                    doc()['started'], doc()['finished'],
+                    len(doc()['stdout']), len(doc()['stderr']),
+                    len(doc()['log'])])
+    return ret
+
+
+# ------------------------------------------------------------------------------
+#
+def summary(units):
+
+    ret = list()
+    for u in units:
+        ret.append([u.uid, u.state, u.exit_code, u.start_time, u.stop_time,
+                    len(u.stdout), len(u.stderr), len(u.log)])
+    return ret
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d units" % N
+
+    dbs = Session('rp.session.summary', 'summary', 'mongodb://localhost/rp')
+    dbs._w.insert_many([unit(i) for i in range(N)])
+
+    start = time.time()
+    ctrl  = UnitManagerController(UMGR, ms.APISession(dbs),
+                                  input_transfer_workers=0,
+                                  output_transfer_workers=0)
+    ctrl.start()
+    ctrl._initialized.wait()
+    print "pull  : %6.2fs" % (time.time() - start)
+
+    units = list()
+    for i in range(N):
+        u = ComputeUnit()
+        u._uid    = 'unit.%06d' % i
+        u._worker = ctrl
+        units.append(u)
+
+    start = time.time()
+    ref   = summary_full(dbs, [u.uid for u in units[:SAMPLE]])
+    stop  = time.time()
+    print "full  : %6.2fs for %d units  (%6.2fs for %d units)" \
+        % (stop - start, SAMPLE, (stop - start) * N / SAMPLE, N)
+
+    start = time.time()
+    res   = summary(units)
+    stop  = time.time()
+    print "cache : %6.2fs for %d units" % (stop - start, N)
+
+    assert res[:SAMPLE] == ref
+    assert len(res) == N
+
+    ctrl.stop()
+    dbs.delete()
+
+test()
+
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# compare the update worker's merged bulks with plain bulks (one update per
+# state message), on a mongomock collection.  Each unit goes through a number
+# of states within one bulk window, and the final state carries stdout and
+# stderr.  We compare the number of DB operations, the time to push, and check
+# that both approaches result in the same documents.
+
+import time
+
+import mongomock
+
+import radical.pilot.states as rps
+
+from radical.pilot.worker.update import UpdateBulk
+
+N      = 1000
+GROUP  = 100    # units which move through the agent together
+FLUSH  = 1024   # messages per bulk
+STATES = [rps.ALLOCATING_PENDING,
+          rps.ALLOCATING,
+          rps.EXECUTING_PENDING,
+          rps.EXECUTING,
+          rps.AGENT_STAGING_OUTPUT_PENDING,
+          rps.DONE]
+
+
+# ------------------------------------------------------------------------------
+#
+def messages():
+
+    msgs = list()
+    for i in range(N):
+        uid = 'unit.%06d' % i
+        for state in STATES:
+            update_dict = {'$set'  : {'state' : state},
+                           '$push' : {'statehistory' : {'state'     : state,
+                                                        'timestamp' : time.time()}}}
+            if state == rps.DONE:
+                update_dict['$set']['stdout']    = 'out ' * 64
+                update_dict['$set']['stderr']    = ''
+                update_dict['$set']['exit_code'] = 0
+            msgs.append([uid, state, update_dict])
+
+    # units move through the agent in groups, and their states interleave
+    msgs.sort(key=lambda m: [int(m[0].split('.')[1]) / GROUP, STATES.index(m[1]), m[0]])
+    return msgs
+
+
+# ------------------------------------------------------------------------------
+#
+def push(coll, ops):
+
+    bulk = coll.initialize_ordered_bulk_op()
+    for query_dict, update_dict in ops:
+        bulk.find(query_dict).update(update_dict)
+    bulk.execute()
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_plain(coll, msgs):
+
+    nops = 0
+    for i in range(0, len(msgs), FLUSH):
+        ops = [[{'_id' : uid}, update_dict] for uid, _, update_dict in msgs[i:i + FLUSH]]
+        push(coll, ops)
+        nops += len(ops)
+    return nops
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_merged(coll, msgs):
+
+    nops = 0
+    for i in range(0, len(msgs), FLUSH):
+        bulk = UpdateBulk()
+        for uid, state, update_dict in msgs[i:i + FLUSH]:
+            bulk.add(uid, state, {'_id' : uid}, update_dict)
+        ops = bulk.ops()
+        push(coll, ops)
+        nops += len(ops)
+    return nops
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d units, %d messages" % (N, N * len(STATES))
+
+    msgs  = messages()
+    colls = dict()
+
+    for name, bench in [['plain ', bench_plain], ['merged', bench_merged]]:
+
+        coll = mongomock.MongoClient().db[name.strip()]
+        coll.insert_many([{'_id' : 'unit.%06d' % i} for i in range(N)])
+        colls[name] = coll
+
+        start = time.time()
+        nops  = bench(coll, msgs)
+        stop  = time.time()
+
+        print "%s: %6.2fs  %7d ops  (%8.1f msgs/s)" \
+            % (name, stop - start, nops, len(msgs) / (stop - start))
+
+    plain  = sorted(colls['plain ' ].find(), key=lambda d: d['_id'])
+    merged = sorted(colls['merged'].find(), key=lambda d: d['_id'])
+    assert plain == merged
+    assert all([doc['state'] == rps.DONE for doc in merged])
+    assert all([len(doc['statehistory']) == len(STATES) for doc in merged])
+
+test()
+
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# replay shuffled unit state streams through the update worker's state
+# ordering, and compare the pushed states with the original ordering
+# implementation.  We also check that the pushed states per unit are ordered,
+# that every unit ends up in the state in which it left the agent, and that the
+# ordering state does not grow with the number of units, as long as the bulks
+# are flushed.  Most units leave the agent in PENDING_OUTPUT_STAGING, the others
+# in a final state.
+
+import random
+import collections
+
+import radical.pilot.states as rps
+
+from radical.pilot.worker.update import Update
+
+N       = 100000
+WINDOW  = 100     # number of units in flight
+FLUSH   = 1000    # number of messages per bulk
+STATES  = [rps.AGENT_STAGING_INPUT,
+           rps.ALLOCATING_PENDING,
+           rps.ALLOCATING,
+           rps.EXECUTING_PENDING,
+           rps.EXECUTING,
+           rps.AGENT_STAGING_OUTPUT_PENDING,
+           rps.AGENT_STAGING_OUTPUT,
+           rps.PENDING_OUTPUT_STAGING]
+FINAL   = [rps.DONE, rps.FAILED, rps.CANCELED]
+P_FINAL = 0.1    # fraction of units which leave the agent in a final state
+
+
+# ------------------------------------------------------------------------------
+#
+class ListOrdering(object):
+    """
+    the original state ordering of the update worker (minus the history)
+    """
+
+    s2i = {rps.AGENT_STAGING_INPUT_PENDING  : 10,
+           rps.AGENT_STAGING_INPUT          : 11,
+           rps.ALLOCATING_PENDING           : 12,
+           rps.ALLOCATING                   : 13,
+           rps.EXECUTING_PENDING            : 14,
+           rps.EXECUTING                    : 15,
+           rps.AGENT_STAGING_OUTPUT_PENDING : 16,
+           rps.AGENT_STAGING_OUTPUT         : 17,
+           rps.PENDING_OUTPUT_STAGING       : 18,
+           rps.STAGING_OUTPUT               : 19,
+           rps.DONE                         : 20,
+           rps.CANCELING                    : 21,
+           rps.CANCELED                     : 22,
+           rps.FAILED                       : 23}
+    i2s = dict([[v, k] for k, v in s2i.iteritems()])
+
+    def __init__(self):
+        self.cache = dict()
+
+    def update(self, uid, state):
+        if uid not in self.cache:
+            self.cache[uid] = {'unsent' : list(),
+                               'final'  : False,
+                               'last'   : rps.AGENT_STAGING_INPUT_PENDING}
+        cache = self.cache[uid]
+        if cache['final']:
+            return None
+        if state in FINAL:
+            cache['final'] = True
+            return state
+        cache['unsent'].append(state)
+        new_state = None
+        for i in range(self.s2i[cache['last']] + 1, self.s2i[rps.FAILED]):
+            if self.i2s[i] in cache['unsent']:
+                new_state = self.i2s[i]
+                cache['unsent'].remove(new_state)
+            else:
+                break
+        if new_state:
+            cache['last'] = new_state
+        return new_state
+
+
+# ------------------------------------------------------------------------------
+#
+def stream():
+    """
+    Yield [uid, state] pairs for N units, with WINDOW units in flight at any
+    time.  The states of each unit arrive in random order, but the state in
+    which the unit leaves the agent always arrives last.
+    """
+
+    random.seed(42)
+    active = list()
+    nxt    = 0
+
+    while nxt < N or active:
+
+        while nxt < N and len(active) < WINDOW:
+            states = list(STATES[:-1])
+            random.shuffle(states)
+            if random.random() < P_FINAL:
+                states.append(random.choice(FINAL))
+            else:
+                states.append(rps.PENDING_OUTPUT_STAGING)
+            active.append(['unit.%06d' % nxt, states])
+            nxt += 1
+
+        idx = random.randrange(len(active))
+        uid, states = active[idx]
+        yield uid, states.pop(0)
+
+        if not states:
+            active[idx] = active[-1]
+            active.pop()
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n      : %d" % N
+    print "window : %d" % WINDOW
+
+    worker = Update.__new__(Update)
+    worker._state_cache = dict()
+    worker._final_cache = collections.OrderedDict()
+    worker._final_size  = 10 * WINDOW
+
+    ref    = ListOrdering()
+    pushed = dict()
+    bulk   = list()
+    peak   = 0
+
+    for uid, state in stream():
+
+        res   = worker._ordered_update({'_id' : uid}, state, 1.0)
+        check = ref.update(uid, state)
+
+        new = res.get('$set', {}).get('state')
+        assert new == check, '%s: %s != %s' % (uid, new, check)
+
+        if new:
+            pushed.setdefault(uid, list()).append(new)
+
+        bulk.append(uid)
+        if len(bulk) >= FLUSH:
+            worker._evict(bulk)
+            bulk = list()
+
+        peak = max(peak, len(worker._state_cache))
+
+    worker._evict(bulk)
+
+    for uid, states in pushed.iteritems():
+        ranks = [STATES.index(s) if s in STATES else len(STATES) for s in states]
+        assert ranks == sorted(ranks), '%s: %s' % (uid, states)
+        assert states[-1] in FINAL + [rps.PENDING_OUTPUT_STAGING], \
+               '%s: %s' % (uid, states)
+
+    print "pushed : %d units" % len(pushed)
+    print "peak   : %d units tracked" % peak
+    print "final  : %d units tracked, %d remembered as final" \
+        % (len(worker._state_cache), len(worker._final_cache))
+
+    assert len(pushed) == N
+    assert not worker._state_cache
+    assert peak <= WINDOW + FLUSH
+    assert len(worker._final_cache) <= worker._final_size
+
+test()
+
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Simulate the agent scheduler on a synthetic workload, without any LRMS or
+# agent components: units are allocated on a CoreMap, wait in a WaitPool if
+# they don't fit, and the pool is rescheduled whenever a unit completes.  We
+# compare the FIFO and backfill policies of the wait pool, for a mix of small
+# and large units.
+
+import time
+import heapq
+import random
+
+from radical.pilot.agent.scheduler.core_map  import CoreMap
+from radical.pilot.agent.scheduler.wait_pool import WaitPool
+
+NODES = 64
+CPN   = 32
+N     = 20000
+MIX   = [[1, 0.9, 60.0], [64, 0.1, 300.0]]  # cores, fraction, mean runtime
+
+
+# ------------------------------------------------------------------------------
+#
+def workload():
+
+    random.seed(42)
+    units = list()
+    for i in range(N):
+        r   = random.random()
+        acc = 0.0
+        for cores, frac, runtime in MIX:
+            acc += frac
+            if r <= acc:
+                break
+        units.append({'_id'     : 'unit.%06d' % i,
+                      'cores'   : cores,
+                      'runtime' : random.expovariate(1.0 / runtime)})
+    return units
+
+
+# ------------------------------------------------------------------------------
+#
+def simulate(backfill):
+
+    cmap   = CoreMap(['node_%03d' % i for i in range(NODES)], CPN)
+    pool   = WaitPool(backfill=backfill)
+    events = list()   # heap of [end time, uid, unit]
+    stats  = {'tries' : 0, 'busy' : 0.0}
+    now    = [0.0]
+
+    def allocate(unit):
+        stats['tries'] += 1
+        offset = cmap.find(unit['cores'], unit['cores'] <= CPN)
+        if offset is None:
+            return False
+        cmap.set_busy(offset, unit['cores'])
+        unit['offset'] = offset
+        unit['start']  = now[0]
+        heapq.heappush(events, [now[0] + unit['runtime'], unit['_id'], unit])
+        return True
+
+    # all units arrive at t=0 -- they are placed right away or have to wait
+    units = workload()
+    for unit in units:
+        if not allocate(unit):
+            pool.add(unit, unit['cores'])
+
+    start = time.time()
+    while events:
+        now[0], _, unit = heapq.heappop(events)
+        cmap.set_free(unit['offset'], unit['cores'])
+        stats['busy'] += unit['cores'] * unit['runtime']
+        pool.schedule(allocate, cmap.free)
+    stop = time.time()
+
+    assert not len(pool)
+
+    makespan = now[0]
+    util     = stats['busy'] / (makespan * NODES * CPN)
+    print "%-8s: makespan %9.1f  util %5.1f%%  tries %8d  sim %6.2fs" \
+        % ('backfill' if backfill else 'fifo', makespan, 100 * util,
+           stats['tries'], stop - start)
+
+    for cores, _, _ in MIX:
+        waits = sorted([u['start'] for u in units if u['cores'] == cores])
+        print "          %3d cores: %6d units  wait avg %9.1f  max %9.1f" \
+            % (cores, len(waits), sum(waits) / len(waits), waits[-1])
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d" % N
+    print "cores : %d" % (NODES * CPN)
+
+    simulate(backfill=False)
+    simulate(backfill=True)
+
+test()
+
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# wait for a large number of units to become final, once by checking all unit
+# states periodically (like wait_units did before), and once by waiting for the
+# unit manager controller's state notifications.  An 'agent' thread finishes
+# the units in batches, updates the controller's unit data and notifies the
+# waiters (like the controller's run loop does).  We measure the CPU time used
+# while waiting, and the latency between the last unit becoming final and the
+# wait returning.
+
+import time
+import threading
+
+import radical.pilot.states as rps
+
+# connects the DB sessions to mongomock
+import mongomock_session as ms
+
+from radical.pilot.db         import Session
+from radical.pilot.controller import UnitManagerController
+
+N      = 100 * 1000   # units
+BATCH  = 1000         # units finishing at once
+PAUSE  = 0.05         # time between batches
+FINAL  = [rps.DONE, rps.FAILED, rps.CANCELED]
+UMGR   = 'umgr.0000'
+
+
+# ------------------------------------------------------------------------------
+#
+def controller(name):
+
+    dbs  = Session('rp.session.%s' % name, name, 'mongodb://localhost/rp')
+    ctrl = UnitManagerController(UMGR, ms.APISession(dbs),
+                                 input_transfer_workers=0,
+                                 output_transfer_workers=0)
+
+    # the run loop is not started, we fill in the units ourself
+    for i in range(N):
+        uid = 'unit.%06d' % i
+        ctrl._shared_data[uid] = {'data'          : {'_id'   : uid,
+                                                     'state' : rps.EXECUTING},
+                                  'callbacks'     : [],
+                                  'facade_object' : None}
+    ctrl._initialized.set()
+
+    return ctrl
+
+
+# ------------------------------------------------------------------------------
+#
+def agent(ctrl, uids, done):
+
+    for i in range(0, len(uids), BATCH):
+        time.sleep(PAUSE)
+        changes = list()
+        for uid in uids[i:i + BATCH]:
+            ctrl._shared_data[uid]['data'] = {'_id' : uid, 'state' : rps.DONE}
+            changes.append([uid, rps.DONE])
+        ctrl._notify_waiters(changes)
+
+    done.append(time.time())
+
+
+# ------------------------------------------------------------------------------
+#
+def wait_polling(ctrl, uids):
+    """
+    the original wait_units loop
+    """
+
+    checked  = dict([[uid, False] for uid in uids])
+    to_check = uids
+    while to_check:
+        for uid in to_check:
+            if ctrl.get_compute_unit_data(uid)['state'] in FINAL:
+                checked[uid] = True
+        to_check = [uid for uid in checked if not checked[uid]]
+        if to_check:
+            time.sleep(0.5)
+
+
+# ------------------------------------------------------------------------------
+#
+def wait_notified(ctrl, uids):
+
+    arrived = list()
+    pending = ctrl.wait_units(uids, FINAL,
+                              arrived_cb=lambda uid, state: arrived.append(uid))
+    assert not pending
+    assert sorted(arrived) == uids
+
+
+# ------------------------------------------------------------------------------
+#
+def test():
+
+    print "n     : %d units, %d per batch" % (N, BATCH)
+
+    for name, wait in [['polling ', wait_polling], ['notified', wait_notified]]:
+
+        ctrl = controller(name.strip())
+        uids = sorted(ctrl._shared_data.keys())
+        done = list()
+        thr  = threading.Thread(target=agent, args=[ctrl, uids, done])
+
+        cpu  = time.clock()
+        thr.start()
+        wait(ctrl, uids)
+        stop = time.time()
+        cpu  = time.clock() - cpu
+        thr.join()
+
+        print "%s: %6.2fs cpu  %6.3fs latency" % (name, cpu, stop - done[0])
+
+        ctrl._dbs.delete()
+
+    # a wait which times out returns the units which did not arrive
+    ctrl  = controller('timeout')
+    uids  = sorted(ctrl._shared_data.keys())
+    start = time.time()
+    assert ctrl.wait_units(uids[:10], FINAL, timeout=0.5) == set(uids[:10])
+    assert 0.5 <= time.time() - start < 1.0
+    ctrl._dbs.delete()
+
+test()
+